@@ -26,6 +26,15 @@ SECRET_KEY = "django-insecure-!phh3n1gd^k$w+wy@+1)8elp3f&r_cwh4t9=is1nl-$l$g$y!6
 # Encryption key for database
 FIELD_ENCRYPTION_KEY = "eqZklcJ7rvGDJ813zaSUr3KqbnRVxu6xTE6l3A72WIM="  # this is for demo only, in real project you would do: os.environ.get('DAWN_DATABASE_ENCRYPTION_KEY', '')
 
+# HMAC key for the searchable blind indexes of encrypted fields, must differ from FIELD_ENCRYPTION_KEY
+BLIND_INDEX_KEY = "6wQd0Yh3Jm8vTzR2kLp9sXb4NcFgUa7e"  # this is for demo only, in real project you would do: os.environ.get('DAWN_BLIND_INDEX_KEY', '')
+
+# Bearer tokens of the clients of the /api/ endpoints (e.g. the mediation layer), see matsecom/api.py
+API_TOKENS = ["demo-mediation-token-9c1e5d7a"]  # this is for demo only, in real project you would do: os.environ.get('DAWN_API_TOKENS', '').split()
+
+# Bearer tokens of the Prometheus scrapers of /metrics (staff users can open it without one), see matsecom/metrics.py
+METRICS_TOKENS = ["demo-metrics-token-4b8f2e61"]  # this is for demo only, in real project you would do: os.environ.get('DAWN_METRICS_TOKENS', '').split()
+
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = False
@@ -53,6 +62,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "matsecom.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     'whitenoise.middleware.WhiteNoiseMiddleware',
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -95,6 +105,81 @@ DATABASES = {
     }
 }
 
+# DAWN_DATABASE=sqlite-production keeps the SQLite file, but with a connection profile for several gunicorn workers
+# (see matsecom/backends/sqlite3): WAL journal, so reads don't wait for the writer, IMMEDIATE write transactions,
+# which wait busy_timeout for the write lock instead of failing with "database is locked", and persistent
+# connections. manage.py benchmark_sqlite_profile compares it with the default profile
+SQLITE_PRODUCTION_DATABASE = {
+    "ENGINE": "matsecom.backends.sqlite3",
+    "NAME": BASE_DIR / "db.sqlite3",
+    "OPTIONS": {
+        "transaction_mode": "IMMEDIATE",
+        "pragmas": {
+            "journal_mode": "WAL",
+            # a commit doesn't wait for the disk in WAL mode, a power loss can lose the last transactions but never
+            # corrupts the database
+            "synchronous": "NORMAL",
+            "busy_timeout": 10000,  # ms
+            "cache_size": -65536,  # KiB, i.e. 64 MiB page cache per connection
+            "mmap_size": 268435456,  # 256 MiB
+            "temp_store": "MEMORY",
+        },
+    },
+    "CONN_MAX_AGE": 600,
+    "CONN_HEALTH_CHECKS": True,
+}
+if os.environ.get('DAWN_DATABASE') == 'sqlite-production':
+    DATABASES = {"default": SQLITE_PRODUCTION_DATABASE}
+
+# DAWN_DATABASE=postgresql switches to PostgreSQL, where the subscriber names are encrypted in the database with
+# pgcrypto instead of in Django, so they can be filtered and ordered in SQL (see matsecom/pgcrypto.py).
+# manage.py copy_sqlite_database copies an existing SQLite database over
+if os.environ.get('DAWN_DATABASE') == 'postgresql':
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get('DAWN_POSTGRES_DB', 'dawn'),
+            "USER": os.environ.get('DAWN_POSTGRES_USER', 'dawn'),
+            "PASSWORD": os.environ.get('DAWN_POSTGRES_PASSWORD', ''),
+            "HOST": os.environ.get('DAWN_POSTGRES_HOST', 'localhost'),
+            "PORT": os.environ.get('DAWN_POSTGRES_PORT', '5432'),
+        }
+    }
+
+# Key of the pgcrypto encrypted fields on PostgreSQL
+PGCRYPTO_KEY = "Vq3xN8cR2mL7sK1pZ5tB9wH4yD6fJ0gE"  # this is for demo only, in real project you would do: os.environ.get('DAWN_PGCRYPTO_KEY', '')
+
+
+# Seconds after which the in-memory reference data catalog (matsecom/catalog.py) is reloaded, so changes made in other
+# processes are picked up. Changes made in the same process invalidate it right away
+CATALOG_MAX_AGE = 60
+
+
+# Seconds after which a running subscriber import whose worker stopped reporting progress (matsecom/import_jobs.py) is
+# given to another worker, and how often a job is tried before it is marked failed
+IMPORT_JOB_LEASE_SECONDS = 600
+IMPORT_JOB_MAX_ATTEMPTS = 3
+
+
+# Write-behind mode for simulated sessions (matsecom/write_behind.py): sessions are buffered per process and written
+# every SESSION_WRITE_BEHIND_MAX_RECORDS sessions or SESSION_WRITE_BEHIND_MAX_DELAY_MS milliseconds. The spool keeps
+# buffered sessions on disk until they are written, with SESSION_SPOOL_FSYNC they also survive a power loss. The data
+# volume quota is checked and reserved when a session is accepted (usage.reserve_usage), with or without the buffer.
+# That reservation is a write transaction of its own, so the buffer only takes the session INSERT off the request:
+# a single worker simulates about twice as many sessions per second, but workers contending for the SQLite write lock
+# don't get faster (manage.py benchmark_write_behind). Off by default, see the README
+SESSION_WRITE_BEHIND = os.environ.get('DAWN_SESSION_WRITE_BEHIND', '') == '1'
+SESSION_WRITE_BEHIND_MAX_RECORDS = 500
+SESSION_WRITE_BEHIND_MAX_DELAY_MS = 200
+SESSION_SPOOL_DIR = BASE_DIR / 'spool'
+SESSION_SPOOL_FSYNC = False
+
+
+# Directory in which the processes (gunicorn workers, import worker, billing runs) share their metrics
+# (matsecom/metrics.py), e.g. DAWN_METRICS_DIR=/run/dawn-metrics. Empty it when the server is started. Without it
+# /metrics only shows the values of the process that answers
+METRICS_DIRECTORY = os.environ.get('DAWN_METRICS_DIR') or None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -19,7 +19,7 @@ from django.contrib import admin
 from django.contrib.auth.views import LoginView, LogoutView
 from django.urls import path
 
-from matsecom.views import HomeTemplateView, SubscriberListView, SubscriberDetailView, AddSubscriberView, SubscriberDeleteView, CreateInvoiceView, InvoiceDetailView, SessionListView, SimulateSessionView
+from matsecom.views import HomeTemplateView, SubscriberListView, SubscriberDetailView, AddSubscriberView, SubscriberDeleteView, CreateInvoiceView, InvoiceDetailView, SessionListView, SimulateSessionView, ImportJobProgressView, IngestSessionsView, SimulateSessionsView, MetricsView
 
 urlpatterns = [
     path('', HomeTemplateView.as_view(), name='home'),
@@ -28,10 +28,14 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path('subscribers/', SubscriberListView.as_view(), name='subscriber_list'),
     path('subscribers/<int:pk>/', SubscriberDetailView.as_view(), name='subscriber_detail'),
+    path('subscribers/import/<int:pk>/', ImportJobProgressView.as_view(), name='import_job_progress'),
     path('subscribers/add/', AddSubscriberView.as_view(), name='add_subscriber'),
     path('subscribers/delete/<int:pk>/', SubscriberDeleteView.as_view(), name='subscriber_delete'),
     path('invoice/', CreateInvoiceView.as_view(), name='invoice'),
     path('invoice/<int:pk>/', InvoiceDetailView.as_view(), name='invoice_details'),
     path('sessions/', SessionListView.as_view(), name='session_list'),
     path('sessions/simulate', SimulateSessionView.as_view(), name='session_simulation'),
+    path('api/sessions/ingest/', IngestSessionsView.as_view(), name='api_session_ingest'),
+    path('api/sessions/simulate/', SimulateSessionsView.as_view(), name='api_session_simulation'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,13 +1,49 @@
 from django.contrib import admin
 
-from .models import Service, Session, Subscriber, Subscription, Technology, Terminal, ThroughputPercentage
+from .models import Service, Session, SessionArchive, Subscriber, Subscription, Technology, Terminal, ThroughputPercentage
 
 # Register your models here.
 
+
+class SubscriberAdmin(admin.ModelAdmin):
+    list_display = ('imsi', 'terminal_type', 'subscription_type')
+    list_select_related = ('terminal_type', 'subscription_type')
+    search_fields = ('imsi',)
+    search_help_text = "Search by IMSI or by the beginning of the forename/surname"
+
+    # the names are encrypted, so they are searched through their blind indexes instead of icontains lookups
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        matches = queryset.search_name(search_term)
+        if search_term.strip().isdigit():
+            matches = matches | queryset.filter(imsi=int(search_term))
+        return matches, False
+
+
+class SessionAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'data_volume', 'call_seconds', 'paid')
+    list_select_related = ('subscriber__terminal_type', 'subscriber__subscription_type', 'service')
+    raw_id_fields = ('subscriber',)
+
+
+# archived sessions are history, they are only moved there by manage.py archive_sessions
+class SessionArchiveAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'data_volume', 'call_seconds', 'archived_at')
+    list_select_related = ('subscriber', 'service')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(ThroughputPercentage)
 admin.site.register(Technology)
 admin.site.register(Terminal)
 admin.site.register(Subscription)
-admin.site.register(Subscriber)
+admin.site.register(Subscriber, SubscriberAdmin)
 admin.site.register(Service)
-admin.site.register(Session)
\ No newline at end of file
+admin.site.register(Session, SessionAdmin)
+admin.site.register(SessionArchive, SessionArchiveAdmin)
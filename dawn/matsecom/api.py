@@ -0,0 +1,77 @@
+import hmac
+import json
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+
+# Machine clients (e.g. the mediation layer) call the /api/ views with a bearer token from settings.API_TOKENS
+# instead of logging in, LoginRequiredMiddleware lets these paths through and the views check the token themselves.
+# There is no session cookie involved, so the views are exempt from CSRF protection.
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl')
+
+
+class ApiError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# a record of a request body that could not be parsed
+class ApiRecordError:
+    def __init__(self, message: str):
+        self.message = message
+
+
+# returns whether the request carries one of the tokens, by default one of the configured API tokens
+def has_valid_token(request, tokens: list = None) -> bool:
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return False
+    if tokens is None:
+        tokens = getattr(settings, 'API_TOKENS', [])
+    return any(hmac.compare_digest(token.encode(), valid.encode()) for valid in tokens)
+
+
+# mixin for the views of the token authenticated JSON API, raise ApiError in a handler to answer with an error
+@method_decorator(csrf_exempt, name='dispatch')
+class ApiTokenMixin:
+    def dispatch(self, request, *args, **kwargs):
+        if not has_valid_token(request):
+            return JsonResponse({'error': 'invalid or missing API token'}, status=401,
+                                headers={'WWW-Authenticate': 'Bearer'})
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'error': error.message}, status=error.status)
+
+
+# returns the records of a JSON array (Content-Type: application/json) or NDJSON (application/x-ndjson, one JSON
+# object per line) request body. The body is read from the request stream, so DATA_UPLOAD_MAX_MEMORY_SIZE doesn't
+# apply, max_records limits the size instead
+# a line of NDJSON that is not valid JSON is returned as an ApiRecordError, so it can be rejected on its own
+def parse_records(request, max_records: int) -> list:
+    if request.content_type in NDJSON_CONTENT_TYPES:
+        records = []
+        for line in request:
+            if not line.strip():
+                continue
+            if len(records) == max_records:
+                raise ApiError(f"at most {max_records} records per request", status=413)
+            try:
+                records.append(json.loads(line))
+            except ValueError as error:
+                records.append(ApiRecordError(f"invalid JSON: {error}"))
+        return records
+    try:
+        records = json.load(request)
+    except ValueError as error:
+        raise ApiError(f"invalid JSON: {error}")
+    if not isinstance(records, list):
+        raise ApiError("expected a JSON array or NDJSON")
+    if len(records) > max_records:
+        raise ApiError(f"at most {max_records} records per request", status=413)
+    return records
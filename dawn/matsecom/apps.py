@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MatsecomConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "matsecom"
+
+    def ready(self):
+        from . import signals  # noqa: F401 registers the signal receivers
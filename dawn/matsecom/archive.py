@@ -0,0 +1,95 @@
+import time
+
+from django.db import transaction
+from django.db.models import F
+
+from .db import run_with_retry
+from .models import Session, SessionArchive
+
+# Hot/cold split of the sessions: _simulate_session and invoice() only need the unpaid sessions, so paid sessions
+# older than a cutoff are moved from Session to SessionArchive by manage.py archive_sessions. Lists and reports that
+# show the whole history use SessionHistory, which queries both tables as one.
+
+ARCHIVED_FIELDS = ['id', 'subscriber_id', 'service_id', 'timestamp', 'duration', 'data_volume', 'call_seconds', 'paid']
+
+
+# moves up to chunk_size paid sessions older than cutoff to the archive in one short transaction
+# copying ignores sessions that are archived already, so a chunk that failed after the copy is simply repeated
+# returns the number of sessions moved
+def archive_chunk(cutoff, chunk_size: int = 1000) -> int:
+    with transaction.atomic():
+        ids = list(Session.objects.filter(paid=True, timestamp__lt=cutoff).order_by('pk')
+                   .values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return 0
+        SessionArchive.objects.bulk_create(
+            [SessionArchive(**row) for row in Session.objects.filter(pk__in=ids).values(*ARCHIVED_FIELDS)],
+            ignore_conflicts=True
+        )
+        Session.objects.filter(pk__in=ids, paid=True).delete()
+    return len(ids)
+
+
+# archives all paid sessions older than cutoff chunk by chunk, sleeping pause seconds between the chunks so other
+# writers get the database in between. progress(moved) is called after every chunk
+# returns the number of sessions moved
+def archive_sessions(cutoff, chunk_size: int = 1000, pause: float = 0.0, progress=None) -> int:
+    moved = 0
+    while True:
+        count = run_with_retry(archive_chunk, cutoff, chunk_size)
+        if not count:
+            return moved
+        moved += count
+        if progress is not None:
+            progress(moved)
+        if pause:
+            time.sleep(pause)
+
+
+# the Session and SessionArchive tables queried as one, for the read-only history views
+# filter() is applied to both tables, count() adds up both counts and order_by() returns a UNION ALL of both as
+# dicts with the keys in COLUMNS, so ordering and slicing still happen in SQL
+class SessionHistory:
+    COLUMNS = {
+        'id': F('id'),
+        'imsi': F('subscriber__imsi'),
+        'service': F('service__name'),
+        'timestamp': F('timestamp'),
+        'data_volume': F('data_volume'),
+        'call_seconds': F('call_seconds'),
+        'paid': F('paid'),
+    }
+
+    def __init__(self, querysets=None):
+        self.querysets = querysets or [Session.objects.all(), SessionArchive.objects.all()]
+
+    def filter(self, *args, **kwargs):
+        return SessionHistory([queryset.filter(*args, **kwargs) for queryset in self.querysets])
+
+    def count(self) -> int:
+        return sum(queryset.count() for queryset in self.querysets)
+
+    # field names are the keys of COLUMNS, 'pk' orders by id
+    def order_by(self, *field_names):
+        rows = [
+            queryset.order_by().values(**{f'_{name}': expression for name, expression in self.COLUMNS.items()})
+            for queryset in self.querysets
+        ]
+        ordering = [('-' if name.startswith('-') else '') + '_' + ('id' if name.lstrip('-') == 'pk' else name.lstrip('-'))
+                    for name in field_names]
+        return _Rows(rows[0].union(*rows[1:], all=True).order_by(*ordering))
+
+
+# strips the prefix of the UNION column aliases (values() doesn't allow aliases that clash with model fields)
+class _Rows:
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def __getitem__(self, item):
+        rows = self.queryset[item]
+        if isinstance(item, slice):
+            return [{name[1:]: value for name, value in row.items()} for row in rows]
+        return {name[1:]: value for name, value in rows.items()}
+
+    def __iter__(self):
+        return iter(self[:])
@@ -0,0 +1,31 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+# SQLite backend for the production profile (DAWN_DATABASE=sqlite-production, see settings.py), configured with two
+# OPTIONS on top of the ones sqlite3.connect takes:
+#   'pragmas': {name: value} run on every new connection, e.g. journal_mode WAL so readers don't block the writer
+#   'transaction_mode': 'DEFERRED' (SQLite's default), 'IMMEDIATE' or 'EXCLUSIVE', the BEGIN of atomic blocks.
+#       A deferred transaction that reads first and writes later can't wait for the write lock and fails with
+#       "database is locked" right away, an IMMEDIATE one takes the write lock at BEGIN and waits busy_timeout for it
+# Django 5.1 has 'transaction_mode' (and 'init_command' for the pragmas) built in.
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = kwargs.pop('pragmas', {})
+        self.transaction_mode = kwargs.pop('transaction_mode', 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}")
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
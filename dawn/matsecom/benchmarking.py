@@ -0,0 +1,135 @@
+import contextlib
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .models import Service, Session, Subscriber, Subscription, Technology, Terminal, ThroughputPercentage
+
+# helpers shared by the benchmark management commands
+
+
+# runs the benchmark in a throwaway database that is created like the test database, so real data is never touched
+# name can be a file path to benchmark on disk instead of in memory (SQLite)
+@contextlib.contextmanager
+def benchmark_database(name=None):
+    if name:
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = name
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+# creates the reference data used by the test suite (technologies, terminals, subscriptions, services)
+def seed_catalog() -> dict:
+    percentages = [
+        ThroughputPercentage.objects.create(signal_quality='G', percentage=0.5),
+        ThroughputPercentage.objects.create(signal_quality='M', percentage=0.25),
+        ThroughputPercentage.objects.create(signal_quality='L', percentage=0.1),
+        ThroughputPercentage.objects.create(signal_quality='N', percentage=0.0),
+    ]
+    technology_2g = Technology.objects.create(name='2G', voice_call_support=True)
+    technology_3g = Technology.objects.create(name='3G', maximum_throughput=20)
+    technology_3g.achievable_throughput_percentages.set(percentages)
+    technology_4g = Technology.objects.create(name='4G', maximum_throughput=300)
+    technology_4g.achievable_throughput_percentages.set(percentages)
+
+    phair_phone = Terminal.objects.create(name='PhairPhone')
+    phair_phone.supported_technologies.set([technology_2g, technology_3g])
+    s42plus = Terminal.objects.create(name='Samsung S42plus')
+    s42plus.supported_technologies.set([technology_2g, technology_3g, technology_4g])
+
+    return {
+        'terminals': [phair_phone, s42plus],
+        'subscriptions': [
+            Subscription.objects.create(name='GS', basic_fee=800, minutes_included=0, price_per_extra_minute=8,
+                                        data_volume_3g_4g=500),
+            Subscription.objects.create(name='GM', basic_fee=2200, minutes_included=100, price_per_extra_minute=6,
+                                        data_volume_3g_4g=2000),
+            Subscription.objects.create(name='GL', basic_fee=4200, minutes_included=150, price_per_extra_minute=4,
+                                        data_volume_3g_4g=5000),
+        ],
+        'services': {
+            'VC': Service.objects.create(name='VC', ran_technologies='2G', required_data_rate=0),
+            'BN': Service.objects.create(name='BN', ran_technologies='3G4G', required_data_rate=2),
+            'AD': Service.objects.create(name='AD', ran_technologies='3G4G', required_data_rate=10),
+            'AV': Service.objects.create(name='AV', ran_technologies='3G4G', required_data_rate=75),
+        },
+    }
+
+
+# creates count subscribers with IMSIs counting up from 262010000000000 + start, returns their primary keys
+def seed_subscribers(catalog: dict, count: int, start: int = 0, batch_size: int = 5000) -> list:
+    terminals = catalog['terminals']
+    subscriptions = catalog['subscriptions']
+    for offset in range(start, start + count, batch_size):
+        Subscriber.objects.bulk_create([
+            Subscriber(
+                forename='Bench',
+                surname=f'Subscriber{i}',
+                imsi=262010000000000 + i,
+                terminal_type=terminals[i % len(terminals)],
+                subscription_type=subscriptions[i % len(subscriptions)]
+            )
+            for i in range(offset, min(offset + batch_size, start + count))
+        ])
+    return list(Subscriber.objects.filter(imsi__gte=262010000000000 + start,
+                                          imsi__lt=262010000000000 + start + count)
+                .order_by('imsi').values_list('pk', flat=True))
+
+
+# creates count sessions spread round-robin over subscriber_ids, every paid_every-th session is left unpaid
+def seed_sessions(catalog: dict, subscriber_ids: list, count: int, paid_every: int = 10,
+                  batch_size: int = 10000):
+    service = catalog['services']['BN']
+    for offset in range(0, count, batch_size):
+        Session.objects.bulk_create([
+            Session(
+                subscriber_id=subscriber_ids[i % len(subscriber_ids)],
+                service=service,
+                duration=60,
+                data_volume=100,
+                call_seconds=0,
+                paid=i % paid_every != 0
+            )
+            for i in range(offset, min(offset + batch_size, count))
+        ])
+
+
+# calls function repeat times and returns the median/min/max wall time in milliseconds
+def time_call(function, repeat: int = 5) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'max_ms': max(timings),
+    }
+
+
+# calls function once and returns the number of queries it sent and its peak python memory allocation in KiB
+# (tracemalloc slows the call down, so this is measured separately from time_call)
+def profile_call(function) -> dict:
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            function()
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return {
+        'queries': len(queries),
+        'peak_memory_kib': round(peak / 1024, 1),
+    }
@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import BillingCycle, Invoice, Session, Subscriber, Subscription
+from .usage import UsageSummary, get_mb_from_mbit, rate_usage, settle_usage, settle_usages
+
+
+# settles all unpaid sessions of a subscriber and writes the invoice, all in one transaction
+# the unpaid sessions are locked and marked paid with a single UPDATE, the totals are summed up in the database.
+# Only sessions up to the highest locked id are settled, so sessions created while the invoice is written are
+# neither billed nor marked paid and end up on the next invoice
+def settle_subscriber(subscriber: Subscriber) -> Invoice:
+    with transaction.atomic():
+        # serializes concurrent invoice runs for the same subscriber
+        list(Subscriber.objects.select_for_update().filter(pk=subscriber.pk).values_list('pk', flat=True))
+        locked_ids = Session.objects.select_for_update().filter(subscriber=subscriber, paid=False) \
+            .values_list('pk', flat=True).order_by()
+        cutoff = max(locked_ids, default=None)
+
+        usage = UsageSummary(0, 0)
+        if cutoff is not None:
+            settled = Session.objects.filter(subscriber=subscriber, paid=False, pk__lte=cutoff)
+            totals = settled.aggregate(
+                data_volume=Coalesce(Sum('data_volume'), 0),
+                call_seconds=Coalesce(Sum('call_seconds'), 0)
+            )
+            usage = UsageSummary(totals['data_volume'], totals['call_seconds'])
+            settled.update(paid=True)
+        settle_usage(subscriber.pk, usage)
+
+        (data_volume, call_minutes, charges) = rate_usage(usage, subscriber.subscription_type)
+        return Invoice.objects.create(
+            subscriber=subscriber,
+            data_volume=get_mb_from_mbit(data_volume),
+            call_minutes=call_minutes,
+            charges=charges
+        )
+
+
+# returns the billing cycle called name, creating it if needed
+# a new cycle settles all sessions that exist when it is started, running it again resumes it
+def get_or_start_billing_cycle(name: str) -> BillingCycle:
+    cycle, created = BillingCycle.objects.get_or_create(
+        name=name,
+        defaults={'session_cutoff': Session.objects.aggregate(cutoff=Coalesce(Max('pk'), 0))['cutoff']}
+    )
+    return cycle
+
+
+# returns the ids of the subscribers that have no invoice in the cycle yet
+def get_unbilled_subscriber_ids(cycle: BillingCycle) -> list:
+    return list(Subscriber.objects.exclude(invoice__billing_cycle=cycle).order_by('pk').values_list('pk', flat=True))
+
+
+# settles and invoices a chunk of subscribers for a billing cycle in one transaction, with a constant number of
+# queries per chunk. Subscribers that already have an invoice in the cycle are skipped, so a chunk can be re-run
+# after a crash. Returns the number of invoices written
+def settle_chunk(cycle_id: int, subscriber_ids: list) -> int:
+    with transaction.atomic():
+        cycle = BillingCycle.objects.get(pk=cycle_id)
+        billed = set(Invoice.objects.filter(billing_cycle=cycle, subscriber_id__in=subscriber_ids)
+                     .values_list('subscriber_id', flat=True))
+        subscription_ids = dict(Subscriber.objects.select_for_update()
+                                .filter(pk__in=[pk for pk in subscriber_ids if pk not in billed])
+                                .values_list('pk', 'subscription_type_id'))
+        if not subscription_ids:
+            return 0
+        subscriptions = Subscription.objects.in_bulk(set(subscription_ids.values()))
+
+        settled = Session.objects.filter(subscriber_id__in=list(subscription_ids), paid=False,
+                                         pk__lte=cycle.session_cutoff)
+        usages = {subscriber_id: UsageSummary(0, 0) for subscriber_id in subscription_ids}
+        for row in settled.values('subscriber_id').annotate(data_volume=Sum('data_volume'),
+                                                            call_seconds=Sum('call_seconds')).order_by():
+            usages[row['subscriber_id']] = UsageSummary(row['data_volume'], row['call_seconds'])
+        settled.update(paid=True)
+        settle_usages(usages)
+
+        invoices = []
+        for subscriber_id, usage in usages.items():
+            (data_volume, call_minutes, charges) = rate_usage(usage, subscriptions[subscription_ids[subscriber_id]])
+            invoices.append(Invoice(
+                subscriber_id=subscriber_id,
+                billing_cycle=cycle,
+                data_volume=get_mb_from_mbit(data_volume),
+                call_minutes=call_minutes,
+                charges=charges
+            ))
+        Invoice.objects.bulk_create(invoices)
+        return len(invoices)
+
+
+def finish_billing_cycle(cycle: BillingCycle):
+    cycle.finished_at = timezone.now()
+    cycle.save(update_fields=['finished_at'])
@@ -0,0 +1,48 @@
+import hashlib
+import hmac
+import unicodedata
+
+from django.conf import settings
+
+# Blind indexes make encrypted fields searchable without decrypting them: instead of the plain value, a keyed HMAC
+# of the normalized value is stored next to the ciphertext and can be matched with ordinary indexed SQL.
+# Prefix searches use one token per prefix length, up to PREFIX_TOKEN_MAX_LENGTH characters. Longer search terms
+# are matched on their first PREFIX_TOKEN_MAX_LENGTH characters and the remaining candidates are checked in python.
+
+PREFIX_TOKEN_MAX_LENGTH = 12
+
+
+# lower-cases and strips a name so that "Müller", "müller " and "MÜLLER" share the same index entries
+def normalize_name(value: str) -> str:
+    return unicodedata.normalize('NFKC', str(value)).strip().casefold()
+
+
+_keyed_hmacs = {}
+
+
+def _hmac(message: str) -> str:
+    # keying HMAC hashes the key, so a keyed instance is kept and copied for every message
+    key = settings.BLIND_INDEX_KEY
+    if key not in _keyed_hmacs:
+        _keyed_hmacs[key] = hmac.new(key.encode(), digestmod=hashlib.sha256)
+    keyed = _keyed_hmacs[key].copy()
+    keyed.update(message.encode())
+    return keyed.hexdigest()
+
+
+# returns the exact match index of a value, the field name is part of the message so equal forenames and surnames
+# don't share index entries
+def exact_index(field_name: str, value: str) -> str:
+    return _hmac(f"{field_name}:exact:{normalize_name(value)}")
+
+
+# returns the token to look up values of field_name starting with prefix
+def prefix_token(field_name: str, prefix: str) -> str:
+    return _hmac(f"{field_name}:prefix:{normalize_name(prefix)[:PREFIX_TOKEN_MAX_LENGTH]}")
+
+
+# returns all prefix tokens that are stored for a value
+def prefix_tokens(field_name: str, value: str) -> list:
+    normalized = normalize_name(value)
+    return [_hmac(f"{field_name}:prefix:{normalized[:length]}")
+            for length in range(1, min(len(normalized), PREFIX_TOKEN_MAX_LENGTH) + 1)]
@@ -0,0 +1,205 @@
+import random
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+
+from .models import Service, Subscription, Technology, Terminal, ThroughputPercentage
+
+# In-memory copy of the small, rarely changing reference tables (throughput percentages, technologies, terminals,
+# subscriptions and services), so the hot paths don't have to query them again and again.
+# Saving or deleting one of these models (or changing their many-to-many relations) bumps the version through the
+# receivers in signals.py, and the catalog is reloaded on its next use. Changes made by other processes are picked up
+# after CATALOG_MAX_AGE seconds, or right away when an unknown primary key or name is looked up.
+
+_lock = threading.Lock()
+_version = 0
+_catalog = None
+
+
+# throughput (hundredths of Mbit/s) of a terminal without data technologies, lower than any required data rate, so
+# such a session never has enough bandwidth. The batch engine in simulation.py uses the same value
+NO_THROUGHPUT = -1
+
+
+# returns a throughput in Mbit/s (Decimal, int or None) as integer hundredths, so comparisons and sums are exact
+def to_hundredths(throughput) -> int:
+    if throughput is None:
+        return 0
+    return int(Decimal(str(throughput)) * 100)
+
+
+# what a terminal can do, precomputed when the catalog is loaded:
+# - voice_call_support: whether one of its technologies supports voice calls
+# - throughputs: achievable throughput in hundredths of Mbit/s per (technology id, throughput percentage id), for
+#   every technology of the terminal that has a maximum throughput
+# - voice_technology: the name of the first of its technologies that supports voice calls
+class TerminalCapabilities:
+    def __init__(self, voice_call_support: bool, throughputs: dict, voice_technology: str = ''):
+        self.voice_call_support = voice_call_support
+        self.throughputs = throughputs
+        self.voice_technology = voice_technology
+
+    # returns the achievable throughput of a (technology, throughput percentage) tuple in hundredths of Mbit/s
+    def throughput(self, technology: Technology, throughput_percentage: ThroughputPercentage) -> int:
+        try:
+            return self.throughputs[technology.pk, throughput_percentage.pk]
+        except KeyError:
+            # percentage not linked to the technology
+            return technology.maximum_throughput * to_hundredths(throughput_percentage.percentage)
+
+    # returns the highest throughput of a list of (technology, throughput percentage) tuples in hundredths of Mbit/s,
+    # NO_THROUGHPUT for an empty list
+    def fastest_throughput(self, throughput_percentages: list) -> int:
+        return self.fastest(throughput_percentages)[1]
+
+    # returns a tuple (technology, throughput in hundredths of Mbit/s) with the highest throughput of a list of
+    # (technology, throughput percentage) tuples, the first technology wins a tie. An empty list (no data
+    # technologies) gives (None, NO_THROUGHPUT)
+    def fastest(self, throughput_percentages: list) -> tuple:
+        return max(((technology, self.throughput(technology, throughput_percentage))
+                    for technology, throughput_percentage in throughput_percentages), key=lambda item: item[1],
+                   default=(None, NO_THROUGHPUT))
+
+
+class Catalog:
+    def __init__(self, version: int):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.throughput_percentages = {tp.pk: tp for tp in ThroughputPercentage.objects.all()}
+        self.technologies = {technology.pk: technology for technology in Technology.objects.all()}
+        self.terminals = {terminal.pk: terminal for terminal in Terminal.objects.order_by('pk')}
+        self.subscriptions = {subscription.pk: subscription for subscription in Subscription.objects.order_by('pk')}
+        self.services = {service.pk: service for service in Service.objects.order_by('pk')}
+        self.terminals_by_name = {terminal.name: terminal for terminal in self.terminals.values()}
+        self.subscriptions_by_name = {subscription.name: subscription
+                                      for subscription in self.subscriptions.values()}
+
+        # achievable throughput percentages per technology, sorted ascending
+        self.technology_percentages = {pk: [] for pk in self.technologies}
+        for row in Technology.achievable_throughput_percentages.through.objects.values_list(
+                'technology_id', 'throughputpercentage_id'):
+            self.technology_percentages[row[0]].append(self.throughput_percentages[row[1]])
+        for percentages in self.technology_percentages.values():
+            percentages.sort(key=lambda tp: (tp.percentage, tp.pk))
+
+        self.terminal_technologies = {pk: [] for pk in self.terminals}
+        for row in Terminal.supported_technologies.through.objects.order_by('technology_id').values_list(
+                'terminal_id', 'technology_id'):
+            self.terminal_technologies[row[0]].append(self.technologies[row[1]])
+
+        self.terminal_capabilities = {}
+        for pk, technologies in self.terminal_technologies.items():
+            self.terminal_capabilities[pk] = TerminalCapabilities(
+                any(technology.voice_call_support for technology in technologies),
+                {
+                    (technology.pk, tp.pk): technology.maximum_throughput * to_hundredths(tp.percentage)
+                    for technology in technologies if technology.maximum_throughput is not None
+                    for tp in self.technology_percentages[technology.pk]
+                },
+                next((technology.name for technology in technologies if technology.voice_call_support), '')
+            )
+
+
+# returns the current catalog, (re)loading it if it is outdated
+def get_catalog() -> Catalog:
+    global _catalog
+    catalog = _catalog
+    max_age = getattr(settings, 'CATALOG_MAX_AGE', 60)
+    if catalog is None or catalog.version != _version or time.monotonic() - catalog.loaded_at > max_age:
+        with _lock:
+            if _catalog is None or _catalog.version != _version or _catalog is catalog:
+                _catalog = Catalog(_version)
+            catalog = _catalog
+    return catalog
+
+
+# marks the catalog as outdated, called by the signal receivers in signals.py
+def invalidate(**kwargs):
+    global _version
+    with _lock:
+        _version += 1
+
+
+# calls function with the catalog, reloading it once if the function fails with a KeyError (unknown primary key or
+# name, e.g. created by another process since the catalog was loaded)
+def _lookup(function):
+    try:
+        return function(get_catalog())
+    except KeyError:
+        invalidate()
+        return function(get_catalog())
+
+
+def get_terminal(pk: int) -> Terminal:
+    return _lookup(lambda catalog: catalog.terminals[pk])
+
+
+def get_terminals() -> list:
+    return list(get_catalog().terminals.values())
+
+
+def get_terminal_by_name(name: str) -> Terminal:
+    return _lookup(lambda catalog: catalog.terminals_by_name[name])
+
+
+def get_subscription(pk: int) -> Subscription:
+    return _lookup(lambda catalog: catalog.subscriptions[pk])
+
+
+def get_subscriptions() -> list:
+    return list(get_catalog().subscriptions.values())
+
+
+def get_subscription_by_name(name: str) -> Subscription:
+    return _lookup(lambda catalog: catalog.subscriptions_by_name[name])
+
+
+def get_service(pk: int) -> Service:
+    return _lookup(lambda catalog: catalog.services[pk])
+
+
+def get_services() -> list:
+    return list(get_catalog().services.values())
+
+
+# returns the technologies supported by a terminal
+def get_supported_technologies(terminal_id: int) -> list:
+    return _lookup(lambda catalog: catalog.terminal_technologies[terminal_id])
+
+
+def get_terminal_capabilities(terminal_id: int) -> TerminalCapabilities:
+    return _lookup(lambda catalog: catalog.terminal_capabilities[terminal_id])
+
+
+# returns the achievable throughput percentages of a technology, sorted ascending
+def get_throughput_percentages(technology_id: int) -> list:
+    return _lookup(lambda catalog: catalog.technology_percentages[technology_id])
+
+
+# returns a list of tuples (technology, throughput_percentage), choosing a throughput percentage with
+# choose(percentages sorted ascending) for each technology of the terminal that has a maximum throughput and achievable
+# throughput percentages
+def choose_throughput_percentages(terminal_id: int, choose) -> list:
+    def choose_all(catalog):
+        return [
+            (technology, choose(catalog.technology_percentages[technology.pk]))
+            for technology in catalog.terminal_technologies[terminal_id]
+            if technology.maximum_throughput is not None and catalog.technology_percentages[technology.pk]
+        ]
+    return _lookup(choose_all)
+
+
+# choose_throughput_percentages with a random throughput percentage for each technology
+def choose_random_throughput_percentages(terminal_id: int, rng=random) -> list:
+    return choose_throughput_percentages(terminal_id, rng.choice)
+
+
+# returns {name: service, pk: service} of all services, the first service wins if names are not unique
+def get_services_by_key() -> dict:
+    services = {}
+    for service in get_services():
+        services.setdefault(service.name, service)
+        services[service.pk] = service
+    return services
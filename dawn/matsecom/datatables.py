@@ -0,0 +1,48 @@
+from django.http import JsonResponse
+
+# upper limit for the page length, DataTables asks for all rows with length=-1
+MAX_PAGE_LENGTH = 1000
+
+
+# answers a DataTables server-side processing request (https://datatables.net/manual/server-side), so only the rows
+# on screen are read from the database. Filtering, ordering and paging (LIMIT/OFFSET) all happen in SQL.
+# columns lists the field to order each table column by (None if the column can't be ordered),
+# search(queryset, term) applies the global search box and row(obj) returns the data of one table row
+def datatables_response(request, queryset, columns: list, search, row) -> JsonResponse:
+    params = request.GET
+    try:
+        draw = int(params.get('draw', 0))
+        start = max(int(params.get('start', 0)), 0)
+        length = int(params.get('length', 10))
+    except ValueError:
+        return JsonResponse({'error': 'invalid paging parameters'}, status=400)
+    if length < 0 or length > MAX_PAGE_LENGTH:
+        length = MAX_PAGE_LENGTH
+
+    records_total = queryset.count()
+    term = params.get('search[value]', '').strip()
+    if term:
+        queryset = search(queryset, term)
+        records_filtered = queryset.count()
+    else:
+        records_filtered = records_total
+
+    ordering = []
+    i = 0
+    while f'order[{i}][column]' in params:
+        try:
+            column = columns[int(params[f'order[{i}][column]'])]
+        except (ValueError, IndexError):
+            column = None
+        if column is not None:
+            ordering.append(('-' if params.get(f'order[{i}][dir]') == 'desc' else '') + column)
+        i += 1
+    # the primary key keeps the order stable between pages
+    page = queryset.order_by(*ordering, 'pk')[start:start + length]
+
+    return JsonResponse({
+        'draw': draw,
+        'recordsTotal': records_total,
+        'recordsFiltered': records_filtered,
+        'data': [row(obj) for obj in page],
+    })
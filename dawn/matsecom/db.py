@@ -0,0 +1,24 @@
+import random
+import time
+
+from django.db import OperationalError
+
+# SQLite allows a single writer. Transactions that read first and write later can't wait for the write lock
+# (that would deadlock), so SQLite fails them right away with "database is locked" and they have to be retried
+
+
+def is_lock_error(error: OperationalError) -> bool:
+    message = str(error).lower()
+    return 'database is locked' in message or 'database table is locked' in message or 'busy' in message
+
+
+# calls function (which must run its own transaction) until it doesn't fail with a lock error anymore,
+# waiting a random, growing delay between the attempts
+def run_with_retry(function, *args, attempts: int = 20, delay: float = 0.01, **kwargs):
+    for attempt in range(attempts):
+        try:
+            return function(*args, **kwargs)
+        except OperationalError as error:
+            if not is_lock_error(error) or attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0, delay * 2 ** min(attempt, 6)))
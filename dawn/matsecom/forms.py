@@ -1,12 +1,64 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceIterator
 
+from . import catalog
 from .models import Invoice, Subscriber, Session
 
 
+class CatalogChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in self.field.get_catalog_objects():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.get_catalog_objects()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.get_catalog_objects())
+
+
+# ModelChoiceField for reference data, the choices are rendered and validated from the cached catalog (catalog.py)
+# instead of being queried from the database
+class CatalogChoiceField(forms.ModelChoiceField):
+    iterator = CatalogChoiceIterator
+    get_catalog_objects = None  # returns all objects of the model
+    get_catalog_object = None  # returns the object with the given primary key, raises KeyError if there is none
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, self.queryset.model):
+            return value
+        try:
+            return self.get_catalog_object(int(value))
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice',
+                                  params={'value': value})
+
+class TerminalChoiceField(CatalogChoiceField):
+    get_catalog_objects = staticmethod(catalog.get_terminals)
+    get_catalog_object = staticmethod(catalog.get_terminal)
+
+class SubscriptionChoiceField(CatalogChoiceField):
+    get_catalog_objects = staticmethod(catalog.get_subscriptions)
+    get_catalog_object = staticmethod(catalog.get_subscription)
+
+class ServiceChoiceField(CatalogChoiceField):
+    get_catalog_objects = staticmethod(catalog.get_services)
+    get_catalog_object = staticmethod(catalog.get_service)
+
+
 class SubscriberForm(forms.ModelForm):
     class Meta:
         model = Subscriber
         fields = ['forename', 'surname', 'imsi', 'terminal_type', 'subscription_type']
+        field_classes = {
+            'terminal_type': TerminalChoiceField,
+            'subscription_type': SubscriptionChoiceField,
+        }
         widgets = {
             'forename': forms.TextInput(attrs={'maxlength': 100}),
             'surname': forms.TextInput(attrs={'maxlength': 100}),
@@ -16,15 +68,24 @@ class SubscriberForm(forms.ModelForm):
             }),
         }
         
-class InvoiceForm(forms.ModelForm):
+# the subscriber choices are labeled with str(subscriber), which needs the terminal and the subscription
+class SubscriberChoiceMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['subscriber'].queryset = Subscriber.objects.select_related('terminal_type', 'subscription_type')
+
+class InvoiceForm(SubscriberChoiceMixin, forms.ModelForm):
     class Meta:
         model = Invoice
         fields = ['subscriber']
 
-class SessionForm(forms.ModelForm):
+class SessionForm(SubscriberChoiceMixin, forms.ModelForm):
     class Meta:
         model = Session
         fields = ['subscriber', 'service', 'duration']
+        field_classes = {
+            'service': ServiceChoiceField,
+        }
         widgets = {
             'duration': forms.NumberInput(attrs={
                 'min': 1,
@@ -32,5 +93,47 @@ class SessionForm(forms.ModelForm):
             }),
         }
 
+# one item of the batch simulation API, the subscriber (by primary key) and the service (by name or primary key) are
+# looked up in the given dicts instead of being queried per item
+class SimulationItemForm(forms.Form):
+    subscriber = forms.IntegerField()
+    service = forms.Field()
+    duration = forms.IntegerField(validators=Session._meta.get_field('duration').validators)
+
+    def __init__(self, *args, subscribers: dict, services: dict, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.subscribers = subscribers
+        self.services = services
+
+    def clean_subscriber(self):
+        subscriber = self.subscribers.get(self.cleaned_data['subscriber'])
+        if subscriber is None:
+            raise ValidationError(f"unknown subscriber {self.cleaned_data['subscriber']}")
+        return subscriber
+
+    # the service is a name or primary key, other JSON values (lists, objects, booleans) are never a service
+    def clean_service(self):
+        service = self.cleaned_data['service']
+        is_key = isinstance(service, (str, int)) and not isinstance(service, bool)
+        service = self.services.get(service) if is_key else None
+        if service is None:
+            raise ValidationError(f"unknown service {self.cleaned_data['service']}")
+        return service
+
 class UploadCSVForm(forms.Form):
-    csv_file = forms.FileField()
\ No newline at end of file
+    csv_file = forms.FileField()
+
+class SubscriberSearchForm(forms.Form):
+    q = forms.CharField(required=False, max_length=100, label='Search')
+
+    # filters by IMSI or name prefix, the names are matched through their blind indexes (see blind_index.py)
+    # an invalid search (e.g. longer than max_length) matches nothing
+    def filter(self, queryset):
+        if not self.is_valid():
+            return queryset.none()
+        if not self.cleaned_data['q'].strip():
+            return queryset
+        term = self.cleaned_data['q'].strip()
+        if term.isdigit():
+            return queryset.filter(imsi=int(term))
+        return queryset.search_name(term)
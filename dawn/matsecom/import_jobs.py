@@ -0,0 +1,119 @@
+import io
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ImportJob
+from .subscriber_import import import_subscribers_csv
+
+# number of row errors kept on a job
+MAX_JOB_ERRORS = 1000
+
+logger = logging.getLogger(__name__)
+
+
+# the job was requeued (see requeue_stale_jobs) while this worker was still running it
+class JobLeaseLost(Exception):
+    pass
+
+
+# saves the uploaded file to default_storage (chunk by chunk, the upload is never read into memory at once) and
+# queues it for the import worker
+def queue_import(uploaded_file) -> ImportJob:
+    file_name = default_storage.save(f'imports/{uploaded_file.name}', uploaded_file)
+    return ImportJob.objects.create(file_name=file_name)
+
+
+# puts running jobs whose worker has not renewed their heartbeat for settings.IMPORT_JOB_LEASE_SECONDS (e.g. it was
+# killed) back in the queue, or marks them failed once they were claimed IMPORT_JOB_MAX_ATTEMPTS times. The next
+# worker imports the file from the start, the rows imported before are skipped as existing subscribers
+# returns the number of requeued jobs
+def requeue_stale_jobs() -> int:
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'IMPORT_JOB_LEASE_SECONDS', 600))
+    max_attempts = getattr(settings, 'IMPORT_JOB_MAX_ATTEMPTS', 3)
+    stale = ImportJob.objects.filter(Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+                                     status=ImportJob.RUNNING)
+    stale.filter(attempts__gte=max_attempts).update(
+        status=ImportJob.FAILED, finished_at=now,
+        message=f"the import worker stopped responding {max_attempts} times, the job is not retried")
+    return stale.filter(attempts__lt=max_attempts).update(status=ImportJob.PENDING)
+
+
+# marks the oldest pending job as running and returns it, or None if there is none
+# the conditional update makes sure that a job is only claimed by one worker
+def claim_next_job():
+    requeue_stale_jobs()
+    for job in ImportJob.objects.filter(status=ImportJob.PENDING).order_by('pk')[:10]:
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(pk=job.pk, status=ImportJob.PENDING).update(
+            status=ImportJob.RUNNING, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+# imports the job's file, the CSV is parsed as a stream and every batch is committed on its own so that the
+# progress stored on the job is visible while the import runs
+# every progress update renews the job's heartbeat, it raises JobLeaseLost if the job was requeued in the meantime
+def run_import_job(job: ImportJob, batch_size: int = 5000):
+    # the job as long as this worker holds it
+    held = ImportJob.objects.filter(pk=job.pk, status=ImportJob.RUNNING, attempts=job.attempts)
+
+    def save_progress(report):
+        updated = held.update(
+            rows_processed=report.rows,
+            rows_created=report.created,
+            rows_skipped=report.skipped,
+            rows_failed=len(report.errors),
+            heartbeat_at=timezone.now()
+        )
+        if not updated:
+            raise JobLeaseLost(f"job {job.pk} was requeued")
+
+    try:
+        with default_storage.open(job.file_name, 'rb') as binary_file:
+            lines = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+            report = import_subscribers_csv(lines, batch_size=batch_size, progress=save_progress,
+                                            single_transaction=False)
+    except JobLeaseLost:
+        raise
+    except Exception as error:
+        held.update(status=ImportJob.FAILED, message=str(error), finished_at=timezone.now())
+        raise
+    updated = held.update(
+        status=ImportJob.DONE,
+        rows_processed=report.rows,
+        rows_created=report.created,
+        rows_skipped=report.skipped,
+        rows_failed=len(report.errors),
+        errors=report.as_dict(max_errors=MAX_JOB_ERRORS)['errors'],
+        finished_at=timezone.now()
+    )
+    if not updated:
+        # the worker that took over still needs the file
+        raise JobLeaseLost(f"job {job.pk} was requeued")
+    default_storage.delete(job.file_name)
+
+
+# runs pending jobs until there are none left (once=True) or forever, polling every poll_interval seconds
+# log(message) reports the jobs, e.g. the command's stdout
+def work(once: bool = False, poll_interval: float = 1.0, log=logger.info):
+    while True:
+        job = claim_next_job()
+        if job is not None:
+            log(f"Importing job {job.pk} ({job.file_name})")
+            try:
+                run_import_job(job)
+            except Exception as error:
+                log(f"Job {job.pk} failed: {error}")
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
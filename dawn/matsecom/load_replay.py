@@ -0,0 +1,178 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPErrorProcessor, Request, build_opener
+
+# HTTP load generator for the whole WSGI stack (middleware, login, CSRF, templates), see manage.py load_replay.
+# Every worker thread logs in with its own session and then sends requests to the routes in ROUTES, picked at random
+# by weight, until the time is up. Redirects are not followed, e.g. a successful simulation or invoice is its 302.
+
+# route name -> (method, path), {subscriber} is replaced with a random subscriber's primary key, {start} with a
+# random table offset
+ROUTES = {
+    'subscriber_list': ('GET', '/subscribers/'),
+    'subscriber_data': ('GET', '/subscribers/?action=data&draw=1&start={start}&length=50'),
+    'subscriber_detail': ('GET', '/subscribers/{subscriber}/'),
+    'session_data': ('GET', '/sessions/?action=data&draw=1&start={start}&length=50'),
+    'simulate': ('POST', '/sessions/simulate'),
+    'invoice': ('POST', '/invoice/'),
+    'csv_export': ('GET', '/subscribers/?action=download'),
+}
+
+DEFAULT_MIX = {
+    'subscriber_list': 2,
+    'subscriber_data': 4,
+    'subscriber_detail': 4,
+    'session_data': 2,
+    'simulate': 6,
+    'invoice': 1,
+    'csv_export': 1,
+}
+
+
+class LoadError(Exception):
+    pass
+
+
+# hands every response back as it is instead of raising for error statuses or following redirects
+class _PassThrough(HTTPErrorProcessor):
+    def http_response(self, request, response):
+        return response
+
+    https_response = http_response
+
+
+# a logged in browser session
+class LoadClient:
+    def __init__(self, base_url: str, timeout: float = 60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), _PassThrough)
+
+    # returns (status, body)
+    def request(self, method: str, path: str, data: dict = None) -> (int, bytes):
+        headers = {}
+        body = None
+        if method == 'POST':
+            body = urlencode(data or {}).encode()
+            headers['X-CSRFToken'] = self.cookie('csrftoken')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        with self.opener.open(Request(self.base_url + path, data=body, headers=headers, method=method),
+                              timeout=self.timeout) as response:
+            return response.status, response.read()
+
+    def cookie(self, name: str) -> str:
+        return next((cookie.value for cookie in self.cookies if cookie.name == name), '')
+
+    def login(self, username: str, password: str):
+        self.request('GET', '/login/')  # sets the CSRF cookie
+        status, _ = self.request('POST', '/login/', {
+            'username': username, 'password': password, 'csrfmiddlewaretoken': self.cookie('csrftoken')
+        })
+        if status != 302:
+            raise LoadError(f"login as {username} failed with status {status}")
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []  # seconds
+        self.errors = 0
+
+
+# nearest-rank percentile, 0 without latencies
+def percentile(latencies: list, p: float) -> float:
+    latencies = sorted(latencies)
+    if not latencies:
+        return 0.0
+    return latencies[max(math.ceil(p / 100 * len(latencies)) - 1, 0)]
+
+
+# the primary keys of the subscribers (from the subscriber table) and of the services (from the simulation form)
+# returns (subscriber pks, service pks, number of subscribers)
+def discover(client: LoadClient, max_subscribers: int = 1000) -> (list, list, int):
+    status, body = client.request('GET', f'/subscribers/?action=data&draw=1&start=0&length={max_subscribers}')
+    if status != 200:
+        raise LoadError(f"subscriber table returned status {status}")
+    data = json.loads(body)
+    subscribers = [int(re.search(r'/(\d+)/$', row['url']).group(1)) for row in data['data']]
+    status, body = client.request('GET', '/sessions/simulate')
+    select = re.search(rb'<select name="service".*?</select>', body, re.S)
+    services = [int(value) for value in re.findall(rb'<option value="(\d+)"', select.group(0))] if select else []
+    if not subscribers or not services:
+        raise LoadError("the server has no subscribers or services to run requests against")
+    return subscribers, services, data['recordsTotal']
+
+
+# runs concurrency logged in workers against base_url for seconds with the given mix {route: weight}
+# returns ({route: RouteStats}, elapsed seconds)
+def run_load(base_url: str, username: str, password: str, concurrency: int, seconds: float, mix: dict,
+             seed: int = 0) -> (dict, float):
+    for route in mix:
+        if route not in ROUTES:
+            raise LoadError(f"unknown route {route}, choose from {', '.join(ROUTES)}")
+    client = LoadClient(base_url)
+    client.login(username, password)
+    subscribers, services, table_size = discover(client)
+
+    stats = {route: RouteStats() for route in mix}
+    lock = threading.Lock()
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    failures = []
+
+    # the workers log in first, the measured time starts once all of them are ready
+    window = {}
+
+    def start_window():
+        window['start'] = time.perf_counter()
+        window['end'] = window['start'] + seconds
+
+    ready = threading.Barrier(concurrency + 1, action=start_window)
+
+    def work(worker: int):
+        rng = random.Random(seed + worker)
+        try:
+            worker_client = LoadClient(base_url)
+            worker_client.login(username, password)
+        except (LoadError, URLError, OSError) as error:
+            failures.append(error)
+            return
+        finally:
+            ready.wait()
+        while time.perf_counter() < window['end']:
+            route = rng.choices(routes, weights)[0]
+            method, path = ROUTES[route]
+            path = path.format(subscriber=rng.choice(subscribers), start=rng.randrange(max(table_size - 50, 1)))
+            data = None
+            if route == 'simulate':
+                data = {'subscriber': rng.choice(subscribers), 'service': rng.choice(services),
+                        'duration': rng.randint(1, 600)}
+            elif route == 'invoice':
+                data = {'subscriber': rng.choice(subscribers)}
+            start = time.perf_counter()
+            try:
+                status, _ = worker_client.request(method, path, data)
+                failed = status >= 400
+            except (URLError, OSError):
+                failed = True
+            latency = time.perf_counter() - start
+            with lock:
+                stats[route].latencies.append(latency)
+                stats[route].errors += failed
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise LoadError(f"{len(failures)} workers could not log in: {failures[0]}")
+    return stats, time.perf_counter() - window['start']
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from matsecom.archive import archive_sessions
+
+
+class Command(BaseCommand):
+    help = "Moves paid sessions older than the cutoff from the session table to the session archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=90, metavar='DAYS',
+                            help="Archive paid sessions older than this many days (default: 90)")
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Sessions moved per transaction (default: 1000)")
+        parser.add_argument('--pause', type=float, default=0.0, metavar='SECONDS',
+                            help="Pause between the transactions so other writers get the database lock")
+
+    def handle(self, *args, **options):
+        if options['older_than'] < 0 or options['chunk_size'] < 1 or options['pause'] < 0:
+            raise CommandError("--older-than and --pause must not be negative, --chunk-size must be positive")
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        moved = archive_sessions(
+            cutoff, chunk_size=options['chunk_size'], pause=options['pause'],
+            progress=lambda moved: self.stdout.write(f"{moved} sessions archived") if options['verbosity'] > 1 else None
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} paid sessions older than {cutoff:%Y-%m-%d %H:%M}"))
@@ -0,0 +1,61 @@
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from matsecom.benchmarking import benchmark_database, seed_catalog, seed_subscribers
+from matsecom.models import Session, Subscriber
+from matsecom.views import THROUGHPUT_CHOOSERS, _simulate_session
+
+
+class Command(BaseCommand):
+    help = ("Fires concurrent session simulations from several threads at a few subscribers and reports the "
+            "throughput and whether any subscriber exceeded its data volume. Runs in a throwaway SQLite database file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--sessions', type=int, default=200, help="Sessions simulated per thread")
+        parser.add_argument('--subscribers', nargs='+', type=int, default=[1, 8, 64],
+                            help="Numbers of subscribers the threads compete for")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory, benchmark_database(f'{directory}/benchmark.sqlite3'):
+            catalog = seed_catalog()
+            service = catalog['services']['BN']
+            self.stdout.write(f"{'subscribers':>12} {'sessions':>9} {'accepted':>9} {'seconds':>8} {'sessions/s':>11} "
+                              f"{'overruns':>9}")
+            start_id = 0
+            for count in options['subscribers']:
+                subscriber_ids = seed_subscribers(catalog, count, start=start_id)
+                start_id += count
+                subscribers = list(Subscriber.objects.filter(pk__in=subscriber_ids))
+                results = []
+
+                def simulate(thread):
+                    try:
+                        for i in range(options['sessions']):
+                            subscriber = subscribers[(thread + i) % len(subscribers)]
+                            results.append(_simulate_session(subscriber, service, 5, THROUGHPUT_CHOOSERS['maximum']))
+                    finally:
+                        connection.close()
+
+                threads = [threading.Thread(target=simulate, args=(i,)) for i in range(options['threads'])]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+
+                if len(results) != options['threads'] * options['sessions']:
+                    raise CommandError("a simulation thread failed")
+                overruns = sum(
+                    1 for subscriber in subscribers
+                    if (Session.objects.filter(subscriber=subscriber).aggregate(total=Sum('data_volume'))['total'] or 0)
+                    > subscriber.subscription_type.data_volume_3g_4g * 8
+                )
+                self.stdout.write(f"{count:>12} {len(results):>9} {results.count(''):>9} {elapsed:>8.2f} "
+                                  f"{len(results) / elapsed:>11.0f} {overruns:>9}")
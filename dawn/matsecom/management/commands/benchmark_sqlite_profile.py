@@ -0,0 +1,91 @@
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections
+
+from matsecom.benchmarking import benchmark_database, seed_catalog, seed_sessions, seed_subscribers
+from matsecom.db import is_lock_error
+from matsecom.models import Service, Session, Subscriber
+from matsecom.usage import get_running_usage
+from matsecom.views import simulate_session
+
+# the connection settings compared, NAME is the benchmark database
+PROFILES = {
+    'default': {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': {}, 'CONN_MAX_AGE': 0},
+    'production': {key: value for key, value in settings.SQLITE_PRODUCTION_DATABASE.items() if key != 'NAME'},
+}
+
+
+def _init_worker(profile: dict, name: str):
+    # forked workers must not reuse the parent's connection, and connect with the profile's settings
+    connections.close_all()
+    connections.settings['default'] = connections.configure_settings({'default': {**profile, 'NAME': name}})['default']
+    connections['default'] = connections.create_connection('default')
+
+
+# runs requests for seconds, a write_ratio share of them simulates a session, the others read a subscriber, its
+# running usage and its latest sessions like the detail and list views. The connection is released after every
+# request like Django does at the end of a request (close_old_connections), so CONN_MAX_AGE decides whether the next
+# request reconnects. Lock errors are counted, not retried
+# returns (reads, writes, lock errors)
+def _run(seed: int, seconds: float, write_ratio: float):
+    rng = random.Random(seed)
+    subscriber_ids = list(Subscriber.objects.values_list('pk', flat=True))
+    services = list(Service.objects.filter(name__in=['VC', 'BN']))
+    close_old_connections()
+    reads = writes = errors = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        try:
+            subscriber = Subscriber.objects.select_related('terminal_type', 'subscription_type') \
+                .get(pk=rng.choice(subscriber_ids))
+            if rng.random() < write_ratio:
+                simulate_session(subscriber, rng.choice(services), rng.randint(1, 5))
+                writes += 1
+            else:
+                get_running_usage(subscriber)
+                list(Session.objects.filter(subscriber=subscriber).order_by('-timestamp')[:20])
+                reads += 1
+        except OperationalError as error:
+            if not is_lock_error(error):
+                raise
+            errors += 1
+        finally:
+            close_old_connections()
+    connection.close()
+    return reads, writes, errors
+
+
+class Command(BaseCommand):
+    help = ("Compares reads and writes per second of concurrent worker processes with the default SQLite connection "
+            "settings and with the production profile (settings.SQLITE_PRODUCTION_DATABASE). Runs in throwaway "
+            "SQLite database files.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5.0, help="Duration per profile")
+        parser.add_argument('--write-ratio', type=float, default=0.2, help="Share of requests that write")
+        parser.add_argument('--subscribers', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'profile':>11} {'workers':>8} {'reads/s':>9} {'writes/s':>9} {'lock errors':>12}")
+        for name, profile in PROFILES.items():
+            # a fresh database per profile, WAL mode stays switched on in a database file
+            with tempfile.TemporaryDirectory() as directory, benchmark_database(f'{directory}/benchmark.sqlite3'):
+                catalog = seed_catalog()
+                subscriber_ids = seed_subscribers(catalog, options['subscribers'])
+                seed_sessions(catalog, subscriber_ids, options['subscribers'] * 10)
+                database = connection.settings_dict['NAME']
+                connections.close_all()
+                with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker,
+                                         initargs=(profile, database)) as executor:
+                    results = list(executor.map(_run, range(options['workers']),
+                                                [options['seconds']] * options['workers'],
+                                                [options['write_ratio']] * options['workers']))
+                reads, writes, errors = (sum(column) for column in zip(*results))
+                self.stdout.write(f"{name:>11} {options['workers']:>8} {reads / options['seconds']:>9.0f} "
+                                  f"{writes / options['seconds']:>9.0f} {errors:>12}")
@@ -0,0 +1,126 @@
+import itertools
+import json
+import platform
+import random
+import sqlite3
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from matsecom.benchmarking import benchmark_database, profile_call, seed_catalog, seed_sessions, seed_subscribers, \
+    time_call
+from matsecom.models import Session, Subscriber
+from matsecom.views import get_all_subscribers_as_csv, invoice, load_from_csv, simulate_session
+
+
+class Command(BaseCommand):
+    help = ("Times the billing and simulation hot paths (session simulation, invoicing, CSV import and export, list "
+            "views) on growing synthetic datasets and records their query counts and peak memory. Runs in a "
+            "throwaway test database, --output writes the results as JSON to compare them between releases.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000],
+                            help="Numbers of subscribers and of sessions to measure at")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed calls per hot path and size")
+        parser.add_argument('--import-rows', type=int, default=1000, help="Rows of the imported CSV")
+        parser.add_argument('--database-file', help="Run on this SQLite file instead of in memory")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = []
+        with benchmark_database(options['database_file']), override_settings(ALLOWED_HOSTS=['testserver']):
+            catalog = seed_catalog()
+            services = list(catalog['services'].values())
+            client = Client()
+            client.force_login(User.objects.create_user('benchmark'))
+            imported_imsis = itertools.count(262020000000000)
+            rng = random.Random(0)
+
+            self.stdout.write(f"{'size':>9} {'hot path':<28} {'median ms':>10} {'max ms':>10} {'queries':>8} "
+                              f"{'peak KiB':>10}")
+            for size in sorted(options['sizes']):
+                self._grow(catalog, size)
+                # random subscribers, loaded up front so their query doesn't count towards the hot paths
+                subscriber_ids = list(Subscriber.objects.values_list('pk', flat=True))
+                subscribers = itertools.cycle(Subscriber.objects.select_related('terminal_type', 'subscription_type')
+                                              .filter(pk__in=rng.sample(subscriber_ids, options['repeat'] + 1)))
+
+                def simulate():
+                    simulate_session(next(subscribers), rng.choice(services), rng.randint(1, 600))
+
+                def bill():
+                    invoice(next(subscribers))
+
+                def import_csv():
+                    rows = ['forename,surname,imsi,terminal_type,subscription_type']
+                    rows += [f'Import,Subscriber,{next(imported_imsis)},PhairPhone,GS'
+                             for _ in range(options['import_rows'])]
+                    load_from_csv('\n'.join(rows))
+
+                def get(url):
+                    def request():
+                        response = client.get(url)
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                        assert response.status_code == 200, f"{url}: {response.status_code}"
+                    return request
+
+                hot_paths = {
+                    'simulate_session': simulate,
+                    'invoice': bill,
+                    'load_from_csv': import_csv,
+                    'get_all_subscribers_as_csv': get_all_subscribers_as_csv,
+                    'subscriber list page': get('/subscribers/?action=data&length=100'),
+                    'subscriber list search': get('/subscribers/?action=data&length=100&search[value]=sub'),
+                    'session list page': get('/sessions/?action=data&length=100'),
+                    'session list by IMSI': get('/sessions/?action=data&length=100&search[value]=262010000000000'),
+                }
+                for name, function in hot_paths.items():
+                    timings = {key: round(value, 3) for key, value in time_call(function, options['repeat']).items()}
+                    result = {'size': size, 'hot_path': name, **timings, **profile_call(function)}
+                    results.append(result)
+                    self.stdout.write(f"{size:>9} {name:<28} {result['median_ms']:>10.2f} {result['max_ms']:>10.2f} "
+                                      f"{result['queries']:>8} {result['peak_memory_kib']:>10.0f}")
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({'environment': self._environment(options), 'results': results}, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    # seeds subscribers and sessions with bulk_create until there are size of each
+    def _grow(self, catalog, size: int):
+        start = time.perf_counter()
+        subscribers = Subscriber.objects.filter(imsi__lt=262020000000000).count()
+        subscriber_ids = seed_subscribers(catalog, size - subscribers, start=subscribers) if size > subscribers \
+            else []
+        missing_sessions = size - Session.objects.count()
+        if missing_sessions > 0:
+            seed_sessions(catalog, subscriber_ids or list(Subscriber.objects.values_list('pk', flat=True)),
+                          missing_sessions)
+        self.stderr.write(f"seeded {size} subscribers and sessions in {time.perf_counter() - start:.1f} s")
+
+    @staticmethod
+    def _environment(options) -> dict:
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                    cwd=settings.BASE_DIR).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'timestamp': timezone.now().isoformat(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'database': settings.DATABASES['default']['ENGINE'],
+            'sizes': sorted(options['sizes']),
+            'repeat': options['repeat'],
+            'import_rows': options['import_rows'],
+        }
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from matsecom.benchmarking import benchmark_database, seed_catalog, seed_sessions, seed_subscribers, time_call
+from matsecom.models import Session, Subscriber
+from matsecom.usage import get_unpaid_usage
+
+
+class Command(BaseCommand):
+    help = ("Measures the unpaid usage aggregation used by the session simulator and invoicing while the Session "
+            "table grows. Runs in a throwaway test database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000],
+                            help="Session table sizes to measure at, e.g. 10000 100000 1000000 10000000")
+        parser.add_argument('--subscribers', type=int, default=1000,
+                            help="Number of subscribers the background sessions are spread over")
+        parser.add_argument('--probe-sessions', type=int, default=100,
+                            help="Number of sessions of the measured subscriber, constant for all sizes")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--database-file', help="Run on this SQLite file instead of in memory")
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['database_file']):
+            catalog = seed_catalog()
+            subscriber_ids = seed_subscribers(catalog, options['subscribers'])
+            probe = Subscriber.objects.get(pk=subscriber_ids[0])
+            background_ids = subscriber_ids[1:]
+            seed_sessions(catalog, [probe.pk], options['probe_sessions'])
+
+            self.stdout.write(f"{'sessions':>12} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+            for size in sorted(options['sizes']):
+                missing = size - Session.objects.count()
+                if missing > 0:
+                    seed_sessions(catalog, background_ids, missing)
+                result = time_call(lambda: get_unpaid_usage(probe), options['repeat'])
+                self.stdout.write(f"{size:>12} {result['median_ms']:>10.3f} {result['min_ms']:>10.3f} "
+                                  f"{result['max_ms']:>10.3f}")
@@ -0,0 +1,65 @@
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+from matsecom import write_behind
+from matsecom.benchmarking import benchmark_database, seed_catalog, seed_subscribers
+from matsecom.db import run_with_retry
+from matsecom.models import Service, Session, Subscriber
+from matsecom.views import simulate_session
+
+
+def _init_worker():
+    # spawned workers start without Django, forked ones must not reuse the parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+# simulates count sessions of random subscribers (voice calls and browsing), returns the number of accepted ones
+def _simulate(count, seed, buffered, spool_dir):
+    rng = random.Random(seed)
+    with override_settings(SESSION_WRITE_BEHIND=buffered, SESSION_SPOOL_DIR=spool_dir):
+        subscribers = list(Subscriber.objects.only('terminal_type', 'subscription_type'))
+        services = list(Service.objects.filter(name__in=['VC', 'BN']))
+        accepted = 0
+        for _ in range(count):
+            result = run_with_retry(simulate_session, rng.choice(subscribers), rng.choice(services), rng.randint(1, 5))
+            accepted += result == ""
+        write_behind.flush()
+    return accepted
+
+
+class Command(BaseCommand):
+    help = ("Compares simulated sessions per second of concurrent worker processes with and without the write-behind "
+            "buffer. Runs in a throwaway SQLite database file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--sessions', type=int, default=2000, help="Sessions simulated per worker and mode")
+        parser.add_argument('--subscribers', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory, benchmark_database(f'{directory}/benchmark.sqlite3'):
+            catalog = seed_catalog()
+            seed_subscribers(catalog, options['subscribers'])
+            self.stdout.write(f"{'mode':>14} {'sessions':>9} {'accepted':>9} {'seconds':>8} {'sessions/s':>11}")
+            for buffered in (False, True):
+                before = Session.objects.count()
+                connections.close_all()
+                start = time.perf_counter()
+                with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as executor:
+                    accepted = sum(executor.map(
+                        _simulate, [options['sessions']] * options['workers'], range(options['workers']),
+                        [buffered] * options['workers'], [f'{directory}/spool'] * options['workers']))
+                elapsed = time.perf_counter() - start
+                total = options['sessions'] * options['workers']
+                if Session.objects.count() - before != accepted:
+                    raise CommandError(f"{accepted} sessions accepted, but {Session.objects.count() - before} written")
+                self.stdout.write(f"{'write-behind' if buffered else 'direct':>14} {total:>9} {accepted:>9} "
+                                  f"{elapsed:>8.2f} {total / elapsed:>11.0f}")
@@ -0,0 +1,77 @@
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.serializers import sort_dependencies
+from django.db import connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+
+SOURCE = 'sqlite_source'
+
+
+class Command(BaseCommand):
+    help = ("Copies the subscribers, sessions, invoices and users of a SQLite database into the (empty, migrated) "
+            "default database, e.g. PostgreSQL. Encrypted fields are decrypted with the SQLite settings and "
+            "encrypted again the way the default database stores them (pgcrypto on PostgreSQL).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="SQLite database file, e.g. db.sqlite3")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows inserted per query (default: 1000)")
+
+    def handle(self, *args, **options):
+        connections.settings[SOURCE] = connections.configure_settings({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': options['path']}
+        })['default']
+        try:
+            self.check_migrations()
+            with transaction.atomic():
+                for model in self.copied_models():
+                    copied = self.copy_model(model, options['batch_size'])
+                    self.stdout.write(f"{model._meta.label}: {copied} rows")
+                self.reset_sequences()
+        finally:
+            connections[SOURCE].close()
+            del connections.settings[SOURCE]
+        self.stdout.write(self.style.SUCCESS(f"Copied {options['path']}"))
+
+    # both databases have to be at the same migration, and the target must not have any data yet
+    def check_migrations(self):
+        source = MigrationExecutor(connections[SOURCE]).loader.applied_migrations.keys()
+        target = MigrationExecutor(connections['default']).loader.applied_migrations.keys()
+        if {key for key in source if key[0] == 'matsecom'} != {key for key in target if key[0] == 'matsecom'}:
+            raise CommandError("Run manage.py migrate on both databases first")
+        if any(model._base_manager.exists() for model in self.copied_models()):
+            raise CommandError("The default database already has data")
+
+    # the models of the app (with their many-to-many tables) in dependency order, and the users
+    def copied_models(self) -> list:
+        models = sort_dependencies([(apps.get_app_config('matsecom'), None)], allow_cycles=False)
+        through = [field.remote_field.through for model in models for field in model._meta.local_many_to_many]
+        return [User, *models, *through]
+
+    # copies the rows of a model in primary key order. The raw insert keeps the values as they are, including the
+    # auto_now_add timestamps, and doesn't send signals (the usage counters are copied as well)
+    def copy_model(self, model, batch_size: int) -> int:
+        fields = model._meta.local_concrete_fields
+        manager = model._base_manager.using('default')
+        batch_size = max(connections['default'].ops.bulk_batch_size(fields, [None] * batch_size), 1)
+        copied = 0
+        batch = []
+        for obj in model._base_manager.using(SOURCE).order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(obj)
+            if len(batch) == batch_size:
+                manager._insert(batch, fields=fields, raw=True)
+                copied += len(batch)
+                batch = []
+        if batch:
+            manager._insert(batch, fields=fields, raw=True)
+            copied += len(batch)
+        return copied
+
+    # makes the sequences of the primary keys continue after the copied rows (PostgreSQL)
+    def reset_sequences(self):
+        connection = connections['default']
+        statements = connection.ops.sequence_reset_sql(no_style(), self.copied_models())
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
@@ -0,0 +1,101 @@
+import contextlib
+import tempfile
+import threading
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+
+from matsecom.benchmarking import benchmark_database, seed_catalog, seed_sessions, seed_subscribers
+from matsecom.load_replay import DEFAULT_MIX, ROUTES, LoadError, percentile, run_load
+
+USERNAME = 'load-replay'
+PASSWORD = 'load-replay'
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ("Replays a mix of logged in requests (subscriber list and detail, session table, simulation, invoicing, "
+            "CSV export) over HTTP and reports requests per second and latency percentiles per route. Without --url "
+            "the requests go to an in-process server on a seeded throwaway database, with --url to a running server "
+            "(e.g. gunicorn dawn.wsgi) and its data.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--username', default=USERNAME, help="User to log in as with --url")
+        parser.add_argument('--password', default=PASSWORD, help="Password of the user with --url")
+        parser.add_argument('--concurrency', type=int, default=8, help="Logged in clients sending requests")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to send requests for")
+        parser.add_argument('--mix', nargs='+', metavar='ROUTE=WEIGHT',
+                            help=f"Relative weights of the routes ({', '.join(ROUTES)}), routes not given aren't "
+                                 f"requested (default: {' '.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+        parser.add_argument('--subscribers', type=int, default=10000,
+                            help="Subscribers (and ten times as many sessions) seeded for the in-process server")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        mix = self._parse_mix(options['mix']) if options['mix'] else DEFAULT_MIX
+        with contextlib.ExitStack() as stack:
+            if options['url']:
+                url, username, password = options['url'], options['username'], options['password']
+            else:
+                url = stack.enter_context(self._local_server(options['subscribers']))
+                username, password = USERNAME, PASSWORD
+            try:
+                stats, elapsed = run_load(url, username, password, options['concurrency'], options['duration'], mix,
+                                          options['seed'])
+            except LoadError as error:
+                raise CommandError(error)
+
+        self.stdout.write(f"{'route':<18} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} "
+                          f"{'p99 ms':>8} {'max ms':>8}")
+        for route, route_stats in stats.items():
+            self._write_row(route, route_stats.latencies, route_stats.errors, elapsed)
+        all_latencies = [latency for route_stats in stats.values() for latency in route_stats.latencies]
+        self._write_row('total', all_latencies, sum(route_stats.errors for route_stats in stats.values()), elapsed)
+
+    def _write_row(self, route: str, latencies: list, errors: int, elapsed: float):
+        self.stdout.write(f"{route:<18} {len(latencies):>9} {errors:>7} {len(latencies) / elapsed:>8.1f} "
+                          + ' '.join(f"{percentile(latencies, p) * 1000:>8.1f}" for p in (50, 90, 99, 100)))
+
+    @staticmethod
+    def _parse_mix(items: list) -> dict:
+        mix = {}
+        for item in items:
+            route, _, weight = item.partition('=')
+            if route not in ROUTES:
+                raise CommandError(f"unknown route {route}, choose from {', '.join(ROUTES)}")
+            try:
+                mix[route] = float(weight)
+            except ValueError:
+                raise CommandError(f"{item}: the weight must be a number")
+        if not any(mix.values()):
+            raise CommandError("at least one route needs a weight above 0")
+        return mix
+
+    # serves the project in a background thread on a seeded throwaway database file (the server's threads each open
+    # their own connection, so the database can't be in memory), yields the base URL
+    @contextlib.contextmanager
+    def _local_server(self, subscribers: int):
+        with tempfile.TemporaryDirectory() as directory, benchmark_database(f'{directory}/load_replay.sqlite3'):
+            catalog = seed_catalog()
+            seed_sessions(catalog, seed_subscribers(catalog, subscribers), subscribers * 10)
+            User.objects.create_user(USERNAME, password=PASSWORD)
+            connections.close_all()
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+            server.set_app(get_wsgi_application())
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                yield f'http://127.0.0.1:{server.server_port}'
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+                connections.close_all()
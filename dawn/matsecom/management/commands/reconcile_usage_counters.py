@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from matsecom.usage import reconcile_usage_counters
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the per-subscriber usage counters from the unpaid sessions and reports any drift. With "
+            "SESSION_WRITE_BEHIND, run it while no process has buffered sessions: their usage is already reserved on "
+            "the counters, but they are not in the session table yet.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report drift, don't fix the counters")
+
+    def handle(self, *args, **options):
+        drifts = reconcile_usage_counters(fix=not options['dry_run'])
+        for subscriber_id, counted, expected in drifts:
+            self.stdout.write(
+                f"subscriber {subscriber_id}: counter {counted.data_volume} Mbit / {counted.call_seconds} s, "
+                f"sessions {expected.data_volume} Mbit / {expected.call_seconds} s"
+            )
+        if not drifts:
+            self.stdout.write(self.style.SUCCESS("All usage counters are in sync"))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{len(drifts)} usage counters have drifted"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {len(drifts)} usage counters"))
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from matsecom.write_behind import recover_spool
+
+
+class Command(BaseCommand):
+    help = ("Writes the sessions left in the write-behind spool by crashed processes. Segments of running processes "
+            "are skipped, segments that were already written are only deleted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spool-dir', default=getattr(settings, 'SESSION_SPOOL_DIR', None),
+                            help="Defaults to SESSION_SPOOL_DIR")
+
+    def handle(self, *args, **options):
+        spool_dir = Path(options['spool_dir'] or Path(settings.BASE_DIR) / 'spool')
+        if not spool_dir.exists():
+            self.stdout.write(f"No spool directory {spool_dir}")
+            return
+        segments, sessions = recover_spool(spool_dir)
+        self.stdout.write(self.style.SUCCESS(f"Recovered {segments} spool segments with {sessions} sessions"))
@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from matsecom import metrics
+from matsecom.billing import finish_billing_cycle, get_or_start_billing_cycle, get_unbilled_subscriber_ids, \
+    settle_chunk
+from matsecom.db import run_with_retry
+
+
+# chunks running in parallel compete for the SQLite write lock
+# the worker processes of the pool don't run atexit handlers, so the invoices are counted right away
+def _settle_chunk(cycle_id, subscriber_ids):
+    invoiced = run_with_retry(settle_chunk, cycle_id, subscriber_ids)
+    metrics.INVOICES.inc(invoiced, run='cycle')
+    metrics.flush()
+    return invoiced
+
+
+def _init_worker():
+    # spawned workers start without Django, forked ones must not reuse the parent's database connections
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ("Invoices all subscribers for a billing cycle. Subscribers are settled in chunks across a process pool; "
+            "running the command again for the same cycle resumes it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cycle', default=timezone.now().strftime('%Y-%m'),
+                            help="Name of the billing cycle, defaults to the current month (YYYY-MM)")
+        parser.add_argument('--workers', type=int, default=4, help="Number of worker processes, 1 runs in-process")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Subscribers settled per transaction")
+
+    def handle(self, *args, **options):
+        cycle = get_or_start_billing_cycle(options['cycle'])
+        subscriber_ids = get_unbilled_subscriber_ids(cycle)
+        chunk_size = options['chunk_size']
+        chunks = [subscriber_ids[i:i + chunk_size] for i in range(0, len(subscriber_ids), chunk_size)]
+        self.stdout.write(f"Billing cycle {cycle.name}: {len(subscriber_ids)} subscribers to invoice "
+                          f"in {len(chunks)} chunks")
+
+        start = time.perf_counter()
+        invoiced = 0
+        if options['workers'] <= 1:
+            for chunk in chunks:
+                invoiced += _settle_chunk(cycle.pk, chunk)
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as executor:
+                futures = [executor.submit(_settle_chunk, cycle.pk, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    invoiced += future.result()
+        elapsed = time.perf_counter() - start
+        metrics.BILLING_RUN_DURATION.observe(elapsed, run='cycle')
+
+        finish_billing_cycle(cycle)
+        rate = invoiced / elapsed if elapsed > 0 else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Invoiced {invoiced} subscribers in {elapsed:.2f} s ({rate:.0f} subscribers/s)"
+        ))
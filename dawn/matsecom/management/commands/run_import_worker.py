@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from matsecom.import_jobs import work
+
+
+class Command(BaseCommand):
+    help = "Imports the subscriber CSV files uploaded on the subscriber list in the background."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when there are no pending jobs left")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait for new jobs when the queue is empty")
+
+    def handle(self, *args, **options):
+        work(once=options['once'], poll_interval=options['poll_interval'], log=self.stdout.write)
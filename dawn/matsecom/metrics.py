@@ -0,0 +1,266 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+# Counters and histograms in the Prometheus text format, served by MetricsView (/metrics). The values are kept in
+# a store, which only has to add amounts to keys and list them, so the metrics don't depend on where they are kept.
+# By default every process keeps its own values (MemoryStore). With settings.METRICS_DIRECTORY the processes
+# (gunicorn workers, import worker, billing runs) share them through files in that directory (DirectoryStore), and
+# /metrics shows the sum over all processes.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+BILLING_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+# seconds a DirectoryStore keeps new values in memory before it writes its file
+FLUSH_INTERVAL = 1.0
+
+
+# the values of this process, keys are (metric name, sample suffix, label items)
+class MemoryStore:
+    directory = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def add(self, key: tuple, amount: float):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._values.items())
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+# the values of all processes that use the directory
+# every process adds up its values in memory like MemoryStore and replaces its own file with them at most every
+# FLUSH_INTERVAL seconds (and when it exits), items() adds up the files of the other processes and its own values.
+# Files are never written by two processes, and they are replaced atomically, so no locks are needed between the
+# processes. The files of processes that have exited stay and keep counting towards the totals, empty the directory
+# when the server is (re)started. Values added less than FLUSH_INTERVAL seconds before a process is killed are lost
+class DirectoryStore(MemoryStore):
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = str(directory)
+        self._flush_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._new_file()
+
+    def _new_file(self):
+        self._path = os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex}.json')
+        self._flushed_at = time.monotonic()
+
+    # the thread that finds the file outdated writes it, the others don't wait for it
+    def add(self, key: tuple, amount: float):
+        super().add(key, amount)
+        if time.monotonic() - self._flushed_at >= FLUSH_INTERVAL and self._flush_lock.acquire(blocking=False):
+            try:
+                self._write()
+            finally:
+                self._flush_lock.release()
+
+    def flush(self):
+        with self._flush_lock:
+            self._write()
+
+    def _write(self):
+        self._flushed_at = time.monotonic()
+        values = [[name, suffix, [list(item) for item in label_items], value]
+                  for (name, suffix, label_items), value in super().items()]
+        if not values:
+            return
+        temporary = f'{self._path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(values, file)
+        os.replace(temporary, self._path)
+
+    def items(self) -> list:
+        values = dict(super().items())
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            if not file_name.endswith('.json') or path == self._path:
+                continue
+            try:
+                with open(path) as file:
+                    rows = json.load(file)
+            except (OSError, ValueError):
+                continue  # removed in the meantime
+            for name, suffix, label_items, value in rows:
+                key = (name, suffix, tuple(tuple(item) for item in label_items))
+                values[key] = values.get(key, 0) + value
+        return list(values.items())
+
+    # clears the values of all processes
+    def clear(self):
+        super().clear()
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.json'):
+                os.remove(os.path.join(self.directory, file_name))
+
+    # a forked process starts with the values of its parent, which the parent counts already
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._values = {}
+        self._new_file()
+
+
+_store = None
+_store_lock = threading.Lock()
+_metrics = {}  # name -> metric, in the order they were defined
+
+
+# returns the store for settings.METRICS_DIRECTORY
+def get_store() -> MemoryStore:
+    global _store
+    directory = getattr(settings, 'METRICS_DIRECTORY', None)
+    directory = str(directory) if directory else None
+    store = _store
+    if store is None or store.directory != directory:
+        with _store_lock:
+            if _store is None or _store.directory != directory:
+                if isinstance(_store, DirectoryStore):
+                    _store.flush()
+                _store = DirectoryStore(directory) if directory else MemoryStore()
+            store = _store
+    return store
+
+
+# writes the values of this process to settings.METRICS_DIRECTORY now (if it is set)
+def flush():
+    if isinstance(_store, DirectoryStore):
+        _store.flush()
+
+
+def _after_fork():
+    if isinstance(_store, DirectoryStore):
+        _store.after_fork()
+
+
+atexit.register(flush)
+os.register_at_fork(after_in_child=_after_fork)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        if name in _metrics:
+            raise ValueError(f"metric {name} is defined twice")
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        _metrics[name] = self
+
+    def _label_items(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} has the labels {', '.join(self.labels)}")
+        return tuple((label, str(labels[label])) for label in self.labels)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        get_store().add((self.name, '_total', self._label_items(labels)), amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    # counts the value in the first bucket it fits in, render() adds up the buckets
+    def observe(self, value: float, **labels):
+        label_items = self._label_items(labels)
+        bucket = next((bound for bound in self.buckets if value <= bound), math.inf)
+        store = get_store()
+        store.add((self.name, '_bucket', label_items + (('le', _format_value(bucket)),)), 1)
+        store.add((self.name, '_sum', label_items), value)
+        store.add((self.name, '_count', label_items), 1)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(label_items: tuple) -> str:
+    if not label_items:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in label_items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(label_items, escaped)) + '}'
+
+
+# returns all metrics in the Prometheus text exposition format
+def render() -> str:
+    samples = {}
+    for (name, suffix, label_items), value in get_store().items():
+        samples.setdefault(name, {})[suffix, label_items] = value
+    lines = []
+    for name, metric in _metrics.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        values = samples.get(name, {})
+        if isinstance(metric, Histogram):
+            for suffix, label_items in sorted(key for key in values if key[0] == '_count'):
+                cumulative = 0
+                for bound in (*metric.buckets, math.inf):
+                    le = (('le', _format_value(bound)),)
+                    cumulative += values.get(('_bucket', label_items + le), 0)
+                    lines.append(f"{name}_bucket{_format_labels(label_items + le)} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(label_items)} {_format_value(values['_sum', label_items])}")
+                lines.append(f"{name}_count{_format_labels(label_items)} {_format_value(values[suffix, label_items])}")
+        else:
+            for suffix, label_items in sorted(values):
+                lines.append(f"{name}{suffix}{_format_labels(label_items)} {_format_value(values[suffix, label_items])}")
+    return '\n'.join(lines) + '\n'
+
+
+# resets all values, for the tests
+def clear():
+    get_store().clear()
+
+
+# HTTP requests, recorded by RequestMetricsMiddleware, labelled by URL name (view)
+REQUEST_DURATION = Histogram('dawn_http_request_duration_seconds',
+                             "Time spent on the request per view, including streaming the body",
+                             labels=('view', 'method'))
+REQUEST_SQL_DURATION = Histogram('dawn_http_request_sql_seconds', "Time spent in SQL queries per request",
+                                 labels=('view',))
+REQUEST_PYTHON_DURATION = Histogram('dawn_http_request_python_seconds',
+                                    "Time spent outside SQL queries (Python, decryption, templates) per request",
+                                    labels=('view',))
+REQUEST_QUERIES = Histogram('dawn_http_request_queries', "SQL queries per request", labels=('view',),
+                            buckets=QUERY_BUCKETS)
+RESPONSE_SIZE = Histogram('dawn_http_response_size_bytes', "Size of the response body", labels=('view',),
+                          buckets=SIZE_BUCKETS)
+RESPONSES = Counter('dawn_http_responses', "Responses per view and status code", labels=('view', 'status'))
+
+
+# sessions, invoices and imports, recorded where they are created (views.py, billing.py, subscriber_import.py)
+SESSIONS_SIMULATED = Counter('dawn_sessions_simulated', "Simulated sessions by outcome (created or the reason they "
+                             "were rejected), service and the technology used (none if no technology fits)",
+                             labels=('outcome', 'service', 'technology'))
+INVOICES = Counter('dawn_invoices', "Invoices written, by a single invoice or a billing cycle", labels=('run',))
+BILLING_RUN_DURATION = Histogram('dawn_billing_run_duration_seconds', "Duration of a single invoice or of a "
+                                 "billing cycle", labels=('run',), buckets=BILLING_BUCKETS)
+CSV_ROWS = Counter('dawn_csv_rows_imported', "Rows of imported subscriber CSV files by result (created, skipped "
+                   "because the subscriber exists, failed)", labels=('result',))
@@ -1,12 +1,123 @@
+import threading
+import time
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db import connections
 from django.shortcuts import redirect
+from django.urls import Resolver404, resolve
+
+from . import metrics
+from .api import has_valid_token
 
 class LoginRequiredMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        if not request.user.is_authenticated and request.path not in ['/login/']:
+        # the API views authenticate their clients with tokens, see api.py, and so can the Prometheus scraper
+        if not request.user.is_authenticated and request.path not in ['/login/'] \
+                and not request.path.startswith('/api/') \
+                and not (request.path == '/metrics' and has_valid_token(request, settings.METRICS_TOKENS)):
             return redirect('login')
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+
+_local = threading.local()
+
+
+# the queries and SQL time of the request that is handled in this thread
+class _QueryRecorder:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+# execute wrapper of every connection, counts the queries while a request is recorded
+def _record_query(execute, sql, params, many, context):
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.queries += 1
+        recorder.sql_seconds += time.perf_counter() - start
+
+
+# Records the number of queries, the SQL time, the rest of the time (Python: decryption, templates, ...) and the
+# response size of every request in the histograms of metrics.py, labelled by URL name, and sends the timings in a
+# Server-Timing header (shown by the browser's developer tools). Goes first in MIDDLEWARE to time the whole stack.
+# The body of a streaming response (e.g. the CSV export) is produced after the headers are sent, so the header only
+# covers the time to the first byte, the histograms are recorded once the body has been streamed
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # the connection wrappers are per thread and alias, the wrapper is added once to each of them
+        for connection in connections.all():
+            if _record_query not in connection.execute_wrappers:
+                connection.execute_wrappers.append(_record_query)
+        recorder = _QueryRecorder()
+        _local.recorder = recorder
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _local.recorder = None
+        elapsed = time.perf_counter() - start
+        response['Server-Timing'] = (
+            f'sql;dur={recorder.sql_seconds * 1000:.1f};desc="{recorder.queries} queries", '
+            f'python;dur={(elapsed - recorder.sql_seconds) * 1000:.1f}, total;dur={elapsed * 1000:.1f}'
+        )
+        view = self._view_name(request)
+        if response.streaming and not response.is_async:
+            response.streaming_content = self._stream(response.streaming_content, request, response, view, recorder,
+                                                      elapsed)
+        else:
+            self._observe(request, response, view, recorder, elapsed, len(response.content))
+        return response
+
+    def _stream(self, content, request, response, view: str, recorder: _QueryRecorder, elapsed: float):
+        size = 0
+        iterator = iter(content)
+        while True:
+            _local.recorder = recorder
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+                _local.recorder = None
+            size += len(chunk)
+            yield chunk
+        self._observe(request, response, view, recorder, elapsed, size)
+
+    @staticmethod
+    def _observe(request, response, view: str, recorder: _QueryRecorder, elapsed: float, size: int):
+        metrics.REQUEST_DURATION.observe(elapsed, view=view, method=request.method)
+        metrics.REQUEST_SQL_DURATION.observe(recorder.sql_seconds, view=view)
+        metrics.REQUEST_PYTHON_DURATION.observe(elapsed - recorder.sql_seconds, view=view)
+        metrics.REQUEST_QUERIES.observe(recorder.queries, view=view)
+        metrics.RESPONSE_SIZE.observe(size, view=view)
+        metrics.RESPONSES.inc(view=view, status=response.status_code)
+
+    # the URL name, also for requests that were answered before the URL was resolved (e.g. the login redirect),
+    # 'unnamed' for URL patterns without a name
+    @staticmethod
+    def _view_name(request) -> str:
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                return 'unmatched'
+        if not match.url_name:
+            # view_name would fall back to the dotted path of the view function
+            return 'unnamed'
+        return ':'.join([*match.namespaces, match.url_name])
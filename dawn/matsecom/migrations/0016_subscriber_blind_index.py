@@ -0,0 +1,78 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from matsecom import blind_index
+
+
+def fill_blind_indexes(apps, schema_editor):
+    Subscriber = apps.get_model("matsecom", "Subscriber")
+    SubscriberNameToken = apps.get_model("matsecom", "SubscriberNameToken")
+    db_alias = schema_editor.connection.alias
+    subscribers = list(Subscriber.objects.using(db_alias).all())
+    tokens = []
+    for subscriber in subscribers:
+        subscriber.forename_bidx = blind_index.exact_index(
+            "forename", subscriber.forename
+        )
+        subscriber.surname_bidx = blind_index.exact_index("surname", subscriber.surname)
+        for field_name in ("forename", "surname"):
+            tokens += [
+                SubscriberNameToken(subscriber_id=subscriber.pk, token=token)
+                for token in blind_index.prefix_tokens(
+                    field_name, getattr(subscriber, field_name)
+                )
+            ]
+    Subscriber.objects.using(db_alias).bulk_update(
+        subscribers, ["forename_bidx", "surname_bidx"], batch_size=1000
+    )
+    SubscriberNameToken.objects.using(db_alias).bulk_create(tokens, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matsecom", "0015_alter_subscriber_imsi"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscriber",
+            name="forename_bidx",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="subscriber",
+            name="surname_bidx",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=64
+            ),
+        ),
+        migrations.CreateModel(
+            name="SubscriberNameToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token", models.CharField(db_index=True, max_length=64)),
+                (
+                    "subscriber",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="name_tokens",
+                        to="matsecom.subscriber",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(fill_blind_indexes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_usage_counters(apps, schema_editor):
+    Session = apps.get_model("matsecom", "Session")
+    UsageCounter = apps.get_model("matsecom", "UsageCounter")
+    db_alias = schema_editor.connection.alias
+    totals = (
+        Session.objects.using(db_alias)
+        .filter(paid=False)
+        .values("subscriber_id")
+        .annotate(data_volume=Sum("data_volume"), call_seconds=Sum("call_seconds"))
+    )
+    UsageCounter.objects.using(db_alias).bulk_create(
+        [
+            UsageCounter(
+                subscriber_id=row["subscriber_id"],
+                data_volume=row["data_volume"],
+                call_seconds=row["call_seconds"],
+            )
+            for row in totals
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matsecom", "0016_subscriber_blind_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UsageCounter",
+            fields=[
+                (
+                    "subscriber",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="usage_counter",
+                        serialize=False,
+                        to="matsecom.subscriber",
+                    ),
+                ),
+                ("data_volume", models.PositiveBigIntegerField(default=0)),
+                ("call_seconds", models.PositiveBigIntegerField(default=0)),
+                (
+                    "period_start",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+        migrations.RunPython(fill_usage_counters, migrations.RunPython.noop),
+    ]
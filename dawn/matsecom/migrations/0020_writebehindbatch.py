@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matsecom", "0019_importjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WriteBehindBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=64, unique=True)),
+                ("sessions", models.PositiveIntegerField()),
+                ("written_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matsecom", "0020_writebehindbatch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SessionArchive",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("timestamp", models.DateTimeField()),
+                ("duration", models.PositiveIntegerField()),
+                ("data_volume", models.PositiveIntegerField()),
+                ("call_seconds", models.PositiveIntegerField()),
+                ("paid", models.BooleanField(default=True)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "service",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        to="matsecom.service",
+                    ),
+                ),
+                (
+                    "subscriber",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_sessions",
+                        to="matsecom.subscriber",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matsecom", "0021_sessionarchive"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["subscriber", "timestamp"], name="invoice_subscriber_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(
+                fields=["subscriber", "paid"], name="session_subscriber_paid_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(
+                fields=["subscriber", "timestamp"], name="session_subscriber_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(
+                condition=models.Q(("paid", False)),
+                fields=["subscriber"],
+                name="session_unpaid_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:35
+
+from django.db import migrations
+
+import matsecom.pgcrypto
+
+
+def create_pgcrypto_extension(apps, schema_editor):
+    if matsecom.pgcrypto.uses_pgcrypto(schema_editor.connection):
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
+
+
+# the names of existing PostgreSQL databases were encrypted by encrypted_model_fields, nothing changes on SQLite
+def reencrypt_names(apps, schema_editor):
+    Subscriber = apps.get_model("matsecom", "Subscriber")
+    matsecom.pgcrypto.reencrypt_columns(
+        schema_editor.connection, Subscriber._meta.db_table, ["forename", "surname"]
+    )
+
+
+def restore_names(apps, schema_editor):
+    Subscriber = apps.get_model("matsecom", "Subscriber")
+    matsecom.pgcrypto.restore_client_side_encryption(
+        schema_editor.connection, Subscriber._meta.db_table, ["forename", "surname"]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matsecom", "0022_session_invoice_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_pgcrypto_extension, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="subscriber",
+            name="forename",
+            field=matsecom.pgcrypto.PgcryptoCharField(),
+        ),
+        migrations.AlterField(
+            model_name="subscriber",
+            name="surname",
+            field=matsecom.pgcrypto.PgcryptoCharField(),
+        ),
+        migrations.RunPython(reencrypt_names, restore_names),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("matsecom", "0023_pgcrypto_subscriber_names"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,9 +1,13 @@
-from django.db import models
+from django.db import connections, models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy
 from django.forms import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 
-from encrypted_model_fields.fields import EncryptedCharField, EncryptedPositiveIntegerField
+from encrypted_model_fields.fields import EncryptedPositiveIntegerField
+
+from . import blind_index
+from .pgcrypto import PgcryptoCharField, uses_pgcrypto
 
 # Create your models here.
 
@@ -60,13 +64,126 @@ class Subscription(models.Model):
     def __str__(self) -> str:
         return f"{self.name}"
     
+# forename and surname are encrypted, so they can't be filtered in SQL directly. This queryset searches them through
+# their blind indexes instead and keeps the indexes in sync on the bulk paths that bypass Subscriber.save
+class SubscriberQuerySet(models.QuerySet):
+    NAME_FIELDS = ('forename', 'surname')
+
+    # exact (case-insensitive) match on forename and/or surname
+    def with_name(self, forename=None, surname=None):
+        queryset = self
+        if forename is not None:
+            queryset = queryset.filter(forename_bidx=blind_index.exact_index('forename', forename))
+        if surname is not None:
+            queryset = queryset.filter(surname_bidx=blind_index.exact_index('surname', surname))
+        return queryset
+
+    # (case-insensitive) prefix match on forename and/or surname
+    def name_startswith(self, forename=None, surname=None):
+        queryset = self
+        for field_name, prefix in (('forename', forename), ('surname', surname)):
+            if prefix is not None:
+                queryset = queryset._prefix_filter([field_name], prefix)
+        return queryset
+
+    # every whitespace separated word of term has to be a prefix of the forename or the surname
+    def search_name(self, term: str):
+        queryset = self
+        for word in term.split():
+            queryset = queryset._prefix_filter(self.NAME_FIELDS, word)
+        return queryset
+
+    def _prefix_filter(self, field_names, prefix: str):
+        tokens = [blind_index.prefix_token(field_name, prefix) for field_name in field_names]
+        queryset = self.filter(pk__in=SubscriberNameToken.objects.filter(token__in=tokens).values('subscriber_id'))
+        normalized = blind_index.normalize_name(prefix)
+        if len(normalized) <= blind_index.PREFIX_TOKEN_MAX_LENGTH:
+            return queryset
+        if uses_pgcrypto(connections[self.db]):
+            # the names are decrypted in the database, so the rest is checked there as well
+            condition = models.Q()
+            for field_name in field_names:
+                condition |= models.Q(**{f'{field_name}__istartswith': prefix.strip()})
+            return queryset.filter(condition)
+        # the tokens only cover the first characters, check the rest on the (few) remaining candidates
+        matching_pks = [
+            subscriber.pk for subscriber in queryset.only('pk', *field_names)
+            if any(blind_index.normalize_name(getattr(subscriber, field_name)).startswith(normalized)
+                   for field_name in field_names)
+        ]
+        return self.filter(pk__in=matching_pks)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for subscriber in objs:
+            subscriber.set_name_indexes()
+        objs = super().bulk_create(objs, *args, **kwargs)
+        SubscriberNameToken.rebuild_for([subscriber for subscriber in objs if subscriber.pk is not None],
+                                        using=self.db, replace=False)
+        missing_pks = [subscriber.imsi for subscriber in objs if subscriber.pk is None]
+        if missing_pks:
+            # e.g. ignore_conflicts=True doesn't return primary keys, rebuild from the stored names instead
+            SubscriberNameToken.rebuild_for(
+                self.model.objects.using(self.db).filter(imsi__in=missing_pks).only('pk', *self.NAME_FIELDS),
+                using=self.db
+            )
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        names_changed = any(field_name in fields for field_name in self.NAME_FIELDS)
+        if names_changed:
+            for subscriber in objs:
+                subscriber.set_name_indexes()
+            fields += [f'{field_name}_bidx' for field_name in self.NAME_FIELDS if field_name in fields]
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if names_changed:
+            SubscriberNameToken.rebuild_for(objs, using=self.db)
+        return rows
+
+    def update(self, **kwargs):
+        # bulk_update() passes Case expressions and sets the index columns itself
+        names_changed = [field_name for field_name in self.NAME_FIELDS if isinstance(kwargs.get(field_name), str)]
+        if not names_changed:
+            return super().update(**kwargs)
+        for field_name in names_changed:
+            kwargs[f'{field_name}_bidx'] = blind_index.exact_index(field_name, kwargs[field_name])
+        pks = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        SubscriberNameToken.rebuild_for(self.model.objects.using(self.db).filter(pk__in=pks), using=self.db)
+        return rows
+
+
 class Subscriber(models.Model):
-    forename = EncryptedCharField(max_length=100, null=False)
-    surname = EncryptedCharField(max_length=100, null=False)
+    # encrypted in the database on PostgreSQL, in Django otherwise, see pgcrypto.py
+    forename = PgcryptoCharField(max_length=100, null=False, blind_index='forename_bidx')
+    surname = PgcryptoCharField(max_length=100, null=False, blind_index='surname_bidx')
+    # keyed HMACs of the normalized names, see blind_index.py
+    forename_bidx = models.CharField(max_length=64, db_index=True, editable=False, default='')
+    surname_bidx = models.CharField(max_length=64, db_index=True, editable=False, default='')
     imsi =  models.PositiveIntegerField(unique=True, null=False)
     terminal_type = models.ForeignKey(Terminal, on_delete=models.PROTECT)
     subscription_type = models.ForeignKey(Subscription, on_delete=models.PROTECT)
-    
+
+    objects = SubscriberQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        names_changed = update_fields is None or any(field_name in update_fields
+                                                     for field_name in SubscriberQuerySet.NAME_FIELDS)
+        if names_changed:
+            self.set_name_indexes()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'forename_bidx', 'surname_bidx'}
+        super().save(*args, **kwargs)
+        if names_changed:
+            SubscriberNameToken.rebuild_for([self], using=kwargs.get('using') or self._state.db)
+
+    def set_name_indexes(self):
+        self.forename_bidx = blind_index.exact_index('forename', self.forename)
+        self.surname_bidx = blind_index.exact_index('surname', self.surname)
+
     def clean(self):
         super().clean()
         
@@ -100,6 +217,35 @@ class Subscriber(models.Model):
     def __str__(self) -> str:
         return f"{self.surname} {self.forename} | {self.terminal_type.name} | {self.subscription_type}"
 
+# prefix tokens of the encrypted subscriber names, one row per field and prefix length
+class SubscriberNameToken(models.Model):
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name='name_tokens')
+    token = models.CharField(max_length=64, db_index=True)
+
+    # replaces the prefix tokens of the given subscribers with tokens computed from their current names
+    @classmethod
+    def rebuild_for(cls, subscribers, using=None, replace=True):
+        subscribers = list(subscribers)
+        manager = cls.objects.db_manager(using)
+        if replace:
+            manager.filter(subscriber__in=[subscriber.pk for subscriber in subscribers]).delete()
+        rows = [(subscriber.pk, token)
+                for subscriber in subscribers
+                for field_name in SubscriberQuerySet.NAME_FIELDS
+                for token in blind_index.prefix_tokens(field_name, getattr(subscriber, field_name))]
+        # there are many tokens per subscriber, a plain executemany is several times faster than bulk_create here
+        connection = connections[manager.db]
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {quote_name(cls._meta.db_table)} "
+                f"({quote_name(cls._meta.get_field('subscriber').column)}, {quote_name('token')}) VALUES (%s, %s)",
+                rows
+            )
+
+    def __str__(self) -> str:
+        return f"{self.subscriber_id} | {self.token}"
+
 class Service(models.Model):
     SERVICE_TYPES = [
         ('VC', 'Voice call'),
@@ -130,15 +276,126 @@ class Session(models.Model):
     call_seconds = models.PositiveIntegerField()
     paid = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # running usage and invoicing: the (unpaid) sessions of a subscriber
+            models.Index(fields=['subscriber', 'paid'], name='session_subscriber_paid_idx'),
+            # a subscriber's sessions by time, e.g. the session list searched by IMSI
+            models.Index(fields=['subscriber', 'timestamp'], name='session_subscriber_time_idx'),
+            # the few unpaid sessions among all the paid ones, e.g. for reconcile_usage_counters.
+            # Only created on backends with partial indexes (SQLite, PostgreSQL)
+            models.Index(fields=['subscriber'], condition=models.Q(paid=False), name='session_unpaid_idx'),
+        ]
+
     def __str__(self) -> str:
         return f"{self.subscriber} | {self.service} | {self.timestamp}"
 
+# paid sessions moved out of the Session table by manage.py archive_sessions, so the Session table (and its indexes)
+# only grows with the recent and unpaid sessions. The primary key is the one the session had in the Session table.
+# archive.SessionHistory queries both tables together
+class SessionArchive(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name='archived_sessions')
+    service = models.ForeignKey(Service, on_delete=models.PROTECT)
+    timestamp = models.DateTimeField()
+    duration = models.PositiveIntegerField()
+    data_volume = models.PositiveIntegerField()
+    call_seconds = models.PositiveIntegerField()
+    paid = models.BooleanField(default=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.subscriber} | {self.service} | {self.timestamp} (archived)"
+
+# running usage of the subscriber's current billing period, i.e. the sum of the unpaid sessions. It is updated when a
+# session is created and reduced when invoice() settles sessions, so the quota check is a single-row read.
+# manage.py reconcile_usage_counters rebuilds it from the sessions
+class UsageCounter(models.Model):
+    subscriber = models.OneToOneField(Subscriber, on_delete=models.CASCADE, primary_key=True,
+                                      related_name='usage_counter')
+    data_volume = models.PositiveBigIntegerField(default=0)
+    call_seconds = models.PositiveBigIntegerField(default=0)
+    period_start = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        return f"{self.subscriber_id} | {self.data_volume} Mbit | {self.call_seconds} s"
+
+# a run of manage.py run_billing_cycle, sessions up to session_cutoff are settled by it
+class BillingCycle(models.Model):
+    name = models.CharField(max_length=20, unique=True)
+    session_cutoff = models.PositiveBigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.name}"
+
 class Invoice(models.Model):
     subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE)
+    # null for invoices created one by one through CreateInvoiceView
+    billing_cycle = models.ForeignKey(BillingCycle, on_delete=models.PROTECT, null=True, blank=True,
+                                      related_name='invoices')
     timestamp = models.DateTimeField(auto_now_add=True)
     data_volume = models.PositiveIntegerField()
     call_minutes = models.PositiveIntegerField()
     charges = models.PositiveIntegerField()
 
+    class Meta:
+        constraints = [
+            # makes billing cycle runs idempotent per subscriber
+            models.UniqueConstraint(fields=['subscriber', 'billing_cycle'], name='unique_invoice_per_billing_cycle'),
+        ]
+        indexes = [
+            # a subscriber's invoices by time
+            models.Index(fields=['subscriber', 'timestamp'], name='invoice_subscriber_time_idx'),
+        ]
+
     def __str__(self) -> str:
         return f"{self.subscriber} | {self.timestamp}"
+
+# a subscriber CSV upload that is imported in the background by manage.py run_import_worker
+class ImportJob(models.Model):
+    PENDING = 'P'
+    RUNNING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    file_name = models.CharField(max_length=255)  # path of the uploaded file in default_storage
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_created = models.PositiveIntegerField(default=0)
+    rows_skipped = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # renewed by the worker while the job runs, a running job without a recent heartbeat lost its worker
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)  # number of times a worker claimed the job
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return self.rows_processed / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.file_name} | {self.get_status_display()}"
+
+# a batch of sessions written by the write-behind buffer (write_behind.py), named after the spool segment it was read
+# from. It is written in the same transaction as the sessions, so a recovered segment is never inserted twice
+class WriteBehindBatch(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+    sessions = models.PositiveIntegerField()
+    written_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} | {self.sessions} sessions"
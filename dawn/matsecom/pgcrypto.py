@@ -0,0 +1,163 @@
+from django.conf import settings
+from django.db import connections, models
+from django.db.backends.signals import connection_created
+from django.db.models.expressions import Col
+from django.db.models.lookups import Exact, IExact, In
+from django.utils.functional import cached_property
+
+from encrypted_model_fields.fields import EncryptedCharField, decrypt_str, encrypt_str
+
+from . import blind_index
+
+# Database-side encryption of the subscriber names on PostgreSQL (DAWN_DATABASE=postgresql, see settings.py).
+# encrypted_model_fields encrypts in Django, so the database only ever sees ciphertext and can't filter, order or
+# compare the names. On PostgreSQL, PgcryptoCharField encrypts on write with pgp_sym_encrypt and decrypts every
+# reference to the column with pgp_sym_decrypt instead, so ordinary ORM filters, ordering and lookups run in SQL.
+# The key is set once per connection as the session setting KEY_SETTING, so it never appears in the queries.
+# Decrypting in a WHERE clause can't use an index, so exact, iexact and in filters on a field with a blind index (see
+# blind_index.py) first match its indexed HMAC column and only decrypt the rows found there.
+#
+# On the other backends (SQLite) the field is the client-side encrypted EncryptedCharField it replaces, the column
+# holds the same text either way, which keeps the migrations backend-independent.
+
+KEY_SETTING = 'dawn.pgcrypto_key'
+ARMOR_HEADER = '-----BEGIN PGP MESSAGE-----'
+
+
+# returns whether the names are encrypted in the database on this connection
+def uses_pgcrypto(connection) -> bool:
+    return connection.vendor == 'postgresql'
+
+
+def _set_key(sender, connection, **kwargs):
+    if uses_pgcrypto(connection):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config(%s, %s, false)", [KEY_SETTING, settings.PGCRYPTO_KEY])
+
+
+connection_created.connect(_set_key, dispatch_uid='matsecom.pgcrypto.set_key')
+
+
+# a column reference that reads the plain value
+class DecryptedCol(Col):
+    def as_sql(self, compiler, connection):
+        sql, params = super().as_sql(compiler, connection)
+        if uses_pgcrypto(connection):
+            sql = f"pgp_sym_decrypt(dearmor({sql}), current_setting('{KEY_SETTING}'))"
+        return sql, params
+
+
+# blind_index is the name of the field that holds the exact blind index of the value (blind_index.exact_index). It is
+# only used to build queries and is not part of the column, so it is left out of the migrations
+class PgcryptoCharField(EncryptedCharField):
+    def __init__(self, *args, blind_index=None, **kwargs):
+        self.blind_index = blind_index
+        super().__init__(*args, **kwargs)
+
+    def get_col(self, alias, output_field=None):
+        if alias == self.model._meta.db_table and (output_field is None or output_field == self):
+            return self.cached_col
+        return DecryptedCol(alias, self, output_field)
+
+    @cached_property
+    def cached_col(self):
+        return DecryptedCol(self.model._meta.db_table, self)
+
+    # wraps the value in INSERT and UPDATE statements
+    def get_placeholder(self, value, compiler, connection):
+        if uses_pgcrypto(connection):
+            return f"armor(pgp_sym_encrypt(%s, current_setting('{KEY_SETTING}')))"
+        return '%s'
+
+    def get_db_prep_save(self, value, connection):
+        if uses_pgcrypto(connection):
+            return models.CharField.get_db_prep_save(self, value, connection)
+        return super().get_db_prep_save(value, connection)
+
+    def from_db_value(self, value, expression, connection):
+        if uses_pgcrypto(connection):
+            return value
+        return super().from_db_value(value, expression, connection)
+
+
+# matches the blind index column before the decrypted value, so the database looks the value up in the index of
+# the blind index and only decrypts the candidates it finds there (the blind index is case-insensitive, the
+# decrypted comparison keeps the lookup's own semantics)
+class BlindIndexLookupMixin:
+    def as_sql(self, compiler, connection):
+        sql, params = super().as_sql(compiler, connection)
+        field = self.lhs.target if isinstance(self.lhs, DecryptedCol) else None
+        values = [self.rhs] if isinstance(self.rhs, str) else self.rhs
+        if field is None or field.blind_index is None or not uses_pgcrypto(connection) \
+                or not isinstance(values, (list, tuple, set)) or not all(isinstance(value, str) for value in values):
+            return sql, params
+        index_sql, index_params = compiler.compile(
+            Col(self.lhs.alias, field.model._meta.get_field(field.blind_index)))
+        indexes = [blind_index.exact_index(field.name, value) for value in values]
+        return (f"({index_sql} IN ({', '.join(['%s'] * len(indexes))}) AND {sql})",
+                [*index_params, *indexes, *params])
+
+
+@PgcryptoCharField.register_lookup
+class BlindIndexExact(BlindIndexLookupMixin, Exact):
+    pass
+
+
+@PgcryptoCharField.register_lookup
+class BlindIndexIExact(BlindIndexLookupMixin, IExact):
+    pass
+
+
+@PgcryptoCharField.register_lookup
+class BlindIndexIn(BlindIndexLookupMixin, In):
+    pass
+
+
+# re-encrypts the values of columns that are still encrypted by encrypted_model_fields (e.g. tables copied over from
+# SQLite as they are) with pgcrypto, values that are pgcrypto encrypted already are left alone
+# returns the number of rows changed
+def reencrypt_columns(connection, table: str, columns: list) -> int:
+    if not uses_pgcrypto(connection):
+        return 0
+    quote_name = connection.ops.quote_name
+    changed = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT id, {', '.join(quote_name(column) for column in columns)} FROM {quote_name(table)}")
+        rows = [row for row in cursor.fetchall()
+                if any(value is not None and not value.startswith(ARMOR_HEADER) for value in row[1:])]
+        for pk, *values in rows:
+            assignments = []
+            params = []
+            for column, value in zip(columns, values):
+                if value is not None and not value.startswith(ARMOR_HEADER):
+                    assignments.append(
+                        f"{quote_name(column)} = armor(pgp_sym_encrypt(%s, current_setting('{KEY_SETTING}')))")
+                    params.append(decrypt_str(value))
+            cursor.execute(f"UPDATE {quote_name(table)} SET {', '.join(assignments)} WHERE id = %s", [*params, pk])
+            changed += 1
+    return changed
+
+
+# the reverse of reencrypt_columns, encrypts pgcrypto encrypted values with encrypted_model_fields again
+# returns the number of rows changed
+def restore_client_side_encryption(connection, table: str, columns: list) -> int:
+    if not uses_pgcrypto(connection):
+        return 0
+    quote_name = connection.ops.quote_name
+    decrypted = [f"pgp_sym_decrypt(dearmor({quote_name(column)}), current_setting('{KEY_SETTING}'))"
+                 for column in columns]
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT id, {', '.join(decrypted)} FROM {quote_name(table)}")
+        rows = cursor.fetchall()
+        cursor.executemany(
+            f"UPDATE {quote_name(table)} SET {', '.join(f'{quote_name(column)} = %s' for column in columns)} "
+            f"WHERE id = %s",
+            [[None if value is None else encrypt_str(value).decode() for value in values] + [pk]
+             for pk, *values in rows]
+        )
+    return len(rows)
+
+
+# returns whether PgcryptoCharFields can be filtered and ordered in SQL on the database alias
+def names_in_database(using: str = 'default') -> bool:
+    return uses_pgcrypto(connections[using])
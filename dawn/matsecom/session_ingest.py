@@ -0,0 +1,113 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from . import catalog
+from .api import ApiRecordError
+from .models import Session, Subscriber
+from .usage import record_sessions_usage
+
+# maximum number of records accepted in one request
+MAX_INGEST_RECORDS = 100000
+
+
+class IngestReport:
+    def __init__(self):
+        self.records = 0
+        self.created = 0
+        self.rejections = []  # (index in the request, {field: [messages]})
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def records_per_second(self) -> float:
+        return self.records / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'records': self.records,
+            'created': self.created,
+            'rejected': len(self.rejections),
+            'rejections': [{'index': index, 'errors': errors} for index, errors in self.rejections],
+            'seconds': round(self.elapsed, 3),
+            'records_per_second': round(self.records_per_second, 1),
+        }
+
+
+# creates unpaid sessions from records (dicts with imsi, service, duration, data_volume and call_seconds) produced
+# by the mediation layer. The service is given by name (e.g. "BN") or primary key.
+# Records are validated with the validators of the Session fields, invalid records and unknown IMSIs or services are
+# reported and skipped. The IMSIs are resolved with one query per max_query_params IMSIs, the sessions are inserted
+# with bulk_create in batches of batch_size and the subscribers' usage counters are updated in bulk, all in one
+# transaction
+def ingest_sessions(records: list, batch_size: int = 5000) -> IngestReport:
+    report = IngestReport()
+    report.records = len(records)
+    services = catalog.get_services_by_key()
+    with transaction.atomic():
+        subscribers = _subscribers_by_imsi(records)
+        sessions = []
+        for index, record in enumerate(records):
+            session = _session_from_record(record, subscribers, services)
+            if isinstance(session, dict):
+                report.rejections.append((index, session))
+            else:
+                sessions.append(session)
+        Session.objects.bulk_create(sessions, batch_size=batch_size)
+        record_sessions_usage(sessions)
+    report.created = len(sessions)
+    report.elapsed = time.perf_counter() - report.started
+    return report
+
+
+# returns {imsi: subscriber id} of the IMSIs in records, looked up in chunks of max_query_params IMSIs (999 on
+# SQLite, unlimited on PostgreSQL) so that one lookup never exceeds the database's parameter limit
+def _subscribers_by_imsi(records: list) -> dict:
+    imsis = set()
+    for record in records:
+        try:
+            imsis.add(int(record['imsi']))
+        except (KeyError, TypeError, ValueError):
+            pass
+    imsis = sorted(imsis)
+    chunk_size = connection.features.max_query_params or len(imsis) or 1
+    subscribers = {}
+    for start in range(0, len(imsis), chunk_size):
+        chunk = imsis[start:start + chunk_size]
+        subscribers.update(Subscriber.objects.filter(imsi__in=chunk).values_list('imsi', 'pk'))
+    return subscribers
+
+
+# returns an unsaved Session, or a dict {field: [messages]} if the record is rejected
+def _session_from_record(record, subscribers: dict, services: dict):
+    if isinstance(record, ApiRecordError):
+        return {'__all__': [record.message]}
+    if not isinstance(record, dict):
+        return {'__all__': ["record must be a JSON object"]}
+    errors = {}
+    try:
+        subscriber_id = subscribers[int(record.get('imsi'))]
+    except (KeyError, TypeError, ValueError):
+        errors['imsi'] = [f"unknown IMSI {record.get('imsi')}"]
+        subscriber_id = None
+    # the service is a name or primary key, other JSON values (lists, objects, booleans) are never a service
+    service = record.get('service')
+    is_key = isinstance(service, (str, int)) and not isinstance(service, bool)
+    service = services.get(service) if is_key else None
+    if service is None:
+        errors['service'] = [f"unknown service {record.get('service')}"]
+
+    session = Session(
+        subscriber_id=subscriber_id,
+        service=service,
+        duration=record.get('duration'),
+        data_volume=record.get('data_volume', 0),
+        call_seconds=record.get('call_seconds', 0),
+        paid=False
+    )
+    try:
+        session.clean_fields(exclude=['subscriber', 'service', 'timestamp'])
+    except ValidationError as error:
+        errors.update(error.message_dict)
+    return errors or session
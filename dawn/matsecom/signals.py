@@ -0,0 +1,29 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import catalog
+from .models import Service, Session, Subscription, Technology, Terminal, ThroughputPercentage
+from .usage import UsageSummary, record_usage, settle_usage
+
+
+# keeps the subscriber's UsageCounter in sync with the unpaid sessions
+@receiver(post_save, sender=Session)
+def count_session_usage(sender, instance: Session, created: bool, **kwargs):
+    # sessions created by _simulate_session have reserved their usage already
+    if created and not instance.paid and not getattr(instance, 'usage_recorded', False):
+        record_usage(instance.subscriber_id, int(instance.data_volume), instance.call_seconds)
+
+
+@receiver(post_delete, sender=Session)
+def uncount_session_usage(sender, instance: Session, **kwargs):
+    if not instance.paid:
+        settle_usage(instance.subscriber_id, UsageSummary(int(instance.data_volume), instance.call_seconds),
+                     new_period=False)
+
+
+# reference data cached in catalog.py
+for model in (ThroughputPercentage, Technology, Terminal, Subscription, Service):
+    post_save.connect(catalog.invalidate, sender=model, dispatch_uid=f'catalog_save_{model.__name__}')
+    post_delete.connect(catalog.invalidate, sender=model, dispatch_uid=f'catalog_delete_{model.__name__}')
+for through in (Technology.achievable_throughput_percentages.through, Terminal.supported_technologies.through):
+    m2m_changed.connect(catalog.invalidate, sender=through, dispatch_uid=f'catalog_m2m_{through.__name__}')
@@ -0,0 +1,199 @@
+from typing import NamedTuple
+
+import numpy as np
+
+from . import catalog as reference_data
+from .models import Subscriber, UsageCounter
+
+# Offline batch version of views._simulate_session for capacity planning ("what happens if N subscribers use service
+# X for Y seconds"). The catalog is loaded once and turned into arrays, throughput qualities are drawn with a seeded
+# numpy RNG and the voice, bandwidth and data volume rules are applied to whole arrays of sessions.
+# Nothing is written to the database.
+
+# outcome codes, OUTCOMES[code] is the string _simulate_session returns
+SUCCESS, CALLING_NOT_POSSIBLE, NOT_ENOUGH_BANDWIDTH, NOT_ENOUGH_DATA_VOLUME = range(4)
+OUTCOMES = ["", "calling not possible", "not enough bandwidth", "not enough data volume"]
+
+
+class SimulationSubscribers(NamedTuple):
+    subscriber_ids: np.ndarray
+    terminal_ids: np.ndarray
+    subscription_ids: np.ndarray
+    used_data_volume: np.ndarray  # running usage in Mbit at the start of the simulation
+
+
+class SimulationResult(NamedTuple):
+    outcomes: np.ndarray  # outcome code per session
+    data_volume: np.ndarray  # Mbit per session, 0 if the session failed
+    call_seconds: np.ndarray  # per session, 0 if the session failed
+    subscriber_data_volume: np.ndarray  # total Mbit per subscriber, including used_data_volume
+
+    # returns the number of sessions per outcome string
+    def counts(self) -> dict:
+        counts = np.bincount(self.outcomes, minlength=len(OUTCOMES))
+        return {outcome: int(count) for outcome, count in zip(OUTCOMES, counts)}
+
+    # returns percentiles (default: 50/90/99) of the data volume of the successful data sessions and of the total
+    # data volume per subscriber
+    def usage_distribution(self, percentiles=(50, 90, 99)) -> dict:
+        session_volumes = self.data_volume[(self.outcomes == SUCCESS) & (self.call_seconds == 0)]
+        return {
+            'session_data_volume': _percentiles(session_volumes, percentiles),
+            'subscriber_data_volume': _percentiles(self.subscriber_data_volume, percentiles),
+        }
+
+
+def _percentiles(values: np.ndarray, percentiles) -> dict:
+    if len(values) == 0:
+        return {p: 0.0 for p in percentiles}
+    return {p: float(value) for p, value in zip(percentiles, np.percentile(values, percentiles))}
+
+
+# loads the terminal, subscription and running usage of subscribers (all if subscriber_ids is None) into arrays
+def load_subscribers(subscriber_ids=None) -> SimulationSubscribers:
+    subscribers = Subscriber.objects.order_by('pk')
+    counters = UsageCounter.objects.all()
+    if subscriber_ids is not None:
+        subscribers = subscribers.filter(pk__in=subscriber_ids)
+        counters = counters.filter(subscriber_id__in=subscriber_ids)
+    rows = np.array(list(subscribers.values_list('pk', 'terminal_type_id', 'subscription_type_id')),
+                    dtype=np.int64).reshape(-1, 3)
+    used = dict(counters.values_list('subscriber_id', 'data_volume'))
+    return SimulationSubscribers(
+        rows[:, 0], rows[:, 1], rows[:, 2],
+        np.array([used.get(pk, 0) for pk in rows[:, 0]], dtype=np.int64)
+    )
+
+
+class SimulationEngine:
+    def __init__(self, catalog=None):
+        catalog = catalog or reference_data.get_catalog()
+
+        self.terminal_ids = np.array(sorted(catalog.terminals), dtype=np.int64)
+        capabilities = [catalog.terminal_capabilities[pk] for pk in self.terminal_ids]
+        self.voice_call_support = np.array([c.voice_call_support for c in capabilities], dtype=bool)
+        # achievable throughputs in hundredths of Mbit/s per terminal, technology slot and throughput percentage,
+        # with the number of percentages per slot (0 for unused slots)
+        technologies = [
+            [t for t in catalog.terminal_technologies[pk]
+             if t.maximum_throughput is not None and catalog.technology_percentages[t.pk]]
+            for pk in self.terminal_ids
+        ]
+        slots = max([len(t) for t in technologies] + [1])
+        depth = max([len(p) for p in catalog.technology_percentages.values()] + [1])
+        self.throughputs = np.zeros((len(self.terminal_ids), slots, depth), dtype=np.int64)
+        self.percentage_counts = np.zeros((len(self.terminal_ids), slots), dtype=np.int64)
+        for i, terminal_technologies in enumerate(technologies):
+            for slot, technology in enumerate(terminal_technologies):
+                percentages = catalog.technology_percentages[technology.pk]
+                self.percentage_counts[i, slot] = len(percentages)
+                self.throughputs[i, slot, :len(percentages)] = [
+                    capabilities[i].throughputs[technology.pk, tp.pk] for tp in percentages
+                ]
+
+        self.subscription_ids = np.array(sorted(catalog.subscriptions), dtype=np.int64)
+        # included data volume in hundredths of Mbit
+        self.data_volume_limits = np.array(
+            [catalog.subscriptions[pk].data_volume_3g_4g * 800 for pk in self.subscription_ids], dtype=np.int64)
+
+        self.service_ids = np.array(sorted(catalog.services), dtype=np.int64)
+        self.voice_services = np.array([catalog.services[pk].name == 'VC' for pk in self.service_ids], dtype=bool)
+        self.required_data_rates = np.array(
+            [reference_data.to_hundredths(catalog.services[pk].required_data_rate) for pk in self.service_ids],
+            dtype=np.int64)
+        self._catalog = catalog
+
+    # simulates sessions in the given order, session i is subscribers[subscribers_index[i]] using service_ids[i] for
+    # durations[i] seconds. Successful data sessions count towards the subscriber's data volume for later sessions,
+    # like consecutive calls of _simulate_session
+    # the throughput of each session is drawn like catalog.choose_random_throughput_percentages with a numpy RNG
+    # seeded with seed. A throughput_chooser (Terminal -> list of (Technology, ThroughputPercentage), see
+    # _simulate_session) can be given instead, it is called once per terminal
+    def run(self, subscribers: SimulationSubscribers, subscriber_index, service_ids, durations, seed=None,
+            throughput_chooser=None) -> SimulationResult:
+        subscriber_index = np.asarray(subscriber_index, dtype=np.int64)
+        durations = np.asarray(durations, dtype=np.int64)
+        terminals = np.searchsorted(self.terminal_ids, subscribers.terminal_ids)[subscriber_index]
+        services = np.searchsorted(self.service_ids, np.asarray(service_ids, dtype=np.int64))
+        voice = self.voice_services[services]
+
+        outcomes = np.full(len(durations), SUCCESS, dtype=np.int64)
+        outcomes[voice & ~self.voice_call_support[terminals]] = CALLING_NOT_POSSIBLE
+        call_seconds = np.where(voice & (outcomes == SUCCESS), durations, 0)
+
+        data = np.flatnonzero(~voice)
+        if throughput_chooser is None:
+            throughput = self._draw_throughputs(terminals[data], np.random.default_rng(seed))
+        else:
+            throughput = self._chosen_throughputs(throughput_chooser)[terminals[data]]
+        # a terminal without data technologies has a throughput of NO_THROUGHPUT, so it never has enough bandwidth
+        bandwidth_ok = throughput >= self.required_data_rates[services[data]]
+        outcomes[data[~bandwidth_ok]] = NOT_ENOUGH_BANDWIDTH
+
+        candidates = data[bandwidth_ok]
+        volumes = throughput[bandwidth_ok] * durations[candidates]  # hundredths of Mbit
+        subscription_limits = self.data_volume_limits[
+            np.searchsorted(self.subscription_ids, subscribers.subscription_ids)]
+        accepted = _accept_within_limits(subscriber_index[candidates], volumes,
+                                         subscription_limits - subscribers.used_data_volume * 100)
+        outcomes[candidates[~accepted]] = NOT_ENOUGH_DATA_VOLUME
+
+        data_volume = np.zeros(len(durations), dtype=np.int64)
+        data_volume[candidates[accepted]] = volumes[accepted] // 100
+        subscriber_data_volume = subscribers.used_data_volume + np.bincount(
+            subscriber_index, weights=data_volume, minlength=len(subscribers.subscriber_ids)).astype(np.int64)
+        return SimulationResult(outcomes, data_volume, call_seconds, subscriber_data_volume)
+
+    # draws one throughput percentage per technology of each session's terminal and returns the fastest throughput
+    # per session in hundredths of Mbit/s, NO_THROUGHPUT for terminals without data technologies
+    def _draw_throughputs(self, terminals: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        counts = self.percentage_counts[terminals]
+        choices = (rng.random(counts.shape) * counts).astype(np.int64)
+        slots = np.arange(counts.shape[1])
+        drawn = self.throughputs[terminals[:, None], slots[None, :], choices]
+        return np.where(counts > 0, drawn, reference_data.NO_THROUGHPUT).max(axis=1)
+
+    def _chosen_throughputs(self, throughput_chooser) -> np.ndarray:
+        return np.array([
+            self._catalog.terminal_capabilities[pk].fastest_throughput(throughput_chooser(self._catalog.terminals[pk]))
+            for pk in self.terminal_ids
+        ], dtype=np.int64).reshape(-1)
+
+
+# returns which data sessions fit into their subscriber's remaining data volume when they are accepted in order
+# (a rejected session doesn't use up data volume, so a later, smaller one may still fit)
+# groups are subscriber positions, volumes and remaining are in hundredths of Mbit, accepted sessions use up their
+# volume rounded down to whole Mbit like the Session rows written by _simulate_session
+def _accept_within_limits(groups: np.ndarray, volumes: np.ndarray, remaining: np.ndarray) -> np.ndarray:
+    order = np.argsort(groups, kind='stable')
+    groups = groups[order]
+    volumes = volumes[order]
+    used = volumes // 100 * 100
+    limits = remaining[groups]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else np.zeros(0, np.int64)
+    group_starts = np.repeat(starts, np.diff(np.r_[starts, len(groups)]))
+
+    accepted = np.ones(len(groups), dtype=bool)
+    while True:
+        accepted_use = np.where(accepted, used, 0)
+        before = np.cumsum(accepted_use) - accepted_use
+        before -= before[group_starts]
+        violations = np.flatnonzero(accepted & (before + volumes > limits))
+        if len(violations) == 0:
+            break
+        # the first violation of every subscriber is final, the sessions before it fit
+        first = violations[np.unique(groups[violations], return_index=True)[1]]
+        accepted[first] = False
+        # later sessions that don't even fit into what was left at the first violation are rejected as well,
+        # so a subscriber running out of data volume doesn't take one round per session
+        left = np.full(len(remaining), np.iinfo(np.int64).max)
+        left[groups[first]] = limits[first] - before[first]
+        first_of_group = np.full(len(remaining), np.iinfo(np.int64).max)
+        first_of_group[groups[first]] = first
+        after_first = np.arange(len(groups)) > first_of_group[groups]
+        accepted[after_first & (volumes > left[groups])] = False
+
+    result = np.empty(len(groups), dtype=bool)
+    result[order] = accepted
+    return result
+
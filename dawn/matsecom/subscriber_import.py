@@ -0,0 +1,141 @@
+import contextlib
+import csv
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from . import catalog, metrics
+from .models import Subscriber
+
+CSV_COLUMNS = ['forename', 'surname', 'imsi', 'terminal_type', 'subscription_type']
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.skipped = 0  # subscribers that already exist
+        self.errors = []  # (line number, message)
+        self.started = time.perf_counter()
+        self._counted = {'created': 0, 'skipped': 0, 'failed': 0}
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    # adds the rows since the last call to metrics.CSV_ROWS
+    def count_rows(self):
+        counts = {'created': self.created, 'skipped': self.skipped, 'failed': len(self.errors)}
+        for result, count in counts.items():
+            if count > self._counted[result]:
+                metrics.CSV_ROWS.inc(count - self._counted[result], result=result)
+        self._counted = counts
+
+    def as_dict(self, max_errors: int = 1000) -> dict:
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'skipped': self.skipped,
+            'failed': len(self.errors),
+            'errors': [{'line': line, 'message': message} for line, message in self.errors[:max_errors]],
+        }
+
+
+# imports subscribers from CSV lines (a file object, io.StringIO, ...) with the columns in CSV_COLUMNS and a header
+# Existing IMSIs are skipped, invalid rows are reported in the returned ImportReport instead of stopping the import.
+# Terminals, subscriptions and existing IMSIs are loaded once up front and the subscribers are inserted with
+# bulk_create in batches of batch_size. With single_transaction=False every batch is committed on its own, so
+# progress(report), which is called after every batch, can be observed from other connections
+def import_subscribers_csv(lines, batch_size: int = 5000, progress=None, single_transaction: bool = True) \
+        -> ImportReport:
+    report = ImportReport()
+    with transaction.atomic() if single_transaction else contextlib.nullcontext():
+        existing_imsis = set(Subscriber.objects.values_list('imsi', flat=True))
+        terminals = {terminal.name: terminal.pk for terminal in catalog.get_terminals()}
+        subscriptions = {subscription.name: subscription.pk for subscription in catalog.get_subscriptions()}
+
+        reader = csv.reader(lines)
+        next(reader, None)
+        batch = []
+        for row in reader:
+            report.rows += 1
+            subscriber = _subscriber_from_row(row, reader.line_num, existing_imsis, terminals, subscriptions, report)
+            if subscriber is None:
+                continue
+            existing_imsis.add(subscriber.imsi)
+            batch.append((reader.line_num, subscriber))
+            if len(batch) >= batch_size:
+                _insert_batch(batch, report, progress)
+                batch = []
+        _insert_batch(batch, report, progress)
+    return report
+
+
+# returns the validated (unsaved) subscriber of a CSV row, or None if the row is skipped or invalid
+def _subscriber_from_row(row, line, existing_imsis, terminals, subscriptions, report):
+    if len(row) != len(CSV_COLUMNS):
+        report.errors.append((line, f"expected {len(CSV_COLUMNS)} columns, got {len(row)}"))
+        return None
+    forename, surname, imsi, terminal, subscription = row
+    try:
+        imsi = int(imsi)
+    except ValueError:
+        report.errors.append((line, f"IMSI {imsi} of user {forename} {surname} is not a number"))
+        return None
+    if imsi in existing_imsis:
+        # subscriber already exists
+        report.skipped += 1
+        return None
+    if terminal not in terminals:
+        report.errors.append((line, f"terminal {terminal} of user {forename} {surname} does not exist"))
+        return None
+    if subscription not in subscriptions:
+        report.errors.append((line, f"subscription {subscription} of user {forename} {surname} does not exist"))
+        return None
+    subscriber = Subscriber(
+        forename=forename,
+        surname=surname,
+        imsi=imsi,
+        terminal_type_id=terminals[terminal],
+        subscription_type_id=subscriptions[subscription]
+    )
+    try:
+        subscriber.clean()
+    except ValidationError as error:
+        report.errors.append((line, "; ".join(error.messages)))
+        return None
+    return subscriber
+
+
+# inserts a batch of (line number, subscriber) tuples
+# if the batch violates a constraint (e.g. a subscriber with the same IMSI was created since the IMSIs were loaded),
+# its rows are inserted one at a time, so only the offending rows are lost: an IMSI that exists by now is skipped,
+# other failures are reported as errors of their line
+def _insert_batch(batch, report, progress):
+    if batch:
+        try:
+            with transaction.atomic():
+                Subscriber.objects.bulk_create([subscriber for line, subscriber in batch])
+            report.created += len(batch)
+        except IntegrityError:
+            for line, subscriber in batch:
+                _insert_row(line, subscriber, report)
+    report.count_rows()
+    if progress is not None:
+        progress(report)
+
+
+def _insert_row(line, subscriber, report):
+    subscriber.pk = None  # may have been set by the rolled back batch
+    try:
+        with transaction.atomic():
+            Subscriber.objects.bulk_create([subscriber])
+        report.created += 1
+    except IntegrityError as error:
+        if Subscriber.objects.filter(imsi=subscriber.imsi).exists():
+            report.skipped += 1
+        else:
+            report.errors.append((line, f"user {subscriber.forename} {subscriber.surname} could not be saved: "
+                                        f"{error}"))
@@ -1,7 +1,38 @@
-from django.test import TestCase
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-from .models import Subscriber, Subscription, Service, Terminal, Technology, ThroughputPercentage
-from .views import _simulate_session
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import ResolverMatch
+from django.utils import timezone
+from encrypted_model_fields.fields import encrypt_str
+
+from . import metrics, pgcrypto, write_behind
+from .archive import SessionHistory
+from .backends.sqlite3 import base as sqlite_backend
+from .benchmarking import seed_catalog, seed_subscribers
+from .billing import get_or_start_billing_cycle, settle_chunk
+from .catalog import NO_THROUGHPUT, choose_random_throughput_percentages, get_catalog, get_supported_technologies, \
+    get_terminal_capabilities
+from .import_jobs import JobLeaseLost, claim_next_job, queue_import, run_import_job
+from .middleware import RequestMetricsMiddleware
+from .models import BillingCycle, ImportJob, Invoice, Session, SessionArchive, Subscriber, SubscriberNameToken, UsageCounter, WriteBehindBatch, Subscription, Service, Terminal, Technology, ThroughputPercentage
+from .session_ingest import MAX_INGEST_RECORDS
+from .simulation import OUTCOMES, SimulationEngine, load_subscribers
+from .subscriber_import import import_subscribers_csv
+from .usage import UsageSummary, get_running_usage, get_unpaid_usage, rate_usage, reconcile_usage_counters
+from .views import THROUGHPUT_CHOOSERS, MetricsView, _evaluate_session, _simulate_session, _simulate_sessions, get_all_subscribers_as_csv, invoice, load_from_csv, simulate_session
 
 
 def _maximum_throughput_chooser(terminal: Terminal):
@@ -14,6 +45,10 @@ def _maximum_throughput_chooser(terminal: Terminal):
     return throughput_percentages
 
 
+# _maximum_throughput_chooser without queries, picks the same percentages from the catalog
+_maximum_throughput_chooser_from_catalog = THROUGHPUT_CHOOSERS['maximum']
+
+
 def _minimum_throughput_chooser(terminal: Terminal):
     throughput_percentages = []
     for technology in terminal.supported_technologies.all():
@@ -143,6 +178,7 @@ class SimulateSessionTest(TestCase):
                     terminal_type=terminal,
                     subscription_type=subscription
                 )
+                i += 1
 
     def test_simulate_session_vc_maximum(self):
         for subscriber in Subscriber.objects.all():
@@ -224,5 +260,1226 @@ class SimulateSessionTest(TestCase):
 
     def test_simulate_session_volume_exceeded(self):
         for subscriber in Subscriber.objects.all():
-            result = _simulate_session(subscriber, self.service_ad, int(subscriber.subscription_type.data_volume_3g_4g.real / 10 + 1), _maximum_throughput_chooser)
+            # the data volume is in MB (8 Mbit), the session lasts one second longer than the volume allows at the
+            # terminal's fastest throughput (in Mbit/s)
+            fastest_throughput = max(technology.maximum_throughput * percentage.percentage
+                                     for technology, percentage in _maximum_throughput_chooser(subscriber.terminal_type))
+            duration = int(subscriber.subscription_type.data_volume_3g_4g * 8 // fastest_throughput) + 1
+            result = _simulate_session(subscriber, self.service_ad, duration, _maximum_throughput_chooser)
             self.assertEqual(result, "not enough data volume")
+            self.assertEqual(_simulate_session(subscriber, self.service_ad, duration - 1, _maximum_throughput_chooser),
+                             "")
+
+    def test_simulate_session_needs_no_catalog_queries(self):
+        get_catalog()
+        subscriber = Subscriber.objects.get(terminal_type=self.s24plus, subscription_type=self.gl_subscription)
+        catalog_tables = ('throughputpercentage', 'technology', 'terminal', 'subscription', 'service')
+        for service in (self.service_vc, self.service_bn, self.service_av):
+            with CaptureQueriesContext(connection) as queries:
+                simulate_session(subscriber, service, 1)
+            tables = ' '.join(query['sql'] for query in queries.captured_queries)
+            for table in catalog_tables:
+                self.assertNotIn(f'"matsecom_{table}"', tables)
+
+    def test_catalog_follows_changes(self):
+        self.assertEqual(get_supported_technologies(self.phair_phone.pk), [self.technology_2g, self.technology_3g])
+        choices = choose_random_throughput_percentages(self.phair_phone.pk)
+        self.assertEqual([technology for technology, tp in choices], [self.technology_3g])
+        self.assertIn(choices[0][1], self.achievable_throughput_percentages)
+
+        self.phair_phone.supported_technologies.add(self.technology_4g)
+        self.assertEqual(get_supported_technologies(self.phair_phone.pk),
+                         [self.technology_2g, self.technology_3g, self.technology_4g])
+        self.technology_4g.achievable_throughput_percentages.clear()
+        self.assertEqual([technology for technology, tp in choose_random_throughput_percentages(self.phair_phone.pk)],
+                         [self.technology_3g])
+
+    def test_terminal_capabilities(self):
+        good = ThroughputPercentage.objects.get(signal_quality='G')
+        low = ThroughputPercentage.objects.get(signal_quality='L')
+        capabilities = get_terminal_capabilities(self.s24plus.pk)
+        self.assertTrue(capabilities.voice_call_support)
+        self.assertEqual(capabilities.throughputs[self.technology_4g.pk, good.pk], 15000)
+        self.assertEqual(capabilities.throughputs[self.technology_3g.pk, low.pk], 200)
+        self.assertEqual(capabilities.fastest_throughput(_25_percent_throughput_chooser(self.s24plus)), 7500)
+        # same sentinel as the batch engine for terminals without data technologies
+        self.assertEqual(capabilities.fastest([]), (None, NO_THROUGHPUT))
+
+        # a second percentage with the same signal quality keeps its own throughput
+        very_good = ThroughputPercentage.objects.create(signal_quality='G', percentage=0.8)
+        self.technology_4g.achievable_throughput_percentages.add(very_good)
+        capabilities = get_terminal_capabilities(self.s24plus.pk)
+        self.assertEqual(capabilities.throughputs[self.technology_4g.pk, good.pk], 15000)
+        self.assertEqual(capabilities.throughputs[self.technology_4g.pk, very_good.pk], 24000)
+        self.assertEqual(capabilities.fastest_throughput([(self.technology_4g, very_good)]), 24000)
+        self.technology_4g.achievable_throughput_percentages.remove(very_good)
+
+        # rebuilt when the terminal's technologies change
+        self.s24plus.supported_technologies.set([self.technology_3g])
+        capabilities = get_terminal_capabilities(self.s24plus.pk)
+        self.assertFalse(capabilities.voice_call_support)
+        self.assertNotIn((self.technology_4g.pk, good.pk), capabilities.throughputs)
+        subscriber = Subscriber.objects.filter(terminal_type=self.s24plus).first()
+        self.assertEqual(_simulate_session(subscriber, self.service_vc, 1, _maximum_throughput_chooser),
+                         "calling not possible")
+
+        # without data technologies there is no throughput to choose from
+        self.s24plus.supported_technologies.set([self.technology_2g])
+        self.assertEqual(_simulate_session(subscriber, self.service_bn, 1, _maximum_throughput_chooser),
+                         "not enough bandwidth")
+
+    def test_batch_engine_matches_scalar_path(self):
+        engine = SimulationEngine()
+        services = [self.service_vc, self.service_bn, self.service_ad, self.service_av]
+        durations = [1, 60, 600, 3600, 20000]
+        for chooser in (_maximum_throughput_chooser, _25_percent_throughput_chooser, _10_percent_throughput_chooser,
+                        _minimum_throughput_chooser):
+            subscribers = load_subscribers()
+            sessions = [(i % len(subscribers.subscriber_ids), services[i % 4], durations[i % 5]) for i in range(120)]
+            result = engine.run(subscribers, [s[0] for s in sessions], [s[1].pk for s in sessions],
+                                [s[2] for s in sessions], throughput_chooser=chooser)
+            for i, (index, service, duration) in enumerate(sessions):
+                subscriber = Subscriber.objects.get(pk=subscribers.subscriber_ids[index])
+                self.assertEqual(OUTCOMES[result.outcomes[i]], _simulate_session(subscriber, service, duration, chooser))
+            for index, pk in enumerate(subscribers.subscriber_ids):
+                self.assertEqual(result.subscriber_data_volume[index], get_running_usage(Subscriber(pk=pk)).data_volume)
+
+    def test_simulate_sessions_matches_scalar_path(self):
+        subscribers = list(Subscriber.objects.order_by('pk'))
+        services = [self.service_vc, self.service_bn, self.service_ad, self.service_av]
+        durations = [1, 60, 600, 3600, 20000]
+        items = [(subscribers[i % len(subscribers)], services[i % 4], durations[i % 5]) for i in range(60)]
+        get_catalog()
+        # savepoint, counters, a reservation per session that passes the bandwidth checks and fits into an empty
+        # subscription (one more if the quota rejects it, to check that the counter exists), sessions, release
+        evaluations = [_evaluate_session(*item, _maximum_throughput_chooser_from_catalog) for item in items]
+        with CaptureQueriesContext(connection) as queries:
+            results = _simulate_sessions(items, _maximum_throughput_chooser_from_catalog)
+        reservations = sum(evaluation.result == "" and evaluation.fits(0) for evaluation in evaluations)
+        rejected = sum(evaluation.result == "" and evaluation.fits(0) and result == "not enough data volume"
+                       for evaluation, result in zip(evaluations, results))
+        self.assertEqual(len(queries), 4 + reservations + rejected)
+        batch_sessions = list(Session.objects.order_by('pk').values_list('subscriber', 'data_volume', 'call_seconds'))
+        self.assertIn("not enough data volume", results)
+
+        Session.objects.all().delete()
+        self.assertEqual([_simulate_session(*item, _maximum_throughput_chooser) for item in items], results)
+        self.assertEqual(list(Session.objects.order_by('pk').values_list('subscriber', 'data_volume', 'call_seconds')),
+                         batch_sessions)
+
+    def test_simulate_sessions_api(self):
+        subscriber = Subscriber.objects.filter(terminal_type=self.phair_phone).first()
+        body = {'throughput': 'maximum', 'sessions': [
+            {'subscriber': subscriber.pk, 'service': 'VC', 'duration': 60},
+            {'subscriber': subscriber.pk, 'service': self.service_av.pk, 'duration': 60},
+            {'subscriber': subscriber.pk, 'service': 'AD', 'duration': 60},
+        ]}
+        with override_settings(API_TOKENS=['token']):
+            response = self.client.post('/api/sessions/simulate/', body, content_type='application/json',
+                                        HTTP_AUTHORIZATION='Bearer token')
+            self.assertEqual(response.json(), {'results': ["", "not enough bandwidth", ""], 'created': 2})
+            self.assertEqual(get_running_usage(subscriber), UsageSummary(600, 60))
+
+            body['sessions'].append({'subscriber': 0, 'service': 'XX', 'duration': 0})
+            response = self.client.post('/api/sessions/simulate/', body, content_type='application/json',
+                                        HTTP_AUTHORIZATION='Bearer token')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['rejections'][0]['index'], 3)
+            self.assertEqual(set(response.json()['rejections'][0]['errors']), {'subscriber', 'service', 'duration'})
+
+    def test_simulate_sessions_api_rejects_non_scalar_services(self):
+        subscriber = Subscriber.objects.filter(terminal_type=self.phair_phone).first()
+        body = {'throughput': 'maximum', 'sessions': [
+            {'subscriber': subscriber.pk, 'service': ['VC'], 'duration': 60},
+            {'subscriber': subscriber.pk, 'service': {'name': 'VC'}, 'duration': 60},
+            {'subscriber': subscriber.pk, 'service': True, 'duration': 60},
+        ]}
+        with override_settings(API_TOKENS=['token']):
+            response = self.client.post('/api/sessions/simulate/', body, content_type='application/json',
+                                        HTTP_AUTHORIZATION='Bearer token')
+        self.assertEqual(response.status_code, 400)
+        rejections = response.json()['rejections']
+        self.assertEqual([rejection['index'] for rejection in rejections], [0, 1, 2])
+        self.assertTrue(all(list(rejection['errors']) == ['service'] for rejection in rejections))
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_write_behind_buffer(self):
+        subscriber = Subscriber.objects.get(terminal_type=self.s24plus, subscription_type=self.gs_subscription)
+        with tempfile.TemporaryDirectory() as spool_dir, override_settings(
+                SESSION_WRITE_BEHIND=True, SESSION_SPOOL_DIR=spool_dir, SESSION_WRITE_BEHIND_MAX_RECORDS=4,
+                SESSION_WRITE_BEHIND_MAX_DELAY_MS=60000):
+            write_behind._buffer = None
+            # 1500 Mbit each, the third one exceeds the 4000 Mbit of GS although the first two are still buffered
+            results = [_simulate_session(subscriber, self.service_ad, 10, _maximum_throughput_chooser)
+                       for _ in range(3)]
+            self.assertEqual(results, ["", "", "not enough data volume"])
+            self.assertEqual(Session.objects.count(), 0)
+            self.assertEqual(len(os.listdir(spool_dir)), 1)
+            # the buffered sessions are reserved on the counter, so other processes see them too
+            self.assertEqual(get_running_usage(subscriber), UsageSummary(3000, 0))
+            with override_settings(SESSION_WRITE_BEHIND=False):
+                self.assertEqual(_simulate_session(subscriber, self.service_ad, 10, _maximum_throughput_chooser),
+                                 "not enough data volume")
+
+            self.assertEqual(_simulate_session(subscriber, self.service_vc, 60, _maximum_throughput_chooser), "")
+            self.assertEqual(_simulate_session(subscriber, self.service_vc, 60, _maximum_throughput_chooser), "")
+            # the fourth accepted session filled the buffer
+            self.assertEqual(Session.objects.count(), 4)
+            self.assertEqual(get_running_usage(subscriber), UsageSummary(3000, 120))
+            self.assertEqual(os.listdir(spool_dir), [])
+
+            self.assertEqual(_simulate_session(subscriber, self.service_vc, 30, _maximum_throughput_chooser), "")
+            write_behind.flush()
+            self.assertEqual(get_running_usage(subscriber), UsageSummary(3000, 150))
+            self.assertEqual(WriteBehindBatch.objects.count(), 2)
+            write_behind._buffer = None
+
+    def test_write_behind_invoice_includes_buffered_sessions(self):
+        subscriber = Subscriber.objects.get(terminal_type=self.s24plus, subscription_type=self.gs_subscription)
+        with tempfile.TemporaryDirectory() as spool_dir, override_settings(
+                SESSION_WRITE_BEHIND=True, SESSION_SPOOL_DIR=spool_dir, SESSION_WRITE_BEHIND_MAX_DELAY_MS=60000):
+            write_behind._buffer = None
+            self.assertEqual(_simulate_session(subscriber, self.service_ad, 10, _maximum_throughput_chooser), "")
+            self.assertEqual(Session.objects.count(), 0)
+            invoice(subscriber)
+            self.assertEqual(Session.objects.filter(paid=True).count(), 1)
+            self.assertEqual(get_running_usage(subscriber), UsageSummary(0, 0))
+            self.assertEqual(reconcile_usage_counters(fix=False), [])
+            write_behind._buffer = None
+
+    def test_write_behind_spool_recovery(self):
+        subscriber = Subscriber.objects.first()
+        record = {'subscriber_id': subscriber.pk, 'service_id': self.service_bn.pk,
+                  'timestamp': '2024-05-01T12:00:00+00:00', 'duration': 10, 'data_volume': 50, 'call_seconds': 0}
+        with tempfile.TemporaryDirectory() as spool_dir:
+            # a segment left by a crashed process, its last line was cut off
+            with open(os.path.join(spool_dir, 'crashed.ndjson'), 'w') as segment:
+                segment.write(json.dumps(record) + '\n' + json.dumps(record) + '\n{"subscriber_id": ')
+            self.assertEqual(write_behind.recover_spool(spool_dir), (1, 2))
+            self.assertEqual(os.listdir(spool_dir), [])
+            self.assertEqual(get_running_usage(subscriber), UsageSummary(100, 0))
+            self.assertEqual(Session.objects.first().timestamp.isoformat(), record['timestamp'])
+
+            # crashed after the commit but before deleting the segment: it is not written again
+            with open(os.path.join(spool_dir, 'crashed.ndjson'), 'w') as segment:
+                segment.write(json.dumps(record) + '\n')
+            self.assertEqual(write_behind.recover_spool(spool_dir), (1, 0))
+            self.assertEqual(Session.objects.count(), 2)
+
+            # the usage of sessions that reserved it when they were accepted is not counted again
+            with open(os.path.join(spool_dir, 'reserved.ndjson'), 'w') as segment:
+                segment.write(json.dumps(dict(record, usage_reserved=True)) + '\n')
+            self.assertEqual(write_behind.recover_spool(spool_dir), (1, 1))
+            self.assertEqual(get_running_usage(subscriber), UsageSummary(100, 0))
+
+    def test_write_behind_keeps_sessions_when_writing_fails(self):
+        subscriber = Subscriber.objects.first()
+
+        def session():
+            return Session(subscriber=subscriber, service=self.service_bn, timestamp=timezone.now(), duration=10,
+                           data_volume=50, call_seconds=0)
+
+        with tempfile.TemporaryDirectory() as spool_dir:
+            buffer = write_behind.SessionBuffer(spool_dir, max_records=1, max_delay_ms=60000)
+            # the session is spooled, so add succeeds although the buffer could not be written
+            with mock.patch.object(write_behind, 'write_batch', side_effect=OperationalError('disk I/O error')), \
+                    self.assertLogs('matsecom.write_behind', 'ERROR'):
+                buffer.add(session())
+            self.assertEqual(Session.objects.count(), 0)
+            self.assertEqual(len(os.listdir(spool_dir)), 1)
+            buffer.flush()
+            self.assertEqual(Session.objects.count(), 1)
+
+            # a written segment that can't be removed doesn't block the buffer, recovery removes it later
+            with mock.patch.object(write_behind.os, 'remove', side_effect=PermissionError), \
+                    self.assertLogs('matsecom.write_behind', 'ERROR'):
+                buffer.add(session())
+            self.assertEqual(Session.objects.count(), 2)
+            buffer.add(session())
+            self.assertEqual(Session.objects.count(), 3)
+            self.assertEqual(write_behind.recover_spool(spool_dir), (1, 0))
+            self.assertEqual(os.listdir(spool_dir), [])
+
+    def test_write_behind_segment_is_locked_before_it_is_visible(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            buffer = write_behind.SessionBuffer(spool_dir, max_delay_ms=60000)
+            buffer.add(Session(subscriber=Subscriber.objects.first(), service=self.service_bn,
+                               timestamp=timezone.now(), duration=10, data_volume=50, call_seconds=0))
+            self.assertEqual([name.endswith(write_behind.SPOOL_SUFFIX) for name in os.listdir(spool_dir)], [True])
+            # a starting process leaves the live segment alone
+            self.assertEqual(write_behind.recover_spool(spool_dir), (0, 0))
+            buffer.flush()
+            self.assertEqual(Session.objects.count(), 1)
+
+    def test_batch_engine_is_seeded(self):
+        engine = SimulationEngine()
+        subscribers = load_subscribers()
+        sessions = ([i % len(subscribers.subscriber_ids) for i in range(1000)], [self.service_ad.pk] * 1000,
+                    [60] * 1000)
+        with self.assertNumQueries(0):
+            first = engine.run(subscribers, *sessions, seed=42)
+        self.assertEqual(first.counts(), engine.run(subscribers, *sessions, seed=42).counts())
+        self.assertEqual(sum(first.counts().values()), 1000)
+        # PhairPhone and Pear APhone 4S only reach 10 Mbit/s on 3G with good signal quality
+        self.assertGreater(first.counts()["not enough bandwidth"], 0)
+        self.assertGreater(first.counts()[""], 0)
+        self.assertEqual(Session.objects.count(), 0)
+
+
+class SubscriberBlindIndexTest(TestCase):
+    def setUp(self):
+        self.terminal = Terminal.objects.create(name='PhairPhone')
+        self.subscription = Subscription.objects.create(
+            name='GS',
+            basic_fee=800,
+            minutes_included=0,
+            price_per_extra_minute=8,
+            data_volume_3g_4g=500
+        )
+        self.mueller = self._create('Anna', 'Mueller', 0)
+        self.meier = self._create('Bernd', 'Meier', 1)
+
+    def _create(self, forename, surname, i):
+        return Subscriber.objects.create(
+            forename=forename,
+            surname=surname,
+            imsi=262010000000000 + i,
+            terminal_type=self.terminal,
+            subscription_type=self.subscription
+        )
+
+    def test_exact_match_is_case_insensitive(self):
+        self.assertQuerySetEqual(Subscriber.objects.with_name(surname='mueller'), [self.mueller])
+        self.assertQuerySetEqual(Subscriber.objects.with_name(forename='ANNA', surname='Mueller'), [self.mueller])
+        self.assertFalse(Subscriber.objects.with_name(forename='Mueller').exists())
+
+    def test_prefix_search(self):
+        self.assertQuerySetEqual(Subscriber.objects.name_startswith(surname='M').order_by('imsi'),
+                                 [self.mueller, self.meier])
+        self.assertQuerySetEqual(Subscriber.objects.name_startswith(surname='Mei'), [self.meier])
+        self.assertQuerySetEqual(Subscriber.objects.search_name('bern mei'), [self.meier])
+        self.assertFalse(Subscriber.objects.search_name('anna meier').exists())
+
+    def test_prefix_longer_than_tokens(self):
+        long_name = self._create('Maximilian', 'Abcdefghijklmnopq', 2)
+        self._create('Maximilian', 'Abcdefghijklmnxyz', 3)
+        self.assertQuerySetEqual(Subscriber.objects.name_startswith(surname='abcdefghijklmnop'), [long_name])
+
+    def test_indexes_follow_save_and_update(self):
+        self.mueller.surname = 'Schmidt'
+        self.mueller.save()
+        self.assertFalse(Subscriber.objects.name_startswith(surname='Mue').exists())
+        self.assertQuerySetEqual(Subscriber.objects.name_startswith(surname='Schm'), [self.mueller])
+
+        Subscriber.objects.filter(pk=self.meier.pk).update(forename='Clara')
+        self.assertQuerySetEqual(Subscriber.objects.with_name(forename='clara'), [self.meier])
+        self.assertQuerySetEqual(Subscriber.objects.search_name('cl'), [self.meier])
+
+    def test_indexes_on_bulk_paths(self):
+        created = Subscriber.objects.bulk_create([
+            Subscriber(forename='Dora', surname='Klein', imsi=262010000000010, terminal_type=self.terminal,
+                       subscription_type=self.subscription),
+        ])
+        self.assertQuerySetEqual(Subscriber.objects.search_name('dor kle'), created)
+
+        self.meier.surname = 'Gross'
+        Subscriber.objects.bulk_update([self.meier], ['surname'])
+        self.assertQuerySetEqual(Subscriber.objects.with_name(surname='gross'), [self.meier])
+        self.assertFalse(Subscriber.objects.name_startswith(surname='Mei').exists())
+
+    def test_tokens_are_deleted_with_subscriber(self):
+        pk = self.mueller.pk
+        self.assertTrue(SubscriberNameToken.objects.filter(subscriber_id=pk).exists())
+        self.mueller.delete()
+        self.assertFalse(SubscriberNameToken.objects.filter(subscriber_id=pk).exists())
+        self.assertFalse(Subscriber.objects.search_name('anna').exists())
+
+
+# runs on PostgreSQL only: DAWN_DATABASE=postgresql python manage.py test
+@skipUnless(connection.vendor == 'postgresql', "pgcrypto encryption is PostgreSQL only")
+class PgcryptoSubscriberNameTest(SubscriberBlindIndexTest):
+    def test_names_are_encrypted_in_the_database(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT surname FROM {Subscriber._meta.db_table} WHERE id = %s", [self.mueller.pk])
+            stored = cursor.fetchone()[0]
+        self.assertTrue(stored.startswith(pgcrypto.ARMOR_HEADER))
+        self.assertNotIn('Mueller', stored)
+        self.assertEqual(Subscriber.objects.get(pk=self.mueller.pk).surname, 'Mueller')
+
+    def test_names_are_filtered_and_ordered_in_sql(self):
+        self.assertQuerySetEqual(Subscriber.objects.filter(surname='Meier'), [self.meier])
+        self.assertQuerySetEqual(Subscriber.objects.filter(forename__istartswith='an'), [self.mueller])
+        self.assertQuerySetEqual(Subscriber.objects.order_by('surname'), [self.meier, self.mueller])
+        self.assertEqual(Subscriber.objects.filter(surname='Meier').update(surname='Zander'), 1)
+        self.assertQuerySetEqual(Subscriber.objects.order_by('-surname'), [self.meier, self.mueller])
+
+    def test_name_filters_match_the_blind_index_first(self):
+        query = str(Subscriber.objects.filter(surname='Mueller').query)
+        self.assertIn('surname_bidx', query)
+        self.assertQuerySetEqual(Subscriber.objects.filter(surname='Mueller'), [self.mueller])
+        # the decrypted comparison keeps exact case-sensitive
+        self.assertFalse(Subscriber.objects.filter(surname='mueller').exists())
+        self.assertQuerySetEqual(Subscriber.objects.filter(surname__iexact='mueller'), [self.mueller])
+        self.assertQuerySetEqual(Subscriber.objects.filter(surname__in=['Meier', 'Schmidt']), [self.meier])
+
+    def test_migration_reencrypts_client_side_encrypted_names(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {Subscriber._meta.db_table} SET surname = %s WHERE id = %s",
+                           [encrypt_str('Schmidt').decode(), self.mueller.pk])
+        self.assertEqual(pgcrypto.reencrypt_columns(connection, Subscriber._meta.db_table, ['forename', 'surname']), 1)
+        self.assertQuerySetEqual(Subscriber.objects.filter(surname='Schmidt'), [self.mueller])
+
+
+class SqliteProductionProfileTest(SimpleTestCase):
+    def _connect(self, path, **options):
+        profile = {**settings.SQLITE_PRODUCTION_DATABASE, 'NAME': path}
+        profile['OPTIONS'] = {**profile['OPTIONS'], **options}
+        wrapper = sqlite_backend.DatabaseWrapper(connections.configure_settings({'default': profile})['default'])
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_pragmas_and_immediate_transactions(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'profile.sqlite3')
+        first = self._connect(path)
+        second = self._connect(path, pragmas={**settings.SQLITE_PRODUCTION_DATABASE['OPTIONS']['pragmas'],
+                                              'busy_timeout': 0})
+        with first.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute("CREATE TABLE counter (value INTEGER)")
+
+        # starts a transaction the way atomic() does, it takes the write lock at BEGIN, before its first write
+        first.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        try:
+            with self.assertRaisesMessage(OperationalError, 'database is locked'), second.cursor() as cursor:
+                cursor.execute("INSERT INTO counter VALUES (1)")
+            # readers aren't blocked in WAL mode
+            with second.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM counter")
+                self.assertEqual(cursor.fetchone()[0], 0)
+        finally:
+            first.rollback()
+            first.set_autocommit(True)
+
+
+class CopySqliteDatabaseTest(TestCase):
+    SOURCE = 'copy_source'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'source.sqlite3')
+        connections.settings[self.SOURCE] = connections.configure_settings({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.path}
+        })['default']
+        self.addCleanup(connections.settings.pop, self.SOURCE)
+        self.addCleanup(connections[self.SOURCE].close)
+        call_command('migrate', database=self.SOURCE, verbosity=0)
+
+        terminal = Terminal.objects.using(self.SOURCE).create(name='PhairPhone')
+        subscription = Subscription.objects.using(self.SOURCE).create(
+            name='GS', basic_fee=800, minutes_included=0, price_per_extra_minute=8, data_volume_3g_4g=500)
+        subscriber = Subscriber(forename='Anna', surname='Mueller', imsi=262010000000000, terminal_type=terminal,
+                                subscription_type=subscription)
+        subscriber.save(using=self.SOURCE)
+        service = Service.objects.using(self.SOURCE).create(name='BN', ran_technologies='3G4G', required_data_rate=2)
+        Session.objects.using(self.SOURCE).bulk_create([
+            Session(subscriber=subscriber, service=service, duration=1, data_volume=5, call_seconds=0)
+        ])
+        self.timestamp = timezone.now() - timedelta(days=3)
+        Session.objects.using(self.SOURCE).update(timestamp=self.timestamp)
+
+    def test_copy(self):
+        call_command('copy_sqlite_database', self.path, stdout=StringIO())
+        subscriber = Subscriber.objects.get()
+        self.assertEqual((subscriber.forename, subscriber.surname), ('Anna', 'Mueller'))
+        self.assertQuerySetEqual(Subscriber.objects.search_name('ann muel'), [subscriber])
+        session = Session.objects.get()
+        self.assertEqual((session.subscriber, session.timestamp), (subscriber, self.timestamp))
+        # new rows continue after the copied primary keys
+        self.assertGreater(Session.objects.create(subscriber=subscriber, service=session.service, duration=1,
+                                                  data_volume=5, call_seconds=0).pk, session.pk)
+
+        with self.assertRaisesMessage(CommandError, "already has data"):
+            call_command('copy_sqlite_database', self.path, stdout=StringIO())
+
+
+class UsageAndBillingTest(TestCase):
+    def setUp(self):
+        terminal = Terminal.objects.create(name='PhairPhone')
+        self.subscription = Subscription.objects.create(
+            name='GM',
+            basic_fee=2200,
+            minutes_included=100,
+            price_per_extra_minute=6,
+            data_volume_3g_4g=2000
+        )
+        self.service = Service.objects.create(name='BN', ran_technologies='3G4G', required_data_rate=2)
+        self.subscriber, self.other = [
+            Subscriber.objects.create(forename='Test', surname='Dummy', imsi=262010000000000 + i,
+                                      terminal_type=terminal, subscription_type=self.subscription)
+            for i in range(2)
+        ]
+
+    def _session(self, subscriber, data_volume, call_seconds, paid=False):
+        Session.objects.create(subscriber=subscriber, service=self.service, duration=1, data_volume=data_volume,
+                               call_seconds=call_seconds, paid=paid)
+
+    def test_unpaid_usage_of_subscriber_only(self):
+        self.assertEqual(get_unpaid_usage(self.subscriber), UsageSummary(0, 0))
+        self._session(self.subscriber, 100, 30)
+        self._session(self.subscriber, 50, 45)
+        self._session(self.subscriber, 1000, 1000, paid=True)
+        self._session(self.other, 1000, 1000)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_unpaid_usage(self.subscriber), UsageSummary(150, 75))
+
+    def test_rate_usage(self):
+        self.assertEqual(rate_usage(UsageSummary(80, 100 * 60), self.subscription), (80, 100, 2200))
+        self.assertEqual(rate_usage(UsageSummary(80, 100 * 60 + 1), self.subscription), (80, 101, 2206))
+
+    def test_running_usage_follows_sessions(self):
+        self._session(self.subscriber, 100, 30)
+        self._session(self.subscriber, 50, 45)
+        self._session(self.other, 7, 7)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_running_usage(self.subscriber), UsageSummary(150, 75))
+
+        Session.objects.filter(subscriber=self.subscriber).last().delete()
+        self.assertEqual(get_running_usage(self.subscriber), UsageSummary(100, 30))
+
+    def test_invoice_resets_running_usage(self):
+        self._session(self.subscriber, 100, 30)
+        invoice(self.subscriber)
+        self.assertEqual(get_running_usage(self.subscriber), UsageSummary(0, 0))
+        self._session(self.subscriber, 8, 0)
+        self.assertEqual(get_running_usage(self.subscriber), UsageSummary(8, 0))
+
+    def test_reconcile_usage_counters(self):
+        self._session(self.subscriber, 100, 30)
+        self._session(self.other, 7, 7)
+        self.assertEqual(reconcile_usage_counters(), [])
+
+        UsageCounter.objects.filter(subscriber=self.subscriber).update(data_volume=5)
+        Session.objects.filter(subscriber=self.other).update(paid=True)
+        drifts = reconcile_usage_counters(fix=False)
+        self.assertEqual(drifts, [
+            (self.subscriber.pk, UsageSummary(5, 30), UsageSummary(100, 30)),
+            (self.other.pk, UsageSummary(7, 7), UsageSummary(0, 0)),
+        ])
+        self.assertEqual(reconcile_usage_counters(), drifts)
+        self.assertEqual(reconcile_usage_counters(), [])
+        self.assertEqual(get_running_usage(self.subscriber), UsageSummary(100, 30))
+
+    def test_invoice_settles_sessions_in_constant_queries(self):
+        for i in range(50):
+            self._session(self.subscriber, 16, 121)
+        self._session(self.other, 8, 60)
+        with self.assertNumQueries(8):
+            generated_invoice = invoice(self.subscriber)
+        self.assertEqual((generated_invoice.data_volume, generated_invoice.call_minutes, generated_invoice.charges),
+                         (100, 101, 2206))
+        self.assertFalse(Session.objects.filter(subscriber=self.subscriber, paid=False).exists())
+        self.assertTrue(Session.objects.filter(subscriber=self.other, paid=False).exists())
+
+        empty_invoice = invoice(self.subscriber)
+        self.assertEqual((empty_invoice.data_volume, empty_invoice.call_minutes, empty_invoice.charges),
+                         (0, 0, 2200))
+
+    def test_billing_cycle_is_resumable(self):
+        self._session(self.subscriber, 16, 121)
+        self._session(self.other, 8, 60)
+        cycle = get_or_start_billing_cycle('2024-05')
+        self.assertEqual(settle_chunk(cycle.pk, [self.subscriber.pk]), 1)
+        self._session(self.other, 800, 600)  # created after the cycle started
+
+        call_command('run_billing_cycle', cycle='2024-05', workers=1, stdout=StringIO())
+        call_command('run_billing_cycle', cycle='2024-05', workers=1, stdout=StringIO())
+
+        invoices = Invoice.objects.filter(billing_cycle__name='2024-05').order_by('subscriber_id')
+        self.assertEqual([(i.subscriber_id, i.data_volume, i.call_minutes, i.charges) for i in invoices], [
+            (self.subscriber.pk, 2, 3, 2200),
+            (self.other.pk, 1, 1, 2200),
+        ])
+        self.assertIsNotNone(BillingCycle.objects.get(name='2024-05').finished_at)
+        self.assertEqual(list(Session.objects.filter(paid=False).values_list('data_volume', flat=True)), [800])
+        self.assertEqual(get_running_usage(self.other), UsageSummary(800, 600))
+
+
+class SubscriberCSVExportTest(TestCase):
+    def setUp(self):
+        terminal = Terminal.objects.create(name='PhairPhone')
+        subscription = Subscription.objects.create(name='GS', basic_fee=800, minutes_included=0,
+                                                   price_per_extra_minute=8, data_volume_3g_4g=500)
+        Subscriber.objects.bulk_create([
+            Subscriber(forename='Test', surname=f'Dummy{i}', imsi=262010000000000 + i, terminal_type=terminal,
+                       subscription_type=subscription)
+            for i in range(1200)
+        ])
+        self.client.force_login(User.objects.create_user('operator'))
+
+    def test_csv_is_streamed(self):
+        with self.assertNumQueries(3):  # session, user, subscribers
+            response = self.client.get('/subscribers/?action=download')
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="subscribers.csv"')
+        lines = content.splitlines()
+        self.assertEqual(len(lines), 1201)
+        self.assertEqual(lines[0], 'forename,surname,imsi,terminal_type,subscription_type')
+        self.assertEqual(lines[1], 'Test,Dummy0,262010000000000,PhairPhone,GS')
+        self.assertEqual(content, get_all_subscribers_as_csv())
+
+
+class SubscriberCSVImportTest(TestCase):
+    def setUp(self):
+        self.terminal = Terminal.objects.create(name='PhairPhone')
+        self.subscription = Subscription.objects.create(name='GS', basic_fee=800, minutes_included=0,
+                                                        price_per_extra_minute=8, data_volume_3g_4g=500)
+        Subscriber.objects.create(forename='Anna', surname='Mueller', imsi=262010000000000,
+                                  terminal_type=self.terminal, subscription_type=self.subscription)
+
+    def test_import_reports_errors_per_row(self):
+        report = load_from_csv(
+            'forename,surname,imsi,terminal_type,subscription_type\n'
+            'Anna,Mueller,262010000000000,PhairPhone,GS\n'
+            'Bernd,Meier,262010000000001,PhairPhone,GS\n'
+            'Clara,Klein,262010000000002,Nokia 3310,GS\n'
+            'Dora,Gross,262010000000003,PhairPhone,XL\n'
+            'Emil,Schmidt2,262010000000004,PhairPhone,GS\n'
+            'Frida,Lang,310010000000005,PhairPhone,GS\n'
+            'Gerd,Kurz,abc,PhairPhone,GS\n'
+            'Hans,Weber\n'
+            'Ida,Fischer,262010000000001,PhairPhone,GS\n'
+            'Jana,Wolf,262010000000009,PhairPhone,GS\n'
+        )
+        self.assertEqual((report.rows, report.created, report.skipped), (10, 2, 2))
+        self.assertEqual(report.errors, [
+            (4, "terminal Nokia 3310 of user Clara Klein does not exist"),
+            (5, "subscription XL of user Dora Gross does not exist"),
+            (6, "Names must only contain alphabetic characters."),
+            (7, "IMSI must be a German IMSI."),
+            (8, "IMSI abc of user Gerd Kurz is not a number"),
+            (9, "expected 5 columns, got 2"),
+        ])
+        self.assertQuerySetEqual(Subscriber.objects.search_name('bernd meier'),
+                                 Subscriber.objects.filter(imsi=262010000000001))
+        self.assertTrue(Subscriber.objects.with_name(forename='Jana').exists())
+
+    def test_import_queries_do_not_grow_with_rows(self):
+        rows = ''.join(f'Test,Dummy,{262010000000100 + i},PhairPhone,GS\n' for i in range(300))
+        get_catalog()
+        with self.assertNumQueries(9):
+            report = load_from_csv('forename,surname,imsi,terminal_type,subscription_type\n' + rows)
+        self.assertEqual(report.created, 300)
+        self.assertEqual(Subscriber.objects.with_name(surname='dummy').count(), 300)
+
+    def test_upload_is_imported_in_background(self):
+        self.client.force_login(User.objects.create_user('operator'))
+        upload = SimpleUploadedFile('subscribers.csv', (
+            '\ufeffforename,surname,imsi,terminal_type,subscription_type\n'
+            'Bernd,Meier,262010000000001,PhairPhone,GS\n'
+            'Clara,Klein,262010000000002,Nokia 3310,GS\n'
+        ).encode())
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post('/subscribers/', {'csv_file': upload})
+            self.assertEqual(response.status_code, 202)
+            progress_url = response.json()['progress_url']
+            self.assertEqual(self.client.get(progress_url).json()['status'], 'pending')
+            self.assertFalse(Subscriber.objects.filter(imsi=262010000000001).exists())
+
+            call_command('run_import_worker', once=True, stdout=StringIO())
+
+        progress = self.client.get(progress_url).json()
+        self.assertEqual(
+            {key: progress[key] for key in ('status', 'rows_processed', 'rows_created', 'rows_failed', 'errors')},
+            {'status': 'done', 'rows_processed': 2, 'rows_created': 1, 'rows_failed': 1,
+             'errors': [{'line': 3, 'message': 'terminal Nokia 3310 of user Clara Klein does not exist'}]}
+        )
+        self.assertTrue(Subscriber.objects.filter(imsi=262010000000001).exists())
+        self.assertIsNotNone(ImportJob.objects.get().finished_at)
+
+    def test_batch_with_conflicting_row_is_inserted_row_by_row(self):
+        def create_conflict(report):
+            # another import creates a subscriber of the next batch after the existing IMSIs were loaded
+            if report.rows == 2:
+                Subscriber.objects.create(forename='Clara', surname='Klein', imsi=262010000000003,
+                                          terminal_type=self.terminal, subscription_type=self.subscription)
+
+        rows = ''.join(f'Test,Dummy,{262010000000001 + i},PhairPhone,GS\n' for i in range(4))
+        report = import_subscribers_csv(StringIO('forename,surname,imsi,terminal_type,subscription_type\n' + rows),
+                                        batch_size=2, progress=create_conflict)
+        self.assertEqual((report.rows, report.created, report.skipped, report.errors), (4, 3, 1, []))
+        self.assertEqual(Subscriber.objects.get(imsi=262010000000003).forename, 'Clara')
+        self.assertTrue(Subscriber.objects.filter(imsi=262010000000004).exists())
+
+    def test_job_of_a_dead_worker_is_requeued(self):
+        contents = b'forename,surname,imsi,terminal_type,subscription_type\nBernd,Meier,262010000000001,PhairPhone,GS\n'
+        long_ago = timezone.now() - timedelta(hours=1)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root,
+                                                                              IMPORT_JOB_MAX_ATTEMPTS=2):
+            stale = queue_import(SimpleUploadedFile('stale.csv', contents))
+            given_up = queue_import(SimpleUploadedFile('given_up.csv', contents))
+            ImportJob.objects.filter(pk=stale.pk).update(status=ImportJob.RUNNING, attempts=1, heartbeat_at=long_ago)
+            ImportJob.objects.filter(pk=given_up.pk).update(status=ImportJob.RUNNING, attempts=2,
+                                                            heartbeat_at=long_ago)
+            job = claim_next_job()
+            self.assertEqual((job.pk, job.attempts), (stale.pk, 2))
+            self.assertEqual(ImportJob.objects.get(pk=given_up.pk).status, ImportJob.FAILED)
+
+            # the first worker comes back after the job was given to another one
+            ImportJob.objects.filter(pk=stale.pk).update(status=ImportJob.PENDING)
+            with self.assertRaises(JobLeaseLost):
+                run_import_job(job)
+            run_import_job(claim_next_job())
+        self.assertEqual(ImportJob.objects.get(pk=stale.pk).status, ImportJob.DONE)
+        self.assertTrue(Subscriber.objects.filter(imsi=262010000000001).exists())
+
+
+class ServerSideTableTest(TestCase):
+    def setUp(self):
+        terminal = Terminal.objects.create(name='PhairPhone')
+        subscription = Subscription.objects.create(name='GS', basic_fee=800, minutes_included=0,
+                                                   price_per_extra_minute=8, data_volume_3g_4g=500)
+        self.subscribers = Subscriber.objects.bulk_create([
+            Subscriber(forename='Test', surname=name, imsi=262010000000000 + i, terminal_type=terminal,
+                       subscription_type=subscription)
+            for i, name in enumerate(['Mueller', 'Meier', 'Schmidt', 'Klein', 'Gross'])
+        ])
+        self.vc = Service.objects.create(name='VC', ran_technologies='2G', required_data_rate=0)
+        self.bn = Service.objects.create(name='BN', ran_technologies='3G4G', required_data_rate=2)
+        for subscriber in self.subscribers:
+            Session.objects.create(subscriber=subscriber, service=self.vc, duration=60, data_volume=0,
+                                   call_seconds=60)
+            Session.objects.create(subscriber=subscriber, service=self.bn, duration=1, data_volume=5, call_seconds=0)
+        self.client.force_login(User.objects.create_user('operator'))
+
+    def _get(self, url, **params):
+        return self.client.get(url, {'action': 'data', 'draw': 3, **params}).json()
+
+    def test_subscriber_table_pages_in_sql(self):
+        data = self._get('/subscribers/', start=1, length=2, **{'order[0][column]': 2, 'order[0][dir]': 'desc'})
+        self.assertEqual((data['draw'], data['recordsTotal'], data['recordsFiltered']), (3, 5, 5))
+        self.assertEqual([row['imsi'] for row in data['data']], [262010000000003, 262010000000002])
+        self.assertEqual(data['data'][0]['url'], f'/subscribers/{self.subscribers[3].pk}/')
+
+    def test_subscriber_table_search_uses_blind_index(self):
+        data = self._get('/subscribers/', **{'search[value]': 'm', 'order[0][column]': 2})
+        self.assertEqual(data['recordsFiltered'], 2)
+        self.assertEqual([row['surname'] for row in data['data']], ['Mueller', 'Meier'])
+
+        # a search longer than the form allows matches nothing instead of being ignored
+        data = self._get('/subscribers/', **{'search[value]': 'm' * 101})
+        self.assertEqual((data['recordsTotal'], data['recordsFiltered'], data['data']), (5, 0, []))
+
+    def test_session_table(self):
+        data = self._get('/sessions/', length=3, **{'order[0][column]': 1, 'order[0][dir]': 'asc'})
+        self.assertEqual((data['recordsTotal'], data['recordsFiltered'], len(data['data'])), (10, 10, 3))
+        self.assertEqual({row['service'] for row in data['data']}, {'BN'})
+
+        data = self._get('/sessions/', **{'search[value]': '262010000000004'})
+        self.assertEqual(data['recordsFiltered'], 2)
+        data = self._get('/sessions/', **{'search[value]': 'vc'})
+        self.assertEqual(data['recordsFiltered'], 5)
+
+    def test_archive_sessions(self):
+        old = timezone.now() - timedelta(days=100)
+        Session.objects.filter(service=self.vc).update(timestamp=old)
+        Session.objects.filter(subscriber=self.subscribers[0]).update(paid=True)
+        Session.objects.filter(subscriber=self.subscribers[1], service=self.vc).update(paid=True)
+        archived = list(Session.objects.filter(paid=True, service=self.vc).values_list('pk', flat=True))
+
+        out = StringIO()
+        call_command('archive_sessions', '--chunk-size', '1', stdout=out)
+        self.assertIn("Archived 2 paid sessions", out.getvalue())
+        # only paid sessions older than the cutoff are moved, the recent paid session stays
+        self.assertEqual(sorted(SessionArchive.objects.values_list('pk', flat=True)), sorted(archived))
+        self.assertEqual(Session.objects.count(), 8)
+        self.assertFalse(Session.objects.filter(pk__in=archived).exists())
+        self.assertEqual(Session.objects.filter(paid=True).count(), 1)
+
+        # archived sessions are still listed, searched and counted
+        data = self._get('/sessions/', length=20, **{'order[0][column]': 0})
+        self.assertEqual((data['recordsTotal'], len(data['data'])), (10, 10))
+        self.assertEqual(data['data'][0], {
+            'imsi': 262010000000000, 'service': 'VC', 'timestamp': data['data'][0]['timestamp'], 'data_volume': 0,
+            'call_seconds': 60, 'paid': True
+        })
+        data = self._get('/sessions/', **{'search[value]': '262010000000001'})
+        self.assertEqual((data['recordsFiltered'], {row['paid'] for row in data['data']}), (2, {True, False}))
+
+        # running again moves nothing
+        call_command('archive_sessions', stdout=StringIO())
+        self.assertEqual(SessionArchive.objects.count(), 2)
+
+    def test_list_pages_do_not_load_rows(self):
+        with self.assertNumQueries(2):  # session, user
+            self.client.get('/subscribers/')
+        with self.assertNumQueries(2):
+            self.client.get('/sessions/')
+
+
+class SessionIngestTest(TestCase):
+    TOKEN = 'test-ingest-token'
+
+    def setUp(self):
+        terminal = Terminal.objects.create(name='PhairPhone')
+        subscription = Subscription.objects.create(name='GS', basic_fee=800, minutes_included=0,
+                                                   price_per_extra_minute=8, data_volume_3g_4g=500)
+        self.subscribers = Subscriber.objects.bulk_create([
+            Subscriber(forename='Test', surname=f'Dummy {i}', imsi=262010000000000 + i, terminal_type=terminal,
+                       subscription_type=subscription)
+            for i in range(3)
+        ])
+        self.vc = Service.objects.create(name='VC', ran_technologies='2G', required_data_rate=0)
+        self.bn = Service.objects.create(name='BN', ran_technologies='3G4G', required_data_rate=2)
+
+    def _post(self, body, content_type='application/x-ndjson', token=TOKEN):
+        with override_settings(API_TOKENS=[self.TOKEN]):
+            return self.client.post('/api/sessions/ingest/', body, content_type=content_type,
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_requires_token(self):
+        response = self._post('[]', content_type='application/json', token='wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_ndjson_with_rejections(self):
+        lines = [
+            {'imsi': 262010000000000, 'service': 'VC', 'duration': 60, 'data_volume': 0, 'call_seconds': 60},
+            {'imsi': 262010000000001, 'service': self.bn.pk, 'duration': 10, 'data_volume': 25, 'call_seconds': 0},
+            {'imsi': 262019999999999, 'service': 'BN', 'duration': 10, 'data_volume': 25, 'call_seconds': 0},
+            {'imsi': 262010000000002, 'service': 'XX', 'duration': 0, 'data_volume': -1, 'call_seconds': 0},
+        ]
+        body = '\n'.join(json.dumps(line) for line in lines) + '\n{not json}\n'
+        response = self._post(body)
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual((report['records'], report['created'], report['rejected']), (5, 2, 3))
+        rejections = {rejection['index']: rejection['errors'] for rejection in report['rejections']}
+        self.assertEqual(list(rejections[2]), ['imsi'])
+        self.assertEqual(set(rejections[3]), {'service', 'duration', 'data_volume'})
+        self.assertIn('__all__', rejections[4])
+        self.assertIn('records_per_second', report)
+
+        self.assertEqual(get_running_usage(self.subscribers[0]), UsageSummary(0, 60))
+        self.assertEqual(get_running_usage(self.subscribers[1]), UsageSummary(25, 0))
+        self.assertEqual(reconcile_usage_counters(fix=False), [])
+
+    def test_json_array_in_constant_queries(self):
+        records = [{'imsi': 262010000000000 + i % 3, 'service': 'BN', 'duration': 10, 'data_volume': 1,
+                    'call_seconds': 0} for i in range(120)]
+        get_catalog()
+        # savepoint, subscribers, sessions, counters (insert missing, update), release
+        with self.assertNumQueries(6):
+            response = self._post(json.dumps(records), content_type='application/json')
+        self.assertEqual(response.json()['created'], 120)
+        self.assertEqual(get_running_usage(self.subscribers[0]), UsageSummary(40, 0))
+
+    def test_non_scalar_service_is_rejected(self):
+        records = [
+            {'imsi': 262010000000000, 'service': ['BN'], 'duration': 10, 'data_volume': 1, 'call_seconds': 0},
+            {'imsi': 262010000000000, 'service': {'name': 'BN'}, 'duration': 10, 'data_volume': 1, 'call_seconds': 0},
+            {'imsi': 262010000000000, 'service': True, 'duration': 10, 'data_volume': 1, 'call_seconds': 0},
+            {'imsi': 262010000000000, 'service': 'BN', 'duration': 10, 'data_volume': 1, 'call_seconds': 0},
+        ]
+        response = self._post(json.dumps(records), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual((report['created'], report['rejected']), (1, 3))
+        self.assertTrue(all(list(rejection['errors']) == ['service'] for rejection in report['rejections']))
+
+    def test_imsis_are_looked_up_in_chunks(self):
+        chunk_size = connection.features.max_query_params
+        records = [{'imsi': 262010000000000 + i, 'service': 'BN', 'duration': 10, 'data_volume': 1,
+                    'call_seconds': 0} for i in range(2 * chunk_size + 1)]
+        get_catalog()
+        with CaptureQueriesContext(connection) as queries:
+            response = self._post(json.dumps(records), content_type='application/json')
+        self.assertEqual((response.json()['created'], response.json()['rejected']), (3, 2 * chunk_size - 2))
+        lookups = [query['sql'] for query in queries.captured_queries if 'FROM "matsecom_subscriber"' in query['sql']]
+        self.assertEqual(len(lookups), 3)
+
+    def test_too_many_records(self):
+        records = json.dumps([{}] * (MAX_INGEST_RECORDS + 1))
+        response = self._post(records, content_type='application/json')
+        self.assertEqual(response.status_code, 413)
+
+
+class QuotaConcurrencyTest(TransactionTestCase):
+    def setUp(self):
+        catalog = seed_catalog()
+        # GS includes 4000 Mbit, an AD session of 10 s at 150 Mbit/s uses 1500 Mbit, so two of them fit
+        self.subscriber_ids = seed_subscribers(catalog, 4)
+        self.service = catalog['services']['AD']
+        Subscriber.objects.update(terminal_type=catalog['terminals'][1], subscription_type=catalog['subscriptions'][0])
+
+    # runs target(*args) in one thread per entry of args_list and returns the exceptions raised by the threads
+    @staticmethod
+    def _run_threads(target, args_list: list) -> list:
+        errors = []
+
+        def run(*args):
+            try:
+                target(*args)
+            except Exception as error:  # reported by the main thread
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=args) for args in args_list]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    # simulates five AD sessions one by one for the subscriber and appends the results to results
+    def _simulate_single_sessions(self, results: list, subscriber_id: int):
+        subscriber = Subscriber.objects.get(pk=subscriber_id)
+        for _ in range(5):
+            results.append(_simulate_session(subscriber, self.service, 10, THROUGHPUT_CHOOSERS['maximum']))
+
+    # asserts that exactly two sessions per subscriber were accepted and that the counters match them
+    def _assert_quota_held(self, results: list):
+        self.assertEqual(results.count(""), 8)
+        for subscriber_id in self.subscriber_ids:
+            self.assertEqual(Session.objects.filter(subscriber_id=subscriber_id).count(), 2)
+        self.assertEqual(reconcile_usage_counters(fix=False), [])
+
+    def test_concurrent_simulations_never_exceed_the_quota(self):
+        results = []
+        errors = self._run_threads(self._simulate_single_sessions,
+                                   [(results, self.subscriber_ids[i % 4]) for i in range(16)])
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 80)
+        self._assert_quota_held(results)
+
+    # with write-behind the buffered sessions are reserved the same way, so the quota holds before they are written
+    def test_concurrent_simulations_with_write_behind(self):
+        results = []
+        with tempfile.TemporaryDirectory() as spool_dir, override_settings(
+                SESSION_WRITE_BEHIND=True, SESSION_SPOOL_DIR=spool_dir, SESSION_WRITE_BEHIND_MAX_DELAY_MS=60000):
+            write_behind._buffer = None
+            errors = self._run_threads(self._simulate_single_sessions,
+                                       [(results, self.subscriber_ids[i % 4]) for i in range(16)])
+            self.assertEqual(Session.objects.count(), 0)
+            write_behind.flush()
+            write_behind._buffer = None
+        self.assertEqual(errors, [])
+        self._assert_quota_held(results)
+
+    # batches of the simulation API and single simulations for the same subscribers share the quota
+    def test_concurrent_batch_and_single_simulations(self):
+        results = []
+
+        def simulate(subscriber_id, batch):
+            if batch:
+                subscriber = Subscriber.objects.get(pk=subscriber_id)
+                results.extend(_simulate_sessions([(subscriber, self.service, 10)] * 5,
+                                                  THROUGHPUT_CHOOSERS['maximum']))
+            else:
+                self._simulate_single_sessions(results, subscriber_id)
+
+        errors = self._run_threads(simulate, [(self.subscriber_ids[i % 4], i % 8 >= 4) for i in range(16)])
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 80)
+        self._assert_quota_held(results)
+
+    # invoices settle the sessions that simulations in other threads are creating at the same time
+    def test_concurrent_invoices_and_simulations(self):
+        def work(subscriber_id):
+            subscriber = Subscriber.objects.get(pk=subscriber_id)
+            for _ in range(10):
+                _simulate_session(subscriber, self.service, 1, THROUGHPUT_CHOOSERS['maximum'])
+                invoice(subscriber)
+
+        errors = self._run_threads(work, [(self.subscriber_ids[i % 4],) for i in range(8)])
+        self.assertEqual(errors, [])
+        self.assertEqual(Invoice.objects.count(), 80)
+        self.assertFalse(Session.objects.filter(paid=False).exists())
+        self.assertEqual(reconcile_usage_counters(fix=False), [])
+
+
+# asserts a fixed query budget for a view, independent of the number of rows in the database
+class QueryBudgetMixin:
+    # requests url (and consumes streamed responses) with the current rows and again after each grow() call,
+    # failing if any of the requests needs more than budget queries
+    def assertQueryBudget(self, url, budget: int, grow, rounds: int = 2):
+        for i in range(rounds + 1):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertLessEqual(
+                len(queries), budget,
+                f"{url} needed {len(queries)} queries, budget is {budget}:\n" +
+                "\n".join(query['sql'] for query in queries.captured_queries)
+            )
+            if i < rounds:
+                grow()
+
+
+class ViewQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.terminals = [Terminal.objects.create(name=name) for name in ('PhairPhone', 'Samsung S42plus')]
+        self.subscriptions = [
+            Subscription.objects.create(name=name, basic_fee=800, minutes_included=0, price_per_extra_minute=8,
+                                        data_volume_3g_4g=500)
+            for name in ('GS', 'GM')
+        ]
+        self.service = Service.objects.create(name='BN', ran_technologies='3G4G', required_data_rate=2)
+        self.imsi = 262010000000000
+        self.grow()
+        self.subscriber = Subscriber.objects.first()
+        self.invoice = invoice(self.subscriber)
+        self.client.force_login(User.objects.create_user('operator'))
+        # the budgets are for a warm reference data catalog
+        get_catalog()
+
+    # adds subscribers with different terminals/subscriptions and sessions with their own subscribers
+    def grow(self, count: int = 10):
+        for i in range(count):
+            subscriber = Subscriber.objects.create(
+                forename='Test', surname='Dummy', imsi=self.imsi, terminal_type=self.terminals[i % 2],
+                subscription_type=self.subscriptions[i % 2]
+            )
+            self.imsi += 1
+            Session.objects.create(subscriber=subscriber, service=self.service, duration=1, data_volume=5,
+                                   call_seconds=0)
+
+    def test_list_views(self):
+        self.assertQueryBudget('/subscribers/?action=data&length=100', 5, self.grow)
+        self.assertQueryBudget('/sessions/?action=data&length=100', 5, self.grow)
+        self.assertQueryBudget('/subscribers/?action=download', 3, self.grow)
+
+    def test_detail_views(self):
+        self.assertQueryBudget(f'/subscribers/{self.subscriber.pk}/', 3, self.grow)
+        self.assertQueryBudget(f'/invoice/{self.invoice.pk}/', 3, self.grow)
+
+    def test_forms_with_subscriber_choices(self):
+        self.assertQueryBudget('/invoice/', 3, self.grow)
+        self.assertQueryBudget('/sessions/simulate', 4, self.grow)
+
+
+# fails if a query on one of the big tables is answered with a full table scan, so a missing or unusable index
+# shows up before the tables are large. The plans are SQLite's (EXPLAIN QUERY PLAN)
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite specific")
+class QueryPlanTest(TestCase):
+    TABLES = (Session._meta.db_table, SessionArchive._meta.db_table, Invoice._meta.db_table)
+
+    def setUp(self):
+        catalog = seed_catalog()
+        self.subscriber_ids = seed_subscribers(catalog, 20)
+        service = Service.objects.get(name='BN')
+        Session.objects.bulk_create([
+            Session(subscriber_id=subscriber_id, service=service, duration=1, data_volume=5, call_seconds=0,
+                    paid=i % 2 == 0)
+            for i, subscriber_id in enumerate(self.subscriber_ids * 5)
+        ])
+        self.subscriber = Subscriber.objects.get(pk=self.subscriber_ids[0])
+
+    # runs func and returns (sql, plan lines) of the queries it sent
+    def _plans(self, func) -> list:
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE')):
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append((query['sql'], [row[3] for row in cursor.fetchall()]))
+        self.assertTrue(plans)
+        return plans
+
+    def assertNoFullTableScan(self, func):
+        # reading all of a partial index (the unpaid sessions) is fine, reading all of any other index is not
+        partial_indexes = [index.name for index in Session._meta.indexes if index.condition is not None]
+        for sql, plan in self._plans(func):
+            for line in plan:
+                full_scan = line.startswith(tuple(f'SCAN {table}' for table in self.TABLES)) and \
+                    not any(f'INDEX {name}' in line for name in partial_indexes)
+                self.assertFalse(full_scan, f"{sql}\n" + "\n".join(plan))
+
+    def test_usage_queries(self):
+        self.assertNoFullTableScan(lambda: get_unpaid_usage(self.subscriber))
+        self.assertNoFullTableScan(lambda: reconcile_usage_counters(fix=False))
+
+    def test_invoicing_queries(self):
+        self.assertNoFullTableScan(lambda: invoice(self.subscriber))
+        cycle = get_or_start_billing_cycle('2026-10')
+        self.assertNoFullTableScan(lambda: settle_chunk(cycle.pk, self.subscriber_ids[1:10]))
+        self.assertNoFullTableScan(
+            lambda: list(Invoice.objects.filter(subscriber=self.subscriber).order_by('-timestamp')[:10]))
+
+    # the session list searched by IMSI (without a search term it pages through all sessions anyway)
+    def test_session_list_queries(self):
+        sessions = SessionHistory().filter(subscriber__imsi=self.subscriber.imsi)
+        self.assertNoFullTableScan(lambda: sessions.count())
+        self.assertNoFullTableScan(lambda: sessions.order_by('-timestamp', 'pk')[0:10])
+        self.assertNoFullTableScan(lambda: sessions.order_by('-data_volume', 'pk')[0:10])
+
+
+class RequestMetricsTest(TestCase):
+    TOKEN = 'test-metrics-token'
+
+    def setUp(self):
+        metrics.clear()
+        terminal = Terminal.objects.create(name='PhairPhone')
+        subscription = Subscription.objects.create(name='GS', basic_fee=800, minutes_included=0,
+                                                   price_per_extra_minute=8, data_volume_3g_4g=500)
+        Subscriber.objects.bulk_create([
+            Subscriber(forename='Test', surname=f'Dummy{i}', imsi=262010000000000 + i, terminal_type=terminal,
+                       subscription_type=subscription)
+            for i in range(20)
+        ])
+        self.user = User.objects.create_user('operator')
+
+    def _metrics(self, **kwargs):
+        with override_settings(METRICS_TOKENS=[self.TOKEN]):
+            return self.client.get('/metrics', **kwargs)
+
+    def test_server_timing_and_histograms(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/subscribers/?action=data&length=10')
+        self.assertEqual(response.status_code, 200)
+        timings = {entry.split(';')[0]: entry for entry in response['Server-Timing'].split(', ')}
+        self.assertEqual(set(timings), {'sql', 'python', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timings['sql'])
+
+        text = metrics.render()
+        self.assertIn('dawn_http_request_duration_seconds_count{view="subscriber_list",method="GET"} 1', text)
+        self.assertIn(f'dawn_http_request_queries_sum{{view="subscriber_list"}} {len(queries)}', text)
+        self.assertIn(f'dawn_http_response_size_bytes_sum{{view="subscriber_list"}} {len(response.content)}', text)
+        self.assertIn('dawn_http_request_queries_bucket{view="subscriber_list",le="+Inf"} 1', text)
+        self.assertIn('dawn_http_responses_total{view="subscriber_list",status="200"} 1', text)
+
+    # the body of the CSV export is only read from the database while it is streamed
+    def test_streaming_response(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/subscribers/?action=download')
+        self.assertNotIn('view="subscriber_list"', metrics.render())
+        content = b''.join(response.streaming_content)
+        text = metrics.render()
+        self.assertIn(f'dawn_http_response_size_bytes_sum{{view="subscriber_list"}} {len(content)}', text)
+        self.assertIn('dawn_http_request_queries_sum{view="subscriber_list"} 3', text)  # session, user, subscribers
+
+    def test_view_label_is_the_url_name(self):
+        request = RequestFactory().get('/subscribers/')
+        self.assertEqual(RequestMetricsMiddleware._view_name(request), 'subscriber_list')
+        request.resolver_match = ResolverMatch(MetricsView.as_view(), (), {}, namespaces=['admin'], url_name='index')
+        self.assertEqual(RequestMetricsMiddleware._view_name(request), 'admin:index')
+        # patterns without a name don't leak the view's module path into the labels
+        request.resolver_match = ResolverMatch(MetricsView.as_view(), (), {})
+        self.assertEqual(RequestMetricsMiddleware._view_name(request), 'unnamed')
+        self.assertEqual(RequestMetricsMiddleware._view_name(RequestFactory().get('/nowhere/')), 'unmatched')
+
+    def test_histogram_buckets_are_cumulative(self):
+        for queries in [1, 3, 3, 2000]:
+            metrics.REQUEST_QUERIES.observe(queries, view='test')
+        text = metrics.render()
+        self.assertIn('dawn_http_request_queries_bucket{view="test",le="1"} 1', text)
+        self.assertIn('dawn_http_request_queries_bucket{view="test",le="2"} 1', text)
+        self.assertIn('dawn_http_request_queries_bucket{view="test",le="5"} 3', text)
+        self.assertIn('dawn_http_request_queries_bucket{view="test",le="1000"} 3', text)
+        self.assertIn('dawn_http_request_queries_bucket{view="test",le="+Inf"} 4', text)
+        self.assertIn('dawn_http_request_queries_count{view="test"} 4', text)
+        with self.assertRaises(ValueError):
+            metrics.REQUEST_QUERIES.observe(1)
+
+    def test_metrics_endpoint_access(self):
+        self.assertRedirects(self._metrics(), '/login/', fetch_redirect_response=False)
+        self.assertRedirects(self._metrics(HTTP_AUTHORIZATION='Bearer wrong'), '/login/',
+                             fetch_redirect_response=False)
+        response = self._metrics(HTTP_AUTHORIZATION=f'Bearer {self.TOKEN}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE dawn_http_request_duration_seconds histogram', response.content.decode())
+
+        self.client.force_login(self.user)
+        self.assertEqual(self._metrics().status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self._metrics()
+        self.assertEqual(response.status_code, 200)
+        # the redirects to the login page above, before any view was called
+        self.assertIn('dawn_http_responses_total{view="metrics",status="302"} 2', response.content.decode())
+
+
+def _count_invoices_in_child():
+    metrics.INVOICES.inc(2, run='invoice')
+    metrics.flush()
+
+
+class BusinessMetricsTest(TestCase):
+    def setUp(self):
+        metrics.clear()
+        self.catalog = seed_catalog()
+        self.services = self.catalog['services']
+        self.phair_phone, self.s42plus = Subscriber.objects.order_by('pk').filter(
+            pk__in=seed_subscribers(self.catalog, 2))
+        data_stick = Terminal.objects.create(name='DataStick')
+        data_stick.supported_technologies.set(Technology.objects.filter(name='3G'))
+        self.data_stick = Subscriber.objects.create(forename='Data', surname='Stick', imsi=262019999999999,
+                                                    terminal_type=data_stick,
+                                                    subscription_type=self.catalog['subscriptions'][0])
+
+    def test_simulation_outcomes(self):
+        simulate = lambda subscriber, service, duration: _simulate_session(
+            subscriber, self.services[service], duration, _maximum_throughput_chooser_from_catalog)
+        self.assertEqual(simulate(self.phair_phone, 'VC', 60), "")
+        self.assertEqual(simulate(self.s42plus, 'BN', 10), "")
+        self.assertEqual(simulate(self.data_stick, 'VC', 60), "calling not possible")
+        self.assertEqual(simulate(self.phair_phone, 'AV', 60), "not enough bandwidth")
+        self.assertEqual(simulate(self.phair_phone, 'BN', 100000), "not enough data volume")
+        self.assertEqual(_simulate_sessions([(self.s42plus, self.services['BN'], 10)],
+                                            _maximum_throughput_chooser_from_catalog), [""])
+
+        text = metrics.render()
+        self.assertIn('dawn_sessions_simulated_total{outcome="created",service="VC",technology="2G"} 1', text)
+        self.assertIn('dawn_sessions_simulated_total{outcome="created",service="BN",technology="4G"} 2', text)
+        self.assertIn('dawn_sessions_simulated_total{outcome="calling not possible",service="VC",technology="none"} 1',
+                      text)
+        self.assertIn('dawn_sessions_simulated_total{outcome="not enough bandwidth",service="AV",technology="3G"} 1',
+                      text)
+        self.assertIn(
+            'dawn_sessions_simulated_total{outcome="not enough data volume",service="BN",technology="3G"} 1', text)
+
+    def test_invoices_and_billing_runs(self):
+        invoice(self.phair_phone)
+        call_command('run_billing_cycle', cycle='2026-10', workers=1, stdout=StringIO())
+        text = metrics.render()
+        self.assertIn('dawn_invoices_total{run="invoice"} 1', text)
+        self.assertIn('dawn_invoices_total{run="cycle"} 3', text)
+        self.assertIn('dawn_billing_run_duration_seconds_count{run="invoice"} 1', text)
+        self.assertIn('dawn_billing_run_duration_seconds_count{run="cycle"} 1', text)
+
+    def test_csv_rows(self):
+        load_from_csv('forename,surname,imsi,terminal_type,subscription_type\n'
+                      'New,Subscriber,262020000000000,PhairPhone,GS\n'
+                      'New,Subscriber,262020000000001,PhairPhone,GS\n'
+                      f'Old,Subscriber,{self.phair_phone.imsi},PhairPhone,GS\n'
+                      'Bad,Subscriber,262020000000002,Unknown,GS\n')
+        text = metrics.render()
+        self.assertIn('dawn_csv_rows_imported_total{result="created"} 2', text)
+        self.assertIn('dawn_csv_rows_imported_total{result="skipped"} 1', text)
+        self.assertIn('dawn_csv_rows_imported_total{result="failed"} 1', text)
+
+    # a forked process writes its own values, the parent's values it inherited are not counted twice
+    def test_values_are_shared_between_processes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIRECTORY=directory):
+            metrics.INVOICES.inc(run='invoice')
+            child = multiprocessing.get_context('fork').Process(target=_count_invoices_in_child)
+            child.start()
+            child.join()
+            self.assertEqual(child.exitcode, 0)
+            self.assertIn('dawn_invoices_total{run="invoice"} 3', metrics.render())
+            self.assertEqual(len(os.listdir(directory)), 1)  # only the child has written its file yet
+            metrics.clear()
+            self.assertIn('# TYPE dawn_invoices counter\n# HELP', metrics.render())
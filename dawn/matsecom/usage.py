@@ -0,0 +1,184 @@
+import math
+from typing import NamedTuple
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Session, Subscriber, Subscription, UsageCounter
+
+
+class UsageSummary(NamedTuple):
+    data_volume: int  # Mbit
+    call_seconds: int
+
+
+# sums up the unpaid sessions of a subscriber in the database
+# session fields are not encrypted, so this is a single aggregate query on the subscriber's sessions
+def get_unpaid_usage(subscriber: Subscriber) -> UsageSummary:
+    totals = Session.objects.filter(subscriber=subscriber, paid=False).aggregate(
+        data_volume=Coalesce(Sum('data_volume'), 0),
+        call_seconds=Coalesce(Sum('call_seconds'), 0)
+    )
+    return UsageSummary(totals['data_volume'], totals['call_seconds'])
+
+
+# returns the running usage of the subscriber's current billing period from its UsageCounter (single-row read)
+def get_running_usage(subscriber: Subscriber) -> UsageSummary:
+    counter = UsageCounter.objects.filter(subscriber=subscriber).values_list('data_volume', 'call_seconds').first()
+    if counter is None:
+        # no session since the last reconciliation
+        return UsageSummary(0, 0)
+    return UsageSummary(*counter)
+
+
+# adds the usage of a new unpaid session to the subscriber's counter
+def record_usage(subscriber_id: int, data_volume: int, call_seconds: int):
+    updated = UsageCounter.objects.filter(subscriber_id=subscriber_id).update(
+        data_volume=F('data_volume') + data_volume,
+        call_seconds=F('call_seconds') + call_seconds
+    )
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            UsageCounter.objects.create(subscriber_id=subscriber_id, data_volume=data_volume,
+                                        call_seconds=call_seconds)
+    except IntegrityError:
+        # created concurrently in the meantime
+        record_usage(subscriber_id, data_volume, call_seconds)
+
+
+# adds usage to the subscriber's counter if the counter's data volume is at most max_data_volume (None: no limit)
+# check and increase are one conditional UPDATE, which takes the row lock, so two concurrent reservations can never
+# both pass the check. Must run in the transaction that creates the session (or, with write-behind, before the
+# session is buffered). This is the only place where simulated sessions take data volume from the quota, for single
+# simulations, batches and the write-behind buffer alike
+# returns whether the usage was added
+def reserve_usage(subscriber_id: int, usage: UsageSummary, max_data_volume: int = None) -> bool:
+    if _reserve_counted_usage(subscriber_id, usage, max_data_volume):
+        return True
+    if max_data_volume is not None and max_data_volume < 0 \
+            or UsageCounter.objects.filter(subscriber_id=subscriber_id).exists():
+        return False
+    # first session since the last reconciliation
+    create_usage_counters([subscriber_id])
+    return _reserve_counted_usage(subscriber_id, usage, max_data_volume)
+
+
+# reserve_usage for a subscriber whose counter exists
+def _reserve_counted_usage(subscriber_id: int, usage: UsageSummary, max_data_volume: int = None) -> bool:
+    if max_data_volume is not None and max_data_volume < 0:
+        return False
+    counters = UsageCounter.objects.filter(subscriber_id=subscriber_id)
+    if max_data_volume is not None:
+        counters = counters.filter(data_volume__lte=max_data_volume)
+    return counters.update(data_volume=F('data_volume') + usage.data_volume,
+                           call_seconds=F('call_seconds') + usage.call_seconds) == 1
+
+
+# creates empty counters for the subscribers that have none, ignoring concurrently created ones
+def create_usage_counters(subscriber_ids):
+    UsageCounter.objects.bulk_create([UsageCounter(subscriber_id=subscriber_id) for subscriber_id in subscriber_ids],
+                                     ignore_conflicts=True)
+
+
+# record_usage for many sessions at once, usages maps subscriber ids to the UsageSummary to add
+# missing counters are created empty first (ignoring concurrently created ones), then every counter is increased
+# with an executemany of the same UPDATE, which is much cheaper to build than one UPDATE with a CASE per subscriber
+def record_usages(usages: dict):
+    if not usages:
+        return
+    create_usage_counters(usages)
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {quote_name(UsageCounter._meta.db_table)} "
+            f"SET {quote_name('data_volume')} = {quote_name('data_volume')} + %s, "
+            f"{quote_name('call_seconds')} = {quote_name('call_seconds')} + %s "
+            f"WHERE {quote_name('subscriber_id')} = %s",
+            [(usage.data_volume, usage.call_seconds, subscriber_id) for subscriber_id, usage in usages.items()]
+        )
+
+
+# record_usages for sessions created with bulk_create, which doesn't send post_save (see signals.py)
+def record_sessions_usage(sessions):
+    usages = {}
+    for session in sessions:
+        if session.paid:
+            continue
+        usage = usages.get(session.subscriber_id, UsageSummary(0, 0))
+        usages[session.subscriber_id] = UsageSummary(usage.data_volume + int(session.data_volume),
+                                                     usage.call_seconds + session.call_seconds)
+    record_usages(usages)
+
+
+# removes settled (or deleted) usage from the subscriber's counter
+# sessions created after the settled ones stay counted
+def settle_usage(subscriber_id: int, usage: UsageSummary, new_period: bool = True):
+    settle_usages({subscriber_id: usage}, new_period)
+
+
+# settle_usage for many subscribers at once, usages maps subscriber ids to their settled UsageSummary
+# all counters are reduced with a single UPDATE
+def settle_usages(usages: dict, new_period: bool = True):
+    if not usages:
+        return
+    changes = {}
+    for field_name in UsageSummary._fields:
+        settled = Case(*[When(subscriber_id=subscriber_id, then=Value(getattr(usage, field_name)))
+                         for subscriber_id, usage in usages.items()], default=Value(0))
+        changes[field_name] = F(field_name) - settled
+    if new_period:
+        changes['period_start'] = timezone.now()
+    UsageCounter.objects.filter(subscriber_id__in=list(usages)).update(**changes)
+
+
+# recomputes all counters from the unpaid sessions
+# returns a list of (subscriber_id, counter usage, session usage) for every counter that had drifted
+# with fix=False the counters are only compared, not rewritten
+def reconcile_usage_counters(fix: bool = True) -> list:
+    actual = {
+        row['subscriber_id']: UsageSummary(row['data_volume'], row['call_seconds'])
+        for row in Session.objects.filter(paid=False).values('subscriber_id').annotate(
+            data_volume=Sum('data_volume'), call_seconds=Sum('call_seconds')).order_by()
+    }
+    counters = {
+        row[0]: UsageSummary(row[1], row[2])
+        for row in UsageCounter.objects.values_list('subscriber_id', 'data_volume', 'call_seconds')
+    }
+    drifts = []
+    for subscriber_id in sorted(actual.keys() | counters.keys()):
+        expected = actual.get(subscriber_id, UsageSummary(0, 0))
+        counted = counters.get(subscriber_id, UsageSummary(0, 0))
+        if expected != counted:
+            drifts.append((subscriber_id, counted, expected))
+    if fix:
+        with transaction.atomic():
+            for subscriber_id, counted, expected in drifts:
+                UsageCounter.objects.update_or_create(
+                    subscriber_id=subscriber_id,
+                    defaults={'data_volume': expected.data_volume, 'call_seconds': expected.call_seconds}
+                )
+    return drifts
+
+
+# returns (dataVolume, minutes, charges)
+# does not check if used data exceeds the included data volume
+def rate_usage(usage: UsageSummary, subscription: Subscription) -> (int, int, int):
+    charges = subscription.basic_fee
+    call_minutes = get_call_minutes_from_seconds(usage.call_seconds)
+    if call_minutes > subscription.minutes_included:
+        charges += (call_minutes - subscription.minutes_included) * subscription.price_per_extra_minute
+    return usage.data_volume, call_minutes, charges
+
+
+# returns the number of call minutes for a given duration in seconds
+# rounds up to the next minute
+def get_call_minutes_from_seconds(sec: int) -> int:
+    return math.ceil(sec / 60)
+
+
+def get_mb_from_mbit(mbit: int) -> int:
+    return math.ceil(mbit / 8)
@@ -1,18 +1,37 @@
 import csv
 import io
-import math
-
-from django.core.files.storage import default_storage
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+import json
+import time
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.formats import date_format
 from django.contrib import messages
 from django.views.generic import View, TemplateView, FormView, DetailView, DeleteView
 from django.views.generic.edit import CreateView
 from django.views.generic.list import ListView
 
-from .forms import SubscriberForm, SessionForm, InvoiceForm, UploadCSVForm
-from .models import Invoice, Subscriber, Session, Service, Subscription, Terminal
+from .forms import SubscriberForm, SessionForm, InvoiceForm, UploadCSVForm, SubscriberSearchForm, SimulationItemForm
+from .models import ImportJob, Invoice, Subscriber, Session, Service, Subscription, Terminal
+from . import catalog, metrics, write_behind
+from .api import ApiError, ApiTokenMixin, has_valid_token, parse_records
+from .archive import SessionHistory
+from .billing import settle_subscriber
+from .datatables import datatables_response
+from .import_jobs import queue_import
+from .pgcrypto import names_in_database
+from .session_ingest import MAX_INGEST_RECORDS, ingest_sessions
+from .subscriber_import import ImportReport, import_subscribers_csv
+from .db import run_with_retry
+from .usage import UsageSummary, create_usage_counters, reserve_usage, settle_usage
+
+# maximum number of sessions simulated in one request of the batch simulation API
+MAX_SIMULATION_ITEMS = 10000
 
 
 # Create your views here.
@@ -22,6 +41,7 @@ class HomeTemplateView(TemplateView):
 
 class SubscriberListView(ListView):
     model = Subscriber
+    queryset = Subscriber.objects.select_related('terminal_type', 'subscription_type')
     template_name = 'subscribers/subscriber_list.html' # Specify your template location
     context_object_name = 'subscribers' # Name for the list as a template variable
     
@@ -29,34 +49,65 @@ class SubscriberListView(ListView):
         action = request.GET.get('action')
         if action == 'download':
             return self.get_csv(request, *args, **kwargs)
+        if action == 'data':
+            return self.get_data(request, *args, **kwargs)
+        # the rows are loaded by the table through get_data
         return super().get(request, *args, **kwargs)
+
+    # rows for the DataTables table. The names are encrypted, they can only be searched (by prefix), and only be
+    # ordered on PostgreSQL, where they are decrypted in the database
+    def get_data(self, request, *args, **kwargs):
+        name_columns = ['forename', 'surname'] if names_in_database() else [None, None]
+        return datatables_response(
+            request,
+            self.get_queryset(),
+            columns=[*name_columns, 'imsi', 'subscription_type__name', 'terminal_type__name'],
+            search=lambda queryset, term: SubscriberSearchForm({'q': term}).filter(queryset),
+            row=lambda subscriber: {
+                'forename': subscriber.forename,
+                'surname': subscriber.surname,
+                'imsi': subscriber.imsi,
+                'subscription_type': str(subscriber.subscription_type),
+                'terminal_type': str(subscriber.terminal_type),
+                'url': reverse('subscriber_detail', args=[subscriber.pk]),
+            }
+        )
     
     def post(self, request, *args, **kwargs):
         if 'csv_file' in request.FILES:
-            csv_file = request.FILES['csv_file']
-            # Save the file temporarily
-            temp_file_path = default_storage.save(csv_file.name, csv_file)
-            # Read the file content
-            with default_storage.open(temp_file_path, 'r') as f:
-                csv_content = f.read()
-            # Import subscribers from the CSV content
-            load_from_csv(csv_content)
-            # Clean up the temporary file
-            default_storage.delete(temp_file_path)
-            return JsonResponse({'status': 'success', 'message': 'Subscribers imported successfully'})
+            # The import runs in the background (manage.py run_import_worker), poll the progress url for its state
+            job = queue_import(request.FILES['csv_file'])
+            return JsonResponse({'status': 'accepted', 'message': 'Subscriber import queued', 'job_id': job.pk,
+                                 'progress_url': reverse('import_job_progress', args=[job.pk])}, status=202)
         else:
             return JsonResponse({'status': 'error', 'message': 'No file uploaded'})
         
     def get_csv(self, request, *args, **kwargs):
-        # Generate CSV content
-        csv_content = get_all_subscribers_as_csv()
-        # Create a response with the CSV content
-        response = HttpResponse(csv_content, content_type='text/csv')
+        # Stream the CSV content, so neither the whole table nor the whole file is held in memory
+        response = StreamingHttpResponse(iter_subscribers_csv(), content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename="subscribers.csv"'
         return response
 
+class ImportJobProgressView(DetailView):
+    model = ImportJob
+
+    def render_to_response(self, context, **response_kwargs):
+        job = self.object
+        return JsonResponse({
+            'job_id': job.pk,
+            'status': job.get_status_display().lower(),
+            'rows_processed': job.rows_processed,
+            'rows_created': job.rows_created,
+            'rows_skipped': job.rows_skipped,
+            'rows_failed': job.rows_failed,
+            'rows_per_second': round(job.rows_per_second, 1),
+            'errors': job.errors,
+            'message': job.message,
+        })
+
 class SubscriberDetailView(DetailView):
     model = Subscriber
+    queryset = Subscriber.objects.select_related('terminal_type', 'subscription_type')
     template_name = 'subscribers/subscriber_detail.html' # Pfad zur Template-Datei
 
     def get_context_data(self, **kwargs):
@@ -98,14 +149,47 @@ class CreateInvoiceView(FormView):
 
 class InvoiceDetailView(DetailView):
     model = Invoice
+    queryset = Invoice.objects.select_related('subscriber__subscription_type')
     template_name = 'invoices/invoice_detail.html' # Specify the template name
     context_object_name = 'invoice'
 
 class SessionListView(ListView):
     model = Session
+    queryset = Session.objects.select_related('subscriber', 'service') \
+        .only('timestamp', 'data_volume', 'call_seconds', 'paid', 'subscriber__imsi', 'service__name')
     template_name = 'session/session_list.html' # Specify your template location
     context_object_name = 'sessions' # Name for the list as a template variable
 
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('action') == 'data':
+            return self.get_data(request, *args, **kwargs)
+        # the rows are loaded by the table through get_data
+        return super().get(request, *args, **kwargs)
+
+    # rows for the DataTables table, searchable by IMSI or service
+    # the table shows the archived sessions as well, see archive.SessionHistory
+    def get_data(self, request, *args, **kwargs):
+        return datatables_response(
+            request,
+            SessionHistory(),
+            columns=['imsi', 'service', 'timestamp', 'data_volume', 'call_seconds', 'paid'],
+            search=self.search_sessions,
+            row=lambda session: {
+                'imsi': session['imsi'],
+                'service': session['service'],
+                'timestamp': date_format(timezone.localtime(session['timestamp']), 'DATETIME_FORMAT'),
+                'data_volume': session['data_volume'],
+                'call_seconds': session['call_seconds'],
+                'paid': session['paid'],
+            }
+        )
+
+    @staticmethod
+    def search_sessions(queryset, term: str):
+        if term.isdigit():
+            return queryset.filter(subscriber__imsi=int(term))
+        return queryset.filter(service__name__iexact=term)
+
 class SimulateSessionView(FormView):
     model = Session
     form_class = SessionForm
@@ -127,6 +211,62 @@ class SimulateSessionView(FormView):
         return self.render_to_response(self.get_context_data(form=form))
 
 
+# bulk ingest of sessions from the mediation layer, see session_ingest.py
+# POST a JSON array or NDJSON of up to MAX_INGEST_RECORDS session records with an API token
+class IngestSessionsView(ApiTokenMixin, View):
+    def post(self, request, *args, **kwargs):
+        report = ingest_sessions(parse_records(request, MAX_INGEST_RECORDS))
+        return JsonResponse(report.as_dict(), status=201 if report.created else 200)
+
+
+# batch simulation for load tests and demos, see _simulate_sessions
+# POST {"sessions": [{"subscriber": pk, "service": "BN" or pk, "duration": seconds}, ...], "throughput": "random"}
+# with an API token, throughput names one of THROUGHPUT_CHOOSERS. All items are validated first, the response has
+# the result of _simulate_session for every item
+class SimulateSessionsView(ApiTokenMixin, View):
+    def post(self, request, *args, **kwargs):
+        try:
+            body = json.loads(request.body)
+            items = body['sessions']
+            throughput_chooser = THROUGHPUT_CHOOSERS[body.get('throughput', 'random')]
+        except (ValueError, TypeError, KeyError):
+            raise ApiError(f"expected {{\"sessions\": [...], \"throughput\": one of {list(THROUGHPUT_CHOOSERS)}}}")
+        if not isinstance(items, list) or len(items) > MAX_SIMULATION_ITEMS:
+            raise ApiError(f"sessions must be a list of at most {MAX_SIMULATION_ITEMS} items")
+
+        subscribers = Subscriber.objects.only('terminal_type', 'subscription_type').in_bulk(
+            {item.get('subscriber') for item in items if isinstance(item, dict)
+             and isinstance(item.get('subscriber'), int)})
+        services = catalog.get_services_by_key()
+        sessions = []
+        errors = []
+        for index, item in enumerate(items):
+            form = SimulationItemForm(item if isinstance(item, dict) else {}, subscribers=subscribers,
+                                      services=services)
+            if form.is_valid():
+                sessions.append((form.cleaned_data['subscriber'], form.cleaned_data['service'],
+                                 form.cleaned_data['duration']))
+            else:
+                errors.append({'index': index, 'errors': form.errors.get_json_data()})
+        if errors:
+            return JsonResponse({'error': 'invalid sessions', 'rejections': errors}, status=400)
+
+        results = _simulate_sessions(sessions, throughput_chooser)
+        return JsonResponse({
+            'results': results,
+            'created': results.count(""),
+        })
+
+
+# the request and business metrics in the Prometheus text format, for staff users and for scrapers with one of
+# settings.METRICS_TOKENS (Authorization: Bearer <token>), see metrics.py
+class MetricsView(View):
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_staff and not has_valid_token(request, settings.METRICS_TOKENS):
+            raise PermissionDenied
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def simulate_session(subscriber: Subscriber, service: Service, duration: int):
     return _simulate_session(subscriber, service, duration, lambda x: _get_random_throughput_percentage_for_terminal_technologies(x))
 
@@ -139,139 +279,212 @@ def simulate_session(subscriber: Subscriber, service: Service, duration: int):
 # - "calling not possible" if the subscriber's terminal does not support voice calls
 # - "not enough bandwidth" if the throughput is not sufficient for the service
 # - "not enough data volume" if the subscriber's subscription does not include enough data volume
+# the data volume is checked and reserved on the subscriber's usage counter in the same transaction that creates the
+# session, so concurrent simulations for the same subscriber can't overrun the plan together, see _create_session
+# with settings.SESSION_WRITE_BEHIND the usage is reserved the same way, but the session is buffered instead of
+# inserted right away, see write_behind.py
 def _simulate_session(subscriber: Subscriber, service: Service, duration: int, throughput_chooser) -> str:
-    data_volume = 0
-    call_seconds = 0
+    evaluation = _evaluate_session(subscriber, service, duration, throughput_chooser)
+    result = evaluation.result
+    if result == "":
+        result = _save_session(subscriber, service, duration, evaluation)
+    _count_simulation(result, service, evaluation)
+    return result
+
+
+def _save_session(subscriber: Subscriber, service: Service, duration: int, evaluation) -> str:
+    if write_behind.enabled():
+        usage = UsageSummary(evaluation.data_volume, evaluation.call_seconds)
+        if not run_with_retry(_reserve_session_usage, subscriber, usage, evaluation.max_used_data_volume):
+            return "not enough data volume"
+        try:
+            write_behind.get_buffer().add(Session(subscriber=subscriber, service=service, timestamp=timezone.now(),
+                                                  duration=duration, data_volume=evaluation.data_volume,
+                                                  call_seconds=evaluation.call_seconds))
+        except Exception:
+            # add only raises if the session did not reach the spool, so it is never written and its reservation
+            # is given back
+            run_with_retry(settle_usage, subscriber.pk, usage, new_period=False)
+            raise
+        return ""
+
+    return run_with_retry(_create_session, subscriber, service, duration, evaluation)
+
+
+# reserves the usage of a session that is buffered by write_behind.py, the row is inserted later
+def _reserve_session_usage(subscriber: Subscriber, usage: UsageSummary, max_data_volume: int) -> bool:
+    with transaction.atomic():
+        return reserve_usage(subscriber.pk, usage, max_data_volume)
+
+
+def _count_simulation(result: str, service: Service, evaluation):
+    metrics.SESSIONS_SIMULATED.inc(outcome=result or 'created', service=service.name,
+                                   technology=evaluation.technology or 'none')
+
+
+# creates the session if its data volume still fits into the subscription
+# the check and the increase of the usage counter are one conditional UPDATE (see usage.reserve_usage), which
+# locks the subscriber's counter row until the session is inserted and the transaction commits. Simulations for the
+# same subscriber are serialized this way, other subscribers only wait where the database has no row locks (SQLite,
+# where a busy database is retried by run_with_retry)
+def _create_session(subscriber: Subscriber, service: Service, duration: int, evaluation) -> str:
+    with transaction.atomic():
+        if not reserve_usage(subscriber.pk, UsageSummary(evaluation.data_volume, evaluation.call_seconds),
+                             evaluation.max_used_data_volume):
+            return "not enough data volume"
+        session = Session(
+            subscriber=subscriber,
+            service=service,
+            timestamp=timezone.now(),
+            duration=duration,
+            data_volume=evaluation.data_volume,
+            call_seconds=evaluation.call_seconds,
+            paid=False
+        )
+        session.usage_recorded = True  # already counted by reserve_usage, see signals.py
+        session.save()
+    return ""
 
+
+# simulates many sessions in one transaction, items is a list of tuples (subscriber, service, duration) and
+# throughput_chooser works like for _simulate_session
+# the sessions are evaluated up front, then every accepted one reserves its usage like _create_session does, so the
+# quota covers the batch's earlier sessions and concurrent simulations alike. The sessions are inserted with
+# bulk_create
+# returns the result of _simulate_session for every item
+def _simulate_sessions(items: list, throughput_chooser) -> list:
+    evaluations = [_evaluate_session(subscriber, service, duration, throughput_chooser)
+                   for subscriber, service, duration in items]
+    results = run_with_retry(_create_sessions, items, evaluations)
+    for (subscriber, service, duration), evaluation, result in zip(items, evaluations, results):
+        _count_simulation(result, service, evaluation)
+    return results
+
+
+# the missing usage counters are created up front, so a successful reservation is a single UPDATE
+def _create_sessions(items: list, evaluations: list) -> list:
+    with transaction.atomic():
+        create_usage_counters({subscriber.pk for subscriber, service, duration in items})
+        results = []
+        sessions = []
+        for (subscriber, service, duration), evaluation in zip(items, evaluations):
+            result = evaluation.result
+            if result == "" and not reserve_usage(
+                    subscriber.pk, UsageSummary(evaluation.data_volume, evaluation.call_seconds),
+                    evaluation.max_used_data_volume):
+                result = "not enough data volume"
+            results.append(result)
+            if result == "":
+                sessions.append(Session(subscriber=subscriber, service=service, timestamp=timezone.now(),
+                                        duration=duration, data_volume=evaluation.data_volume,
+                                        call_seconds=evaluation.call_seconds, paid=False))
+        Session.objects.bulk_create(sessions)  # no post_save, the usage is reserved already
+    return results
+
+
+class SessionEvaluation(NamedTuple):
+    result: str  # "calling not possible", "not enough bandwidth" or "" (the data volume is checked with fits())
+    data_volume: int
+    call_seconds: int
+    # the highest running data volume (Mbit) of the subscriber with which the session still fits into the
+    # subscription, None for calls
+    max_used_data_volume: Optional[int]
+    technology: str = ''  # name of the technology the session uses, or the fastest one that was too slow
+
+    def fits(self, used_data_volume: int) -> bool:
+        return self.max_used_data_volume is None or used_data_volume <= self.max_used_data_volume
+
+
+# applies the rules of _simulate_session that don't depend on the subscriber's running usage
+def _evaluate_session(subscriber: Subscriber, service: Service, duration: int, throughput_chooser) \
+        -> SessionEvaluation:
+    # voice support and throughputs are looked up in the terminal's precomputed capabilities, throughputs are
+    # compared in hundredths of Mbit/s
+    capabilities = catalog.get_terminal_capabilities(subscriber.terminal_type_id)
     if service.name == 'VC':
-        calling_possible = False
-        for t in subscriber.terminal_type.supported_technologies.all():
-            if t.voice_call_support:
-                calling_possible = True
-                break
-        if not calling_possible:
-            return "calling not possible"
-        call_seconds = duration
-    else:
-        sessions = _my_database_filter(Session.objects.all(), lambda x: x.subscriber == subscriber and not x.paid)
-        (used_data_volume, used_call_seconds, charges) = _sum_sessions(sessions, subscriber.subscription_type)
-
-        throughput_percentages = throughput_chooser(subscriber.terminal_type)
-        fastest_throughput = throughput_percentages[0]
-        for t in throughput_percentages:
-            if t[0].maximum_throughput * t[1].percentage > fastest_throughput[0].maximum_throughput * \
-                    fastest_throughput[1].percentage:
-                fastest_throughput = t
-        if service.required_data_rate > fastest_throughput[0].maximum_throughput * fastest_throughput[1].percentage:
-            return "not enough bandwidth"
-        data_volume = fastest_throughput[0].maximum_throughput * fastest_throughput[1].percentage * duration
-        if used_data_volume + data_volume > subscriber.subscription_type.data_volume_3g_4g * 8:
-            return "not enough data volume"
+        if not capabilities.voice_call_support:
+            return SessionEvaluation("calling not possible", 0, 0, None)
+        return SessionEvaluation("", 0, duration, None, capabilities.voice_technology)
 
-    Session.objects.create(
-        subscriber=subscriber,
-        service=service,
-        timestamp=timezone.now(),
-        duration=duration,
-        data_volume=data_volume,
-        call_seconds=call_seconds,
-        paid=False
-    )
-    return ""
+    throughput_percentages = throughput_chooser(catalog.get_terminal(subscriber.terminal_type_id))
+    technology, fastest_throughput = capabilities.fastest(throughput_percentages)
+    technology_name = technology.name if technology is not None else ''
+    if catalog.to_hundredths(service.required_data_rate) > fastest_throughput:
+        return SessionEvaluation("not enough bandwidth", 0, 0, None, technology_name)
+    subscription = catalog.get_subscription(subscriber.subscription_type_id)
+    # the session fits if used * 100 + fastest_throughput * duration <= data_volume_3g_4g * 800
+    max_used_data_volume = (subscription.data_volume_3g_4g * 800 - fastest_throughput * duration) // 100
+    return SessionEvaluation("", fastest_throughput * duration // 100, 0, max_used_data_volume, technology_name)
 
 
 # generates invoice for a subscriber
-# returns (surname, dataVolume, minutes, charges)
+# settles the unpaid sessions in one transaction, see billing.settle_subscriber. The transaction reads the sessions
+# before it marks them paid, so on SQLite it fails if another connection writes in the meantime and is retried
+# with settings.SESSION_WRITE_BEHIND the sessions buffered by this process are written first so they are invoiced,
+# sessions still buffered by other processes stay reserved on the counter and go on the next invoice
 def invoice(subscriber: Subscriber) -> Invoice:
-    sessions = _my_database_filter(Session.objects.all(), lambda x: x.subscriber == subscriber and not x.paid)
-    for session in sessions:
-        session.paid = True
-        session.save()
-
-    (data_volume, call_minutes, charges) = _sum_sessions(sessions, subscriber.subscription_type)
-    return Invoice.objects.create(
-        subscriber=subscriber,
-        timestamp=timezone.now,
-        data_volume=_get_mb_from_mbit(data_volume),
-        call_minutes=call_minutes,
-        charges=charges
-    )
+    start = time.perf_counter()
+    if write_behind.enabled():
+        write_behind.flush()
+    result = run_with_retry(settle_subscriber, subscriber)
+    metrics.BILLING_RUN_DURATION.observe(time.perf_counter() - start, run='invoice')
+    metrics.INVOICES.inc(run='invoice')
+    return result
 
 
 def get_all_subscribers_as_csv():
-    subscribers = Subscriber.objects.all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['forename', 'surname', 'imsi', 'terminal_type', 'subscription_type'])
+    return ''.join(iter_subscribers_csv())
+
+
+# pseudo file for csv.writer, writerow() returns the formatted line instead of storing it
+class _Echo:
+    def write(self, value):
+        return value
+
+
+# yields the subscriber CSV in blocks of rows_per_block lines
+# the subscribers are read in chunks together with their terminal and subscription, so memory use and the number of
+# queries don't depend on the size of the table
+def iter_subscribers_csv(rows_per_block: int = 500, chunk_size: int = 2000):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['forename', 'surname', 'imsi', 'terminal_type', 'subscription_type'])
+    subscribers = Subscriber.objects.select_related('terminal_type', 'subscription_type') \
+        .only('forename', 'surname', 'imsi', 'terminal_type__name', 'subscription_type__name') \
+        .order_by('pk').iterator(chunk_size=chunk_size)
+    block = []
     for subscriber in subscribers:
-        writer.writerow([subscriber.forename, subscriber.surname, subscriber.imsi, subscriber.terminal_type.name,
-                         subscriber.subscription_type.name])
-    return output.getvalue()
-
-
-# returns "" if all subscribers were created
-# returns error message otherwise
-def load_from_csv(csv_str: str) -> str:
-    data = io.StringIO(csv_str)
-    reader = csv.reader(data)
-    next(reader)
-    for row in reader:
-        if _my_database_filter(Subscriber.objects.all(), lambda x: x.imsi == int(row[2])):
-            # subscriber already exists
-            continue
-        if not Terminal.objects.get(name=row[3]):
-            return "terminal " + row[3] + " of user " + row[0] + " " + row[1] + " does not exist"
-        if not Subscription.objects.get(name=row[4]):
-            return "subscription " + row[4] + " of user " + row[0] + " " + row[1] + " does not exist"
-        Subscriber.objects.create(
-            forename=row[0],
-            surname=row[1],
-            imsi=row[2],
-            terminal_type=Terminal.objects.get(name=row[3]),
-            subscription_type=Subscription.objects.get(name=row[4])
-        )
-    return ""
+        block.append(writer.writerow([subscriber.forename, subscriber.surname, subscriber.imsi,
+                                      subscriber.terminal_type.name, subscriber.subscription_type.name]))
+        if len(block) >= rows_per_block:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
 
 
-# returns (dataVolume, minutes, charges)
-# does not check if used data exceeds the included data volume
-def _sum_sessions(sessions: list, subscription: Subscription) -> (int, int, int):
-    data_volume = 0
-    call_seconds = 0
-    for session in sessions:
-        data_volume += session.data_volume
-        call_seconds += session.call_seconds
-    charges = subscription.basic_fee
-    call_minutes = _get_call_minutes_from_seconds(call_seconds)
-    if call_minutes > subscription.minutes_included:
-        charges += (call_minutes - subscription.minutes_included) * subscription.price_per_extra_minute
-    return data_volume, call_minutes, charges
+# imports the subscribers of a CSV string, see subscriber_import.import_subscribers_csv
+# returns an ImportReport with the number of created/skipped subscribers and an error per invalid row
+def load_from_csv(csv_str: str) -> ImportReport:
+    return import_subscribers_csv(io.StringIO(csv_str))
 
 
 # returns a list of tuples (technology, throughput_percentage), choosing a random throughput percentage for each
 # technology
+# the choice is made in python from the cached catalog, see catalog.py
 def _get_random_throughput_percentage_for_terminal_technologies(terminal):
-    throughput_percentages = []
-    for technology in terminal.supported_technologies.all():
-        if technology.maximum_throughput is None or technology.achievable_throughput_percentages.count() == 0:
-            continue
-        throughput_percentages.append(
-            (technology, technology.achievable_throughput_percentages.all().order_by('?').first()))
-    return throughput_percentages
-
+    return catalog.choose_random_throughput_percentages(terminal.pk)
 
-# returns the number of call minutes for a given duration in seconds
-# rounds up to the next minute
-def _get_call_minutes_from_seconds(sec: int) -> int:
-    return math.ceil(sec / 60)
 
+# throughput choosers that can be selected by name, e.g. in the batch simulation API
+THROUGHPUT_CHOOSERS = {
+    'random': _get_random_throughput_percentage_for_terminal_technologies,
+    'maximum': lambda terminal: catalog.choose_throughput_percentages(terminal.pk, lambda percentages: percentages[-1]),
+    'minimum': lambda terminal: catalog.choose_throughput_percentages(terminal.pk, lambda percentages: percentages[0]),
+}
 
-def _get_mb_from_mbit(mbit: int) -> int:
-    return math.ceil(mbit / 8)
 
-# because of encryption, the .filter function used by django doesnt work properly, so we use this function instead
-# this is not very performant, but the easiest solution for now. A better solution would be to use something like
-# https://github.com/dcwatson/django-pgcrypto , which handles the encryption in the database itself and not in the
-# django code and thus keeps SQL filters working
+# because of encryption, the .filter function used by django doesnt work properly on SQLite, so we use this function
+# instead. this is not very performant, on PostgreSQL the names are encrypted in the database itself (pgcrypto.py)
+# and SQL filters work
 def _my_database_filter(database_list, evaluation_function):
     return [x for x in database_list if evaluation_function(x)]
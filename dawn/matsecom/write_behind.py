@@ -0,0 +1,249 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from .db import run_with_retry
+from .models import Session, WriteBehindBatch
+from .usage import record_sessions_usage
+
+# Optional write-behind mode for the sessions created by the simulator (settings.SESSION_WRITE_BEHIND).
+# On SQLite every Session.objects.create is its own write transaction and concurrent workers serialize on the
+# database lock. In write-behind mode an accepted session only reserves its usage on the subscriber's UsageCounter
+# right away (the same conditional UPDATE as without write-behind, see usage.reserve_usage), so the quota checks of
+# all processes see it. The session rows are collected in a per-process buffer and inserted in one transaction every
+# SESSION_WRITE_BEHIND_MAX_RECORDS sessions or SESSION_WRITE_BEHIND_MAX_DELAY_MS milliseconds, whichever comes first.
+#
+# Every buffered session is appended to a spool segment in SESSION_SPOOL_DIR before it is acknowledged, so a crashed
+# process loses nothing: recover_spool() (run when a buffer is created and by manage.py recover_session_spool) writes
+# the segments of dead processes. The segment name is stored as a WriteBehindBatch in the same transaction as its
+# sessions, so a segment is written exactly once even if the process died between the commit and deleting the file.
+# A live buffer holds an exclusive lock on its open segment, which is how recovery tells them apart. A process that
+# dies between reserving the usage and spooling the session leaves the counter too high (never too low), which
+# manage.py reconcile_usage_counters corrects.
+
+SPOOL_SUFFIX = '.ndjson'
+
+logger = logging.getLogger(__name__)
+
+
+def enabled() -> bool:
+    return getattr(settings, 'SESSION_WRITE_BEHIND', False)
+
+
+class SessionBuffer:
+    def __init__(self, spool_dir, max_records: int = 500, max_delay_ms: int = 200, fsync: bool = False):
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.max_records = max_records
+        self.max_delay = max_delay_ms / 1000
+        self.fsync = fsync
+        # held while a session is added and while a batch is written
+        self.lock = threading.RLock()
+        self._records = []
+        self._segment = None
+        self._segment_name = None
+        self._timer = None
+        self._unwritten = []  # (segment name, open file, records) whose write failed, retried on the next flush
+
+    # buffers an unsaved, unpaid session whose usage has been reserved, it is durable in the spool when add returns
+    # add only raises if the session did not reach the spool, i.e. it will never be written. Once it is spooled,
+    # failing to write the buffer to the database is logged and retried by the timer, the session stays in the spool
+    def add(self, session: Session):
+        record = {
+            'subscriber_id': session.subscriber_id,
+            'service_id': session.service_id,
+            'timestamp': session.timestamp.isoformat(),
+            'duration': session.duration,
+            'data_volume': int(session.data_volume),
+            'call_seconds': session.call_seconds,
+            'usage_reserved': True,
+        }
+        with self.lock:
+            if self._segment is None:
+                self._open_segment()
+            try:
+                self._segment.write(json.dumps(record) + '\n')
+                self._segment.flush()
+                if self.fsync:
+                    os.fsync(self._segment.fileno())
+            except Exception:
+                # a partly written line must stay the last one of its segment, where it is skipped on recovery
+                self._close_segment()
+                raise
+            self._records.append(record)
+            if len(self._records) >= self.max_records:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Writing buffered sessions failed, they stay in the spool and are retried")
+                    self._schedule_flush()
+            else:
+                self._schedule_flush()
+
+    # writes the buffered sessions to the database and deletes their spool segment
+    def flush(self):
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._close_segment()
+            while self._unwritten:
+                name, segment, records = self._unwritten[0]
+                if records:
+                    run_with_retry(write_batch, name, records)
+                # committed, a segment that can't be removed is skipped by write_batch when it is recovered
+                self._unwritten.pop(0)
+                path = self.spool_dir / f'{name}{SPOOL_SUFFIX}'
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    logger.exception("Could not remove the written spool segment %s", path)
+                finally:
+                    segment.close()  # releases the lock
+
+    def _schedule_flush(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_delay, self._flush_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            with self.lock:
+                self._timer = None
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Writing buffered sessions failed, they stay in the spool and are retried")
+                    self._schedule_flush()
+        finally:
+            # the timer thread has its own database connection
+            connection.close()
+
+    # the segment is created under a name recovery doesn't look at and only renamed once it is locked, so a
+    # recovering process never mistakes a new segment for one left behind by a crashed process
+    def _open_segment(self):
+        name = uuid.uuid4().hex
+        path = self.spool_dir / f'{name}{SPOOL_SUFFIX}'
+        temporary = self.spool_dir / f'{name}.tmp'
+        segment = open(temporary, 'a', encoding='utf-8')
+        try:
+            fcntl.flock(segment.fileno(), fcntl.LOCK_EX)
+            os.rename(temporary, path)
+        except Exception:
+            segment.close()
+            os.remove(temporary)
+            raise
+        self._segment, self._segment_name = segment, name
+
+    # hands the open segment and its records over to be written by flush
+    def _close_segment(self):
+        if self._segment is not None:
+            self._unwritten.append((self._segment_name, self._segment, self._records))
+            self._segment = None
+            self._segment_name = None
+            self._records = []
+
+
+# writes the sessions of a spool segment with their WriteBehindBatch in one transaction, does nothing if the
+# segment was written before. The usage of records without usage_reserved (spooled before sessions reserved their
+# usage when they were accepted) is added to the usage counters
+# returns the number of sessions written
+def write_batch(name: str, records: list) -> int:
+    with transaction.atomic():
+        if WriteBehindBatch.objects.filter(name=name).exists():
+            return 0
+        WriteBehindBatch.objects.create(name=name, sessions=len(records))
+        sessions = [
+            Session(subscriber_id=record['subscriber_id'], service_id=record['service_id'],
+                    timestamp=parse_datetime(record['timestamp']), duration=record['duration'],
+                    data_volume=record['data_volume'], call_seconds=record['call_seconds'], paid=False)
+            for record in records
+        ]
+        _insert_sessions(sessions)
+        record_sessions_usage([session for session, record in zip(sessions, records)
+                               if not record.get('usage_reserved')])
+    return len(sessions)
+
+
+# inserts sessions with an executemany, unlike bulk_create it keeps their timestamp (auto_now_add), which is the time
+# the session was accepted and not the time it was written
+def _insert_sessions(sessions: list):
+    fields = [field for field in Session._meta.concrete_fields if not field.primary_key]
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {quote_name(Session._meta.db_table)} "
+            f"({', '.join(quote_name(field.column) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))})",
+            [[field.get_db_prep_save(getattr(session, field.attname), connection) for field in fields]
+             for session in sessions]
+        )
+
+
+# writes the spool segments that are not locked by a live buffer, i.e. left behind by crashed processes
+# returns (segments, sessions) written
+def recover_spool(spool_dir) -> (int, int):
+    segments = 0
+    written = 0
+    for path in sorted(Path(spool_dir).glob(f'*{SPOOL_SUFFIX}')):
+        with open(path, 'r', encoding='utf-8') as segment:
+            try:
+                fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # owned by a live buffer
+            if not path.exists():
+                continue  # flushed by its owner in the meantime
+            records = []
+            for line in segment:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass  # last line of a process that died while writing it, it was never acknowledged
+            written += run_with_retry(write_batch, path.stem, records) if records else 0
+            os.remove(path)
+            segments += 1
+    return segments, written
+
+
+_buffer = None
+_buffer_pid = None
+_buffer_lock = threading.Lock()
+
+
+# returns the buffer of this process, creating it (and recovering left over spool segments) on first use
+def get_buffer() -> SessionBuffer:
+    global _buffer, _buffer_pid
+    with _buffer_lock:
+        if _buffer is None or _buffer_pid != os.getpid():
+            # a forked worker must not share the parent's buffer or spool segment
+            spool_dir = getattr(settings, 'SESSION_SPOOL_DIR', Path(settings.BASE_DIR) / 'spool')
+            _buffer = SessionBuffer(
+                spool_dir,
+                max_records=getattr(settings, 'SESSION_WRITE_BEHIND_MAX_RECORDS', 500),
+                max_delay_ms=getattr(settings, 'SESSION_WRITE_BEHIND_MAX_DELAY_MS', 200),
+                fsync=getattr(settings, 'SESSION_SPOOL_FSYNC', False),
+            )
+            _buffer_pid = os.getpid()
+            recover_spool(spool_dir)
+        return _buffer
+
+
+# flushes the buffer of this process if there is one
+def flush():
+    if _buffer is not None and _buffer_pid == os.getpid():
+        _buffer.flush()
+
+
+atexit.register(flush)